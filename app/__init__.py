@@ -1,17 +1,24 @@
 from flask import Flask
 from utils.neo4jfactory import Neo4jConnection
 from utils.loggerfactory import LoggerFactory
+from utils.schema import ensure_schema
+from utils.syncjobs import SyncJobRunner
+from utils.scheduler import SyncScheduler
+from utils.cache import TTLCache
+from utils.responsecache import ResponseCache
 import os
 
 def create_app():
     app = Flask(__name__)
-    #initialize Logger
-    logger_factory = LoggerFactory()
-    logger = logger_factory.get_logger("app_logger")
-    app.config["LOGGER"] = logger
-
     from dotenv import load_dotenv
     load_dotenv()
+
+    #initialize Logger, records are written by a background thread unless LOG_QUEUE=false
+    logger_factory = LoggerFactory()
+    logger = logger_factory.get_logger("app_logger",
+                                       use_queue=os.getenv('LOG_QUEUE', 'true').lower() == 'true',
+                                       json_format=os.getenv('LOG_FORMAT', 'color') == 'json')
+    app.config["LOGGER"] = logger
     
     DD_ENV = os.getenv('DD_ENV', 'qa')
     if DD_ENV == "dev_local":
@@ -36,11 +43,41 @@ def create_app():
 
             # Add instances to app config
             app.config["NEO4J"] = neo4j_factory
+            app.config["SYNC_RUNNER"] = SyncJobRunner(logger=logger)
+            app.config["READ_CACHE"] = TTLCache(app.config.get("READ_CACHE_MAX_ENTRIES", 10000),
+                                                app.config.get("READ_CACHE_TTL_SECONDS", 300))
+            app.config["LAST_SYNC_CACHE"] = TTLCache(1, app.config.get("READ_CACHE_SYNC_CHECK_SECONDS", 10))
+            if app.config.get("OKTA_RESPONSE_CACHE_PATH"):
+                app.config["OKTA_RESPONSE_CACHE"] = ResponseCache(app.config["OKTA_RESPONSE_CACHE_PATH"])
+
+            # Create constraints and indexes, a failure here must not keep the app from starting
+            if app.config.get("SCHEMA_BOOTSTRAP", True):
+                try:
+                    with neo4j_factory.get_session() as session:
+                        status = ensure_schema(session, logger)
+                    if status["missing"]:
+                        logger.warning(f"Schema objects not online yet: {status['missing']}")
+                except Exception as e:
+                    logger.error(f"Schema bootstrap failed, run 'flask schema init' later. error is {e}")
+
+            # Register CLI commands
+            from .commands import schema_cli, sync_cli
+            app.cli.add_command(schema_cli)
+            app.cli.add_command(sync_cli)
 
             # Import and register blueprints
             from .routes import bp as main_bp
             app.register_blueprint(main_bp)
 
+            # Periodic syncs in server processes, CLI commands trigger their own
+            if app.config.get("SYNC_SCHEDULE_ENABLED", False) and os.getenv("FLASK_RUN_FROM_CLI") != "true":
+                from .routes import schedule_sync
+                scheduler = SyncScheduler(lambda: schedule_sync(app),
+                                          app.config.get("SYNC_SCHEDULE_INTERVAL_MINUTES", 60) * 60,
+                                          app.config.get("SYNC_SCHEDULE_JITTER_SECONDS", 300), logger)
+                scheduler.start()
+                app.config["SYNC_SCHEDULER"] = scheduler
+
             return app
         except Exception as e:
             logger.info(f"An unexpected error occurred while loading the application object .error is  {e}")
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime, timezone
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from utils.schema import ensure_schema, schema_status
+from utils.deltasync import okta_timestamp
+from utils.syncusersutils import save_sync_state
+from utils.reconcile import GraphState
+from utils.pipeline import SyncPipeline
+from utils.snapshot import Snapshot, SnapshotSource
+from utils.syncjobs import SyncJob, SyncSkipped, run_job
+from .routes import _run_sync, make_lease, make_okta_factory, make_writer
+
+schema_cli = AppGroup("schema", help="Manage Neo4j constraints and indexes.")
+
+@schema_cli.command("init")
+def schema_init():
+    """Create missing constraints and indexes."""
+    neo4j_conn = current_app.config["NEO4J"]
+    with neo4j_conn.get_session() as session:
+        status = ensure_schema(session, current_app.config["LOGGER"])
+    click.echo(json.dumps(status, indent=2, default=str))
+
+@schema_cli.command("status")
+def schema_show():
+    """Show constraints, indexes and their population state."""
+    neo4j_conn = current_app.config["NEO4J"]
+    with neo4j_conn.get_session() as session:
+        status = schema_status(session)
+    click.echo(json.dumps(status, indent=2, default=str))
+
+sync_cli = AppGroup("sync", help="Run or replay the Okta to Neo4j synchronization.")
+
+@sync_cli.command("snapshot")
+@click.argument("path")
+@click.option("--users-json", help="Read users from this JSON file instead of Okta, e.g. dummydata/oktausers.json.")
+@click.option("--user-apps-json", help="JSON object of user id -> appLinks, required with --users-json.")
+def sync_snapshot(path, users_json, user_apps_json):
+    """Save active users and their app assignments to a compact snapshot file."""
+    logger = current_app.config["LOGGER"]
+    if users_json:
+        if not user_apps_json:
+            raise click.UsageError("--user-apps-json is required with --users-json")
+        snapshot = Snapshot.from_json(users_json, user_apps_json)
+    else:
+        okta_factory = make_okta_factory()
+        try:
+            snapshot = Snapshot.from_okta(okta_factory, logger)
+        finally:
+            okta_factory.close()
+    snapshot.save(path)
+    click.echo(f"Saved {len(snapshot.users)} users and {len(snapshot.apps)} applications to {path}")
+
+@sync_cli.command("run")
+@click.option("--mode", type=click.Choice(["auto", "full", "incremental"]), default="auto", show_default=True)
+@click.option("--from-snapshot", "snapshot_path", help="Replay this snapshot into Neo4j without calling Okta.")
+@click.option("--profile", is_flag=True, help="Add a per-phase timing report to the result.")
+def sync_run(mode, snapshot_path, profile):
+    """Synchronize Neo4j in the foreground, from Okta or from a snapshot."""
+    if snapshot_path:
+        result = _replay_snapshot(snapshot_path)
+    else:
+        app = current_app._get_current_object()
+        try:
+            result = run_job(SyncJob(mode), lambda job: _run_sync(app, job, mode, profile),
+                             current_app.config["LOGGER"], reraise=True)
+        except SyncSkipped as e:
+            raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2, default=str))
+
+
+def _replay_snapshot(path):
+    """Full sync of the graph against a snapshot, the stored sync cursor is left untouched"""
+    logger = current_app.config["LOGGER"]
+    snapshot = Snapshot.load(path)
+    logger.info(f"Replaying snapshot from {snapshot.created}: {len(snapshot.users)} users, "
+                f"{len(snapshot.apps)} applications")
+    lease = make_lease()
+    if not lease.acquire():
+        raise click.ClickException("A synchronization is already in progress in another process")
+    neo4j_conn = current_app.config["NEO4J"]
+    with lease, neo4j_conn.get_session() as session:
+        writer = make_writer(session, neo4j_conn, logger, lease)
+        state = GraphState.load(session)
+        pipeline = SyncPipeline(SnapshotSource(snapshot), writer, state,
+                                current_app.config.get("SYNC_PIPELINE_QUEUE_SIZE", 4), logger,
+                                max_delete_ratio=current_app.config.get("SYNC_MAX_DELETE_RATIO", 0.2))
+        result = pipeline.run()
+        # A replay leaves the cursor alone, but moves lastSync so the web workers drop their cached reads
+        session.write_transaction(save_sync_state, {"lastSync": okta_timestamp(datetime.now(timezone.utc))})
+    return {"snapshot_created": snapshot.created, **result, "write_timings": writer.timings}
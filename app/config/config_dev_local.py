@@ -1,4 +1,81 @@
 OKTA_BASE_URL="https://paloaltonetworks.oktapreview.com"
 NEO4J_URI="neo4j://0.0.0.0:7687"
 
+# Number of rows sent per Neo4j write transaction
+NEO4J_BATCH_SIZE=1000
 
+# Concurrent per-user appLinks requests (1 = sequential)
+OKTA_MAX_WORKERS=8
+
+# /syncusers?mode=auto runs incremental syncs and falls back to a full resync after this many hours
+FULL_SYNC_INTERVAL_HOURS=24
+# Seconds of Okta system log re-read before the stored cursor on incremental syncs
+SYNC_CURSOR_OVERLAP_SECONDS=300
+
+# Create Neo4j constraints and indexes when the app starts
+SCHEMA_BOOTSTRAP=True
+
+# Overlap Okta fetches and Neo4j writes during full syncs, with this many users pages queued between stages
+SYNC_PIPELINE=True
+SYNC_PIPELINE_QUEUE_SIZE=4
+
+# In-process cache for the read endpoints, keyed by the last successful sync. The worker that ran
+# a sync clears it at once, the others notice the new sync within READ_CACHE_SYNC_CHECK_SECONDS
+READ_CACHE_MAX_ENTRIES=10000
+READ_CACHE_TTL_SECONDS=300
+READ_CACHE_SYNC_CHECK_SECONDS=10
+
+# Users per keyset page streamed by /export
+EXPORT_PAGE_SIZE=1000
+
+# Progress file of the pipelined full sync, an interrupted run resumes from it
+SYNC_CHECKPOINT_PATH="/tmp/userappdb_sync_checkpoint.jsonl"
+
+# Older checkpoints are discarded and the full sync starts over
+SYNC_CHECKPOINT_MAX_AGE_HOURS=12
+
+# Sessions writing USES batches in parallel over user id ranges, 1 writes from a single session
+NEO4J_WRITE_CONCURRENCY=1
+
+# Relationships or nodes removed per inner transaction when deleting departed users and apps
+NEO4J_DELETE_BATCH_SIZE=1000
+
+# A full sync aborts before deleting more than this share of stored users or apps
+SYNC_MAX_DELETE_RATIO=0.2
+
+# Okta client backend, "requests" (threads) or "async" (httpx on one event loop)
+OKTA_CLIENT="requests"
+
+# Okta requests in flight at once with the async client
+OKTA_ASYNC_CONCURRENCY=100
+
+# How full syncs fetch app assignments: "per_user" (appLinks), "per_app" (/apps/{id}/users) or "auto" for fewer requests
+# Both write the same Application nodes, keyed by Okta app id, so "auto" may switch between them from one sync to the next
+OKTA_ASSIGNMENT_STRATEGY="auto"
+
+# Run 'auto' syncs periodically from every server process, the sync lease keeps one running at a time
+SYNC_SCHEDULE_ENABLED=False
+SYNC_SCHEDULE_INTERVAL_MINUTES=60
+
+# Random delay added to each scheduled tick so workers do not all trigger at once
+SYNC_SCHEDULE_JITTER_SECONDS=300
+
+# Seconds a sync lease survives without renewal, a crashed worker frees it after this
+SYNC_LEASE_TTL_SECONDS=300
+
+# Profile every sync (also per run with /syncusers?profile=true): per-call timings, Neo4j counters, report in the response
+SYNC_PROFILE=False
+
+# Add cProfile output of the sync job thread to profiled runs
+SYNC_PROFILE_CPROFILE=False
+
+# Where profiled runs are stored for /syncusers/reports, and how many are kept
+SYNC_PROFILE_DIR="/tmp/userappdb_sync_reports"
+SYNC_PROFILE_KEEP=50
+
+# Mirror Okta groups, memberships and app group assignments on full syncs
+SYNC_GROUPS=True
+
+# SQLite cache of Okta user and appLinks responses, read with conditional requests. Full
+# syncs skip parsing appLinks payloads they already applied. Empty disables the cache
+OKTA_RESPONSE_CACHE_PATH="/tmp/userappdb_okta_cache.sqlite3"
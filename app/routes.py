@@ -1,101 +1,152 @@
-import json
-from flask import Blueprint, current_app
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from flask import Blueprint, Response, current_app, request, stream_with_context, url_for
 import os
-from utils.okta_factory import OktaFactory
-from utils.syncusersutils import assign_app_to_user, cleanup_user_relationships, cleanup_users_and_apps, create_or_update_app, create_or_update_user, remove_duplicate_nodes
+from utils.okta_factory import ASSIGNMENT_STRATEGIES, OktaFactory
+from utils.async_okta_factory import AsyncOktaFactory, httpx
+from utils.syncusersutils import get_app_groups, get_app_users, get_user_apps, get_user_by_email, remove_duplicate_nodes
+from utils.batchwriter import BatchWriter, ParallelBatchWriter, app_key
+from utils.groupsync import sync_groups
+from utils.deltasync import choose_sync_mode, load_sync_state, record_sync, run_incremental_sync
+from utils.reconcile import DeletionCapExceeded, GraphState, apply_delta, check_deletion_cap, diff_graph
+from utils.schema import rekey_applications, uniqueness_enforced
+from utils.pipeline import SyncPipeline
+from utils.checkpoint import SyncCheckpoint
+from utils.synclease import SyncLease
+from utils.syncjobs import SyncSkipped
+from utils.profiling import SyncProfiler, load_reports, save_report
+from utils.metrics import REGISTRY
+from utils.export import stream_csv, stream_ndjson
 bp = Blueprint("main", __name__)
 
 @bp.route("/")
 def index():
     return "Flask (factory pattern) is running inside Docker!"
 
+@bp.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/users/<user_id>/apps")
+def user_apps(user_id):
+    apps = _cached_read(("user_apps", user_id), get_user_apps, user_id)
+    if apps is None:
+        return {"status": "error", "message": f"User {user_id} not found"}, 404
+    return {"user_id": user_id, "applications": apps}
+
+@bp.route("/apps/<app_id>/users")
+def app_users(app_id):
+    users = _cached_read(("app_users", app_id), get_app_users, app_id)
+    if users is None:
+        return {"status": "error", "message": f"Application {app_id} not found"}, 404
+    return {"app_id": app_id, "users": users}
+
+@bp.route("/apps/<app_id>/groups")
+def app_groups(app_id):
+    groups = _cached_read(("app_groups", app_id), get_app_groups, app_id)
+    if groups is None:
+        return {"status": "error", "message": f"Application {app_id} not found"}, 404
+    return {"app_id": app_id, "groups": groups}
+
+@bp.route("/users/by-email/<email>")
+def user_by_email(email):
+    result = _cached_read(("user_email", email), get_user_by_email, email)
+    if result is None:
+        return {"status": "error", "message": f"User with email {email} not found"}, 404
+    return result
+
+@bp.route("/export")
+def export_graph():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return {"status": "error", "message": f"Unknown export format '{export_format}', expected ndjson or csv"}, 400
+    try:
+        page_size = int(request.args.get("page_size", current_app.config.get("EXPORT_PAGE_SIZE", 1000)))
+    except ValueError:
+        return {"status": "error", "message": "page_size must be an integer"}, 400
+    page_size = max(1, min(page_size, 10000))
+    
+    neo4j_conn = current_app.config["NEO4J"]
+    if export_format == "csv":
+        body, mimetype = stream_csv(neo4j_conn, page_size), "text/csv"
+    else:
+        body, mimetype = stream_ndjson(neo4j_conn, page_size), "application/x-ndjson"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=access-graph.{export_format}"})
+
+def _cached_read(key, transaction_function, *args):
+    """
+    Serve a read from the in-process cache, querying Neo4j on a miss
+
+    Entries are keyed by the last successful sync too, so a sync run by another worker
+    retires them within READ_CACHE_SYNC_CHECK_SECONDS.
+    """
+    neo4j_conn = current_app.config["NEO4J"]
+    def load_last_sync():
+        with neo4j_conn.get_session() as session:
+            return load_sync_state(session).get("lastSync")
+    def load():
+        with neo4j_conn.get_session() as session:
+            return session.read_transaction(transaction_function, *args)
+    last_sync = current_app.config["LAST_SYNC_CACHE"].get_or_load("lastSync", load_last_sync)
+    return current_app.config["READ_CACHE"].get_or_load((last_sync,) + key, load)
+
 @bp.route("/syncusers")
 def sync_users():
     logger = None
-    neo4j_conn = None
-    okta_factory = None
     
     try:
-        # Get instances from app config
-        neo4j_conn = current_app.config["NEO4J"]
         logger = current_app.config["LOGGER"]
+        runner = current_app.config["SYNC_RUNNER"]
         
-        logger.info("Starting user synchronization process")
-        
-        # Initialize Okta factory
-        okta_base_url = current_app.config.get("OKTA_BASE_URL")
-        okta_api_token = os.getenv('OKTA_API_TOKEN', '')
+        requested_mode = request.args.get("mode", "auto")
+        if requested_mode not in ("auto", "full", "incremental"):
+            raise ValueError(f"Unknown sync mode '{requested_mode}', expected auto, full or incremental")
+        profile = request.args.get("profile", str(current_app.config.get("SYNC_PROFILE", False))).lower() == "true"
         
-        if not okta_base_url or not okta_api_token:
+        if not current_app.config.get("OKTA_BASE_URL") or not os.getenv('OKTA_API_TOKEN', ''):
             raise ValueError("OKTA_BASE_URL or OKTA_API_TOKEN not configured properly")
         
-        okta_factory = OktaFactory(okta_base_url, okta_api_token)
-        
-        # Step 1: Get all active users from Okta
-        logger.info("Step 1: Fetching all active users from Okta")
-        users = okta_factory.get_all_active_users()
-        logger.info(f"Retrieved {len(users)} active users from Okta")
+        okta_client = current_app.config.get("OKTA_CLIENT", "requests")
+        if okta_client not in ("requests", "async"):
+            raise ValueError(f"Unknown OKTA_CLIENT '{okta_client}', expected requests or async")
+        if okta_client == "async" and httpx is None:
+            raise ValueError("OKTA_CLIENT is async but httpx is not installed")
         
-        # Step 2: Get apps for those specific users
-        logger.info("Step 2: Fetching applications for each user")
-        user_apps = okta_factory.get_apps_for_users(users)
-        logger.info(f"Retrieved applications for {len(user_apps)} users")
+        assignment_strategy = current_app.config.get("OKTA_ASSIGNMENT_STRATEGY", "auto")
+        if assignment_strategy != "auto" and assignment_strategy not in ASSIGNMENT_STRATEGIES:
+            raise ValueError(f"Unknown OKTA_ASSIGNMENT_STRATEGY '{assignment_strategy}', expected auto, per_user or per_app")
         
-        # Prepare data for Neo4j operations
-        user_ids = [user["id"] for user in users]
+        # A sync running in another gunicorn worker or host only shows up through the lease
+        if runner.active is None:
+            lease = make_lease().current()
+            if lease:
+                logger.info(f"Sync lease held by {lease['holder']}, not starting another sync")
+                return {
+                    "status": "error",
+                    "message": "A synchronization is already in progress in another process",
+                    "lease_holder": lease["holder"]
+                }, 409
         
-        # Collect all unique applications
-        all_apps = {}
-        for user_id, apps in user_apps.items():
-            for app in apps:
-                all_apps[app["id"]] = app
+        # The job runs outside this request, hand it the app rather than the request context
+        app = current_app._get_current_object()
+        job, created = runner.submit(lambda job: _run_sync(app, job, requested_mode, profile), requested_mode)
+        if not created:
+            logger.info(f"Sync job {job.id} already in progress, not starting another one")
+            return {
+                "status": "error",
+                "message": "A synchronization is already in progress",
+                "job_id": job.id,
+                "status_url": url_for("main.sync_status", job_id=job.id)
+            }, 409
         
-        app_ids = list(all_apps.keys())
-        logger.info(f"Found {len(app_ids)} unique applications")
-        
-        # Step 3: Create nodes and relationships in Neo4j
-        with neo4j_conn.get_session() as session:
-            logger.info("Step 3: Starting database synchronization")
-            # Remove duplicate nodes first
-            logger.info("Removing duplicate User nodes")
-            session.write_transaction(remove_duplicate_nodes, "User", "id")
-
-            logger.info("Removing duplicate Application nodes")
-            session.write_transaction(remove_duplicate_nodes, "Application", "id")
-            
-            # Step 4: Remove users not received from Okta
-            logger.info("Step 4: Cleaning up users not in Okta")
-            session.write_transaction(cleanup_users_and_apps, user_ids, app_ids)
-            
-            # Clean up old relationships
-            logger.info("Cleaning up old relationships")
-            for user_id, app_list in user_apps.items():
-                app_id_list = [app["id"] for app in app_list]
-                session.write_transaction(cleanup_user_relationships, user_id, app_id_list)
-            
-            # Create or update users
-            logger.info("Creating/updating user nodes")
-            for user in users:
-                session.write_transaction(create_or_update_user, user)
-            
-            # Create or update applications
-            logger.info("Creating/updating application nodes")
-            for app in all_apps.values():
-                session.write_transaction(create_or_update_app, app)
-            
-            # Create relationships between users and apps
-            logger.info("Creating user-application relationships")
-            for user_id, apps in user_apps.items():
-                for app in apps:
-                    session.write_transaction(assign_app_to_user, user_id, app["id"])
-        
-        logger.info("User synchronization completed successfully")
+        logger.info(f"Queued sync job {job.id} (mode {requested_mode})")
         return {
-            "status": "success",
-            "message": "User and Application data synchronized successfully!",
-            "users_processed": len(users),
-            "applications_processed": len(app_ids)
-        }
+            "status": "queued",
+            "message": "User synchronization started",
+            "job_id": job.id,
+            "status_url": url_for("main.sync_status", job_id=job.id)
+        }, 202
         
     except ValueError as ve:
         error_msg = f"Configuration error: {str(ve)}"
@@ -104,12 +155,258 @@ def sync_users():
         return {"status": "error", "message": error_msg}, 400
         
     except Exception as e:
-        error_msg = f"An unexpected error occurred during synchronization: {str(e)}"
+        error_msg = f"An unexpected error occurred while starting synchronization: {str(e)}"
         if logger:
             logger.error(error_msg, exc_info=True)
         return {"status": "error", "message": error_msg}, 500
+
+@bp.route("/syncusers/reports")
+def sync_reports():
+    """Stored profiles of earlier syncs, newest first, for comparing runs"""
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+    directory = current_app.config.get("SYNC_PROFILE_DIR")
+    return {"reports": load_reports(directory, limit) if directory else []}
+
+@bp.route("/syncusers/<job_id>")
+def sync_status(job_id):
+    job = current_app.config["SYNC_RUNNER"].get(job_id)
+    if job is None:
+        return {"status": "error", "message": f"Unknown sync job {job_id}"}, 404
+    return job.to_dict()
+
+
+def _run_sync(app, job, requested_mode, profile=False):
+    """Run one synchronization on the job runner thread and return the result for the job"""
+    okta_factory = None
+    profiler = None
+    
+    with app.app_context():
+        # Single flight across every worker sharing the database
+        lease = make_lease()
+        if not lease.acquire():
+            holder = lease.current()
+            raise SyncSkipped(f"Sync lease held by {holder['holder'] if holder else 'another process'}")
         
-    finally:
-        # Clean up connections
-        if okta_factory:
-            okta_factory.close()
\ No newline at end of file
+        try:
+            neo4j_conn = current_app.config["NEO4J"]
+            logger = current_app.config["LOGGER"]
+            
+            logger.info(f"Starting user synchronization process (job {job.id})")
+            started = datetime.now(timezone.utc)
+            
+            okta_factory = make_okta_factory()
+            if profile:
+                profiler = SyncProfiler(current_app.config.get("SYNC_PROFILE_CPROFILE", False))
+            
+            with profiler or nullcontext(), neo4j_conn.get_session() as session:
+                writer = make_writer(session, neo4j_conn, logger, lease)
+                
+                job.start_phase("load_state")
+                # Deployments that skip the schema bootstrap still need app-keyed Application nodes
+                rekey_applications(session, logger)
+                state = load_sync_state(session)
+                checkpoint = _load_checkpoint(logger)
+                if checkpoint is not None and checkpoint.resuming:
+                    # Finish the interrupted full sync, its cursor dates from when it started
+                    mode = "full"
+                    started = datetime.fromisoformat(checkpoint.started)
+                else:
+                    mode = choose_sync_mode(state, requested_mode,
+                                            current_app.config.get("FULL_SYNC_INTERVAL_HOURS", 24))
+                logger.info(f"Sync mode: {mode} (requested {requested_mode})")
+                
+                result = None
+                if mode == "incremental":
+                    result = run_incremental_sync(session, okta_factory, writer, state, started,
+                                                  current_app.config.get("SYNC_CURSOR_OVERLAP_SECONDS", 300),
+                                                  logger, job)
+                    if result.pop("needs_full_sync"):
+                        mode = "full"
+                        writer.timings.clear()
+                if mode == "full":
+                    if checkpoint is not None and not checkpoint.resuming:
+                        checkpoint.begin(started)
+                    try:
+                        result = _run_full_sync(session, okta_factory, writer, logger, job, checkpoint)
+                    except DeletionCapExceeded:
+                        # The fetched data is suspect, do not resume from it
+                        if checkpoint is not None:
+                            checkpoint.clear()
+                        raise
+                
+                job.start_phase("record_state")
+                lease.check()
+                record_sync(session, mode, started)
+                # A failed run keeps its checkpoint so the next one resumes from it
+                if checkpoint is not None:
+                    checkpoint.clear()
+            
+            # Cached lookups may describe the graph before this sync
+            current_app.config["READ_CACHE"].clear()
+            current_app.config["LAST_SYNC_CACHE"].clear()
+            logger.info("User synchronization completed successfully")
+            response = {
+                "status": "success",
+                "message": "User and Application data synchronized successfully!",
+                "mode": mode,
+                **result,
+                "write_timings": writer.timings
+            }
+            if profiler is not None:
+                response["profile"] = _save_profile(job, mode, profiler, result, logger)
+            return response
+            
+        finally:
+            # Clean up connections
+            if okta_factory:
+                okta_factory.close()
+            lease.release()
+
+
+def _save_profile(job, mode, profiler, result, logger):
+    """Build the timing report of a profiled sync and store it next to earlier ones"""
+    report = {
+        "job_id": job.id,
+        "started": job.started or job.created,
+        "mode": mode,
+        "counts": {name: value for name, value in result.items() if isinstance(value, int)},
+        **profiler.report(job.to_dict()["phase_durations"]),
+    }
+    directory = current_app.config.get("SYNC_PROFILE_DIR")
+    if directory:
+        path = save_report(directory, job.id, report, current_app.config.get("SYNC_PROFILE_KEEP", 50))
+        logger.info(f"Sync profile written to {path}")
+    return report
+
+
+def schedule_sync(app):
+    """Scheduler tick: queue an 'auto' sync unless one is running here or in another process"""
+    with app.app_context():
+        logger = current_app.config["LOGGER"]
+        runner = current_app.config["SYNC_RUNNER"]
+        if runner.active is not None or make_lease().current():
+            logger.info("Scheduled sync skipped, a synchronization is already in progress")
+            return
+        job, created = runner.submit(lambda job: _run_sync(app, job, "auto"), "auto")
+        if created:
+            logger.info(f"Queued scheduled sync job {job.id}")
+
+
+def make_lease():
+    """Cluster-wide sync lease stored in Neo4j"""
+    return SyncLease(current_app.config["NEO4J"].get_session, ttl=current_app.config.get("SYNC_LEASE_TTL_SECONDS", 300),
+                     logger=current_app.config["LOGGER"])
+
+
+def make_okta_factory():
+    """OktaFactory for the sync, backed by the blocking or the asyncio client depending on OKTA_CLIENT"""
+    base_url = current_app.config.get("OKTA_BASE_URL")
+    api_token = os.getenv('OKTA_API_TOKEN', '')
+    if current_app.config.get("OKTA_CLIENT", "requests") == "async":
+        return AsyncOktaFactory(base_url, api_token,
+                                max_concurrency=current_app.config.get("OKTA_ASYNC_CONCURRENCY", 100),
+                                logger=current_app.config["LOGGER"])
+    return OktaFactory(base_url, api_token, max_workers=current_app.config.get("OKTA_MAX_WORKERS", 1),
+                       response_cache=current_app.config.get("OKTA_RESPONSE_CACHE"),
+                       logger=current_app.config["LOGGER"])
+
+
+def make_writer(session, neo4j_conn, logger, lease=None):
+    """BatchWriter for the sync, writing from several pooled sessions when NEO4J_WRITE_CONCURRENCY > 1"""
+    batch_size = current_app.config.get("NEO4J_BATCH_SIZE", 1000)
+    concurrency = current_app.config.get("NEO4J_WRITE_CONCURRENCY", 1)
+    delete_batch_size = current_app.config.get("NEO4J_DELETE_BATCH_SIZE", batch_size)
+    if concurrency > 1:
+        return ParallelBatchWriter(session, neo4j_conn.get_session, batch_size, concurrency,
+                                   logger, delete_batch_size, lease)
+    return BatchWriter(session, batch_size, logger, delete_batch_size, lease)
+
+
+def _load_checkpoint(logger):
+    """Checkpoint of the pipelined full sync, None when checkpointing is disabled"""
+    path = current_app.config.get("SYNC_CHECKPOINT_PATH")
+    if not path or not current_app.config.get("SYNC_PIPELINE", True):
+        return None
+    checkpoint = SyncCheckpoint(path, current_app.config.get("SYNC_CHECKPOINT_MAX_AGE_HOURS", 12))
+    if checkpoint.load() and checkpoint.resuming:
+        logger.info(f"Resuming full sync started {checkpoint.started} after "
+                    f"{checkpoint.committed_chunks} committed chunks ({len(checkpoint.committed_users)} users)")
+    return checkpoint
+
+
+def _run_full_sync(session, okta_factory, writer, logger, job, checkpoint=None):
+    """Fetch every active user and their apps from Okta and write the difference to the graph"""
+    # Duplicates can only exist while the uniqueness constraints are missing
+    job.start_phase("remove_duplicates")
+    if uniqueness_enforced(session):
+        logger.info("Uniqueness constraints present, skipping duplicate removal")
+    else:
+        logger.info("Removing duplicate User nodes")
+        session.write_transaction(remove_duplicate_nodes, "User", "id")
+
+        logger.info("Removing duplicate Application nodes")
+        session.write_transaction(remove_duplicate_nodes, "Application", "id")
+    
+    job.start_phase("load_graph")
+    state = GraphState.load(session)
+    
+    # The last sync's user and assignment counts predict the cost of each fetch strategy
+    job.start_phase("select_strategy")
+    strategy = okta_factory.select_assignment_strategy(current_app.config.get("OKTA_ASSIGNMENT_STRATEGY", "auto"),
+                                                       len(state.users),
+                                                       sum(len(app_ids) for app_ids in state.user_apps.values()))
+    logger.info(f"Fetching app assignments {strategy.replace('_', ' ')}")
+    # A full diff checks every relationship, so payloads applied by the last full sync need no parsing
+    okta_factory.skip_unchanged_links = okta_factory.response_cache is not None
+    
+    if current_app.config.get("SYNC_PIPELINE", True):
+        # Okta pages, appLinks and Neo4j writes overlap instead of running one after another
+        logger.info("Running pipelined fetch and write")
+        job.start_phase("pipeline")
+        pipeline = SyncPipeline(okta_factory, writer, state,
+                                current_app.config.get("SYNC_PIPELINE_QUEUE_SIZE", 4), logger, job, checkpoint,
+                                current_app.config.get("SYNC_MAX_DELETE_RATIO", 0.2))
+        result = {**pipeline.run(), "assignment_strategy": strategy}
+        okta_factory.confirm_cached_responses()
+        return {**result, **_sync_groups(session, okta_factory, writer, logger, job)}
+    
+    # Step 1: Get all active users from Okta
+    logger.info("Step 1: Fetching all active users from Okta")
+    job.start_phase("fetch_users")
+    users = []
+    for page_users in okta_factory.iter_active_user_pages():
+        users.extend(page_users)
+        job.set_counter("users_fetched", len(users))
+    logger.info(f"Retrieved {len(users)} active users from Okta")
+    
+    # Step 2: Get apps for those specific users
+    logger.info("Step 2: Fetching applications for each user")
+    job.start_phase("fetch_apps")
+    user_apps = okta_factory.get_apps_for_users(
+        users, progress_callback=lambda done: job.set_counter("app_links_fetched", done))
+    logger.info(f"Retrieved applications for {len(user_apps)} users")
+    
+    # Step 3: Compare with the stored graph and write only what changed
+    logger.info("Step 3: Reconciling Okta data with the graph")
+    job.start_phase("diff")
+    delta = diff_graph(state, users, user_apps)
+    job.start_phase("write")
+    check_deletion_cap(state, delta, current_app.config.get("SYNC_MAX_DELETE_RATIO", 0.2))
+    counts = apply_delta(writer, delta, logger)
+    okta_factory.confirm_cached_responses()
+    
+    return {
+        "users_processed": len(users),
+        "applications_processed": len({app_key(app) for apps in user_apps.values() for app in apps}),
+        **counts,
+        "assignment_strategy": strategy,
+        **_sync_groups(session, okta_factory, writer, logger, job)
+    }
+
+def _sync_groups(session, okta_factory, writer, logger, job):
+    """Mirror groups, memberships and app-group assignments once users and apps are written"""
+    if not current_app.config.get("SYNC_GROUPS", True):
+        return {}
+    logger.info("Syncing groups, memberships and app group assignments")
+    job.start_phase("groups")
+    return sync_groups(session, okta_factory, writer, logger, job)
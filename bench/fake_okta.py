@@ -0,0 +1,315 @@
+"""
+Local stand-in for the Okta API used by the sync benchmarks
+
+Serves /api/v1/users (with Link pagination), /api/v1/users/{id},
+/api/v1/users/{id}/appLinks, /api/v1/apps, /api/v1/apps/{id}/users,
+/api/v1/apps/{id}/groups, /api/v1/groups, /api/v1/groups/{id}/users and an empty
+/api/v1/logs for N synthetic users, M apps and G groups shaped like dummydata/oktausers.json and dummydata/userapps.json. Responses
+carry ETags and honour If-None-Match. Latency and 429 responses can be injected to exercise the rate limiter.
+
+    python -m bench.fake_okta --users 10000 --apps 300 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+USER_PREFIX = "00u"
+APP_PREFIX = "0oa"
+# appLinks have ids of their own, distinct from the app id in appInstanceId
+LINK_PREFIX = "0ol"
+GROUP_PREFIX = "00g"
+LAST_UPDATED = "2024-01-01T00:00:00.000Z"
+
+
+class FakeOktaData:
+    def __init__(self, users: int, apps: int, apps_per_user: int = 25, seed: int = 7, groups: int = 0):
+        """
+        Deterministic synthetic org, generated on demand so 100k users cost no memory
+
+        Args:
+            users: Number of active users
+            apps: Number of applications
+            apps_per_user: Applications assigned to each user
+            seed: Seed for the assignment shuffle
+            groups: Number of groups, user i is a member of group i % groups and app j
+                is assigned to group j % groups
+        """
+        self.users = users
+        self.apps = apps
+        self.apps_per_user = min(apps_per_user, apps)
+        self.seed = seed
+        self.groups = groups
+        self._app_users = None
+        self._app_users_lock = threading.Lock()
+
+    @staticmethod
+    def user_id(index: int) -> str:
+        return f"{USER_PREFIX}{index:017d}"
+
+    @staticmethod
+    def app_id(index: int) -> str:
+        return f"{APP_PREFIX}{index:017d}"
+
+    @staticmethod
+    def group_id(index: int) -> str:
+        return f"{GROUP_PREFIX}{index:017d}"
+
+    def group(self, index: int) -> dict:
+        return {
+            "id": self.group_id(index),
+            "type": "OKTA_GROUP",
+            "lastUpdated": LAST_UPDATED,
+            "lastMembershipUpdated": LAST_UPDATED,
+            "profile": {"name": f"Group {index}", "description": f"Bench group {index}"},
+        }
+
+    def group_index(self, group_id: str):
+        if not group_id.startswith(GROUP_PREFIX):
+            return None
+        try:
+            index = int(group_id[len(GROUP_PREFIX):])
+        except ValueError:
+            return None
+        return index if 0 <= index < self.groups else None
+
+    def user(self, index: int) -> dict:
+        return {
+            "id": self.user_id(index),
+            "status": "ACTIVE",
+            "created": LAST_UPDATED,
+            "lastLogin": LAST_UPDATED,
+            "lastUpdated": LAST_UPDATED,
+            "profile": {
+                "firstName": f"User{index}",
+                "lastName": "Bench",
+                "email": f"user{index}@example.com",
+                "login": f"user{index}@example.com",
+            },
+        }
+
+    def app_link(self, index: int, sort_order: int) -> dict:
+        return {
+            "id": f"{LINK_PREFIX}{index:017d}",
+            "label": f"App {index}",
+            "linkUrl": f"https://apps.example.com/{index}",
+            "appName": f"app_{index}",
+            "logoUrl": f"https://example.com/logos/{index}.png",
+            "status": "ACTIVE",
+            "signOnMode": "SAML_2_0",
+            "appInstanceId": self.app_id(index),
+            "sortOrder": sort_order,
+        }
+
+    def app(self, index: int) -> dict:
+        """App object as listed by /api/v1/apps, the same app as app_link(index)"""
+        return {
+            "id": self.app_id(index),
+            "name": f"app_{index}",
+            "label": f"App {index}",
+            "status": "ACTIVE",
+            "signOnMode": "SAML_2_0",
+            "_links": {
+                "appLinks": [{"name": "login", "href": f"https://apps.example.com/{index}", "type": "text/html"}],
+                "logo": [{"name": "medium", "href": f"https://example.com/logos/{index}.png", "type": "image/png"}],
+            },
+        }
+
+    def user_indexes_for_app(self, index: int) -> array:
+        """Users assigned to an app, inverted from the per-user assignments on first use"""
+        with self._app_users_lock:
+            if self._app_users is None:
+                app_users = [array("I") for _ in range(self.apps)]
+                for user in range(self.users):
+                    for app in self.app_indexes_for_user(user):
+                        app_users[app].append(user)
+                self._app_users = app_users
+        return self._app_users[index]
+
+    def app_index(self, app_id: str):
+        if not app_id.startswith(APP_PREFIX):
+            return None
+        try:
+            index = int(app_id[len(APP_PREFIX):])
+        except ValueError:
+            return None
+        return index if 0 <= index < self.apps else None
+
+    def app_indexes_for_user(self, index: int) -> list:
+        return random.Random(self.seed * 1000003 + index).sample(range(self.apps), self.apps_per_user)
+
+    def user_index(self, user_id: str):
+        if not user_id.startswith(USER_PREFIX):
+            return None
+        try:
+            index = int(user_id[len(USER_PREFIX):])
+        except ValueError:
+            return None
+        return index if 0 <= index < self.users else None
+
+
+def make_handler(data: FakeOktaData, latency_ms: float, error_rate: float):
+    class FakeOktaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+            if error_rate and random.random() < error_rate:
+                self._send(429, {"errorCode": "E0000047", "errorSummary": "API call exceeded rate limit"},
+                           {"Retry-After": "1", "X-Rate-Limit-Remaining": "0"})
+                return
+
+            parts = urlsplit(self.path)
+            query = parse_qs(parts.query)
+            segments = [segment for segment in parts.path.split("/") if segment]
+            if segments[:3] not in (["api", "v1", "users"], ["api", "v1", "logs"], ["api", "v1", "apps"],
+                                    ["api", "v1", "groups"]):
+                self._send(404, {"errorCode": "E0000022", "errorSummary": "Not found"})
+            elif segments[:3] == ["api", "v1", "groups"]:
+                self._groups(parts.path, segments, query)
+            elif segments[:3] == ["api", "v1", "apps"]:
+                self._apps(parts.path, segments, query)
+            elif segments[:3] == ["api", "v1", "logs"]:
+                self._send(200, [])
+            elif len(segments) == 3:
+                self._list_users(parts.path, query)
+            else:
+                index = data.user_index(segments[3])
+                if index is None:
+                    self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found: Resource not found"})
+                elif len(segments) == 4:
+                    self._send(200, data.user(index))
+                elif segments[4] == "appLinks":
+                    self._send(200, [data.app_link(app, order) for order, app in
+                                     enumerate(data.app_indexes_for_user(index))])
+                else:
+                    self._send(404, {"errorCode": "E0000022", "errorSummary": "Not found"})
+
+        def _apps(self, path, segments, query):
+            if len(segments) == 3:
+                start, end, headers = self._page(path, query, 200, data.apps, data.app_id, data.app_index)
+                self._send(200, [data.app(index) for index in range(start, end)], headers)
+                return
+            index = data.app_index(segments[3])
+            if index is not None and segments[4:] == ["groups"]:
+                groups = [{"id": data.group_id(index % data.groups), "priority": 0}] if data.groups else []
+                self._send(200, groups)
+                return
+            if index is None or segments[4:] != ["users"]:
+                self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found: Resource not found"})
+                return
+            # Users of an app are paged by position, the after cursor is the last user's id
+            app_users = data.user_indexes_for_app(index)
+            limit = min(int(query.get("limit", ["50"])[0]), 500)
+            after = query.get("after", [None])[0]
+            start = 0
+            if after:
+                start = app_users.index(data.user_index(after)) + 1
+            end = min(start + limit, len(app_users))
+            headers = {}
+            if end < len(app_users):
+                host = self.headers.get("Host")
+                headers["Link"] = (f'<http://{host}{path}?limit={limit}&after={data.user_id(app_users[end - 1])}>; rel="next"')
+            self._send(200, [{"id": data.user_id(user), "scope": "USER", "status": "ACTIVE"}
+                             for user in app_users[start:end]], headers)
+
+        def _groups(self, path, segments, query):
+            if len(segments) == 3:
+                start, end, headers = self._page(path, query, 1000, data.groups, data.group_id, data.group_index)
+                self._send(200, [data.group(index) for index in range(start, end)], headers)
+                return
+            index = data.group_index(segments[3])
+            if index is None or segments[4:] != ["users"]:
+                self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found: Resource not found"})
+                return
+            # Members of group g are users g, g + G, g + 2G, ...
+            members = range(index, data.users, data.groups)
+            start, end, headers = self._page(path, query, 1000, len(members),
+                                             lambda position: data.user_id(members[position]),
+                                             lambda user_id: members.index(data.user_index(user_id)))
+            self._send(200, [data.user(members[position]) for position in range(start, end)], headers)
+
+        def _page(self, path, query, max_limit, count, make_id, parse_id):
+            """Slice [start, end) for a list endpoint and its Link header"""
+            limit = min(int(query.get("limit", [str(max_limit)])[0]), max_limit)
+            after = query.get("after", [None])[0]
+            start = parse_id(after) + 1 if after else 0
+            end = min(start + limit, count)
+            headers = {}
+            if end < count:
+                host = self.headers.get("Host")
+                headers["Link"] = (f'<http://{host}{path}?limit={limit}&after={make_id(end - 1)}>; rel="next"')
+            return start, end, headers
+
+        def _list_users(self, path, query):
+            start, end, headers = self._page(path, query, 200, data.users, data.user_id, data.user_index)
+            self._send(200, [data.user(index) for index in range(start, end)], headers)
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            all_headers = {}
+            if status == 200:
+                # Weak ETags like Okta's, answering a matching If-None-Match with an empty 304
+                etag = f'W/"{hashlib.md5(body).hexdigest()}"'
+                all_headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+            self.send_response(status)
+            all_headers.update({
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+                "X-Rate-Limit-Limit": "100000",
+                "X-Rate-Limit-Remaining": "100000",
+                "X-Rate-Limit-Reset": str(int(time.time()) + 60),
+            })
+            all_headers.update(headers or {})
+            for name, value in all_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return FakeOktaHandler
+
+
+def start_server(data: FakeOktaData, host: str = "127.0.0.1", port: int = 0,
+                 latency_ms: float = 0, error_rate: float = 0) -> ThreadingHTTPServer:
+    """Start the fake Okta server on a daemon thread and return it, server_port holds the bound port"""
+    server = ThreadingHTTPServer((host, port), make_handler(data, latency_ms, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-okta", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Okta org for benchmarks")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--apps", type=int, default=300)
+    parser.add_argument("--apps-per-user", type=int, default=25)
+    parser.add_argument("--groups", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    data = FakeOktaData(args.users, args.apps, args.apps_per_user, groups=args.groups)
+    server = start_server(data, args.host, args.port, args.latency_ms, args.error_rate)
+    print(f"Fake Okta serving {args.users} users, {args.apps} apps and {args.groups} groups on http://{args.host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+End-to-end sync benchmark against the local fake Okta server
+
+Each org size runs in its own process so peak RSS is measured per run.
+Without --neo4j only the Okta side is measured (users pages and appLinks fan-out).
+With --neo4j the full /syncusers job runs against the Neo4j configured for
+DD_ENV (NEO4J_USERNAME/NEO4J_PASSWORD from .env), and write rates are reported too.
+
+    python -m bench.run_benchmark --sizes 1000,10000,100000 --workers 16 --latency-ms 20
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from bench.fake_okta import FakeOktaData, start_server
+
+
+def _serve(users, apps, apps_per_user, latency_ms, error_rate, port_queue):
+    server = start_server(FakeOktaData(users, apps, apps_per_user), latency_ms=latency_ms, error_rate=error_rate)
+    port_queue.put(server.server_port)
+    while True:
+        time.sleep(3600)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def bench_okta(base_url: str, workers: int) -> dict:
+    """Time the users pages and the appLinks fan-out through OktaFactory"""
+    from utils.okta_factory import OktaFactory
+
+    okta_factory = OktaFactory(base_url, "bench-token", max_workers=workers)
+    try:
+        started = time.perf_counter()
+        users = okta_factory.get_all_active_users()
+        users_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        user_apps = okta_factory.get_apps_for_users(users)
+        apps_seconds = time.perf_counter() - started
+    finally:
+        okta_factory.close()
+
+    links = sum(len(apps) for apps in user_apps.values())
+    return {
+        "users": len(users),
+        "app_links": links,
+        "users_fetch_seconds": round(users_seconds, 2),
+        "users_per_second": round(len(users) / users_seconds, 1) if users_seconds else None,
+        "app_links_fetch_seconds": round(apps_seconds, 2),
+        "app_link_users_per_second": round(len(users) / apps_seconds, 1) if apps_seconds else None,
+    }
+
+
+def bench_sync(base_url: str, workers: int, mode: str) -> dict:
+    """Run the /syncusers job through the Flask app and report its phases and write rates"""
+    os.environ["OKTA_API_TOKEN"] = "bench-token"
+    from app import create_app
+
+    app = create_app()
+    app.config["OKTA_BASE_URL"] = base_url
+    app.config["OKTA_MAX_WORKERS"] = workers
+    client = app.test_client()
+
+    started = time.perf_counter()
+    response = client.get(f"/syncusers?mode={mode}")
+    if response.status_code != 202:
+        raise RuntimeError(f"/syncusers returned {response.status_code}: {response.get_json()}")
+    status_url = response.get_json()["status_url"]
+    while True:
+        status = client.get(status_url).get_json()
+        if status["status"] in ("succeeded", "failed", "skipped"):
+            break
+        time.sleep(0.5)
+    wall = time.perf_counter() - started
+    if status["status"] != "succeeded":
+        raise RuntimeError(f"Sync {status['status']}: {status['error']}")
+
+    write_timings = status["result"].get("write_timings", {})
+    rows = sum(timing["rows"] for timing in write_timings.values())
+    write_seconds = sum(timing["seconds"] for timing in write_timings.values())
+    users = status["result"].get("users_processed", 0)
+    return {
+        "users": users,
+        "sync_seconds": round(wall, 2),
+        "users_per_second": round(users / wall, 1) if wall else None,
+        "rows_written": rows,
+        "write_seconds": round(write_seconds, 2),
+        "rows_per_second": round(rows / write_seconds, 1) if write_seconds else None,
+        "phase_durations": status["phase_durations"],
+    }
+
+
+def run_single(args) -> dict:
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=_serve,
+        args=(args.single, args.apps, args.apps_per_user, args.latency_ms, args.error_rate, port_queue),
+        daemon=True,
+    )
+    server.start()
+    try:
+        base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+        if args.neo4j:
+            result = bench_sync(base_url, args.workers, args.mode)
+        else:
+            result = bench_okta(base_url, args.workers)
+    finally:
+        server.terminate()
+    result["size"] = args.single
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OktaFactory and /syncusers against a fake Okta org")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated user counts")
+    parser.add_argument("--apps", type=int, default=300)
+    parser.add_argument("--apps-per-user", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=16, help="OKTA_MAX_WORKERS for the run")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--neo4j", action="store_true", help="Run the full /syncusers job against Neo4j")
+    parser.add_argument("--mode", default="full", help="Sync mode for --neo4j runs")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args)))
+        return
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",") if size]:
+        command = [
+            sys.executable, "-m", "bench.run_benchmark", "--single", str(size),
+            "--apps", str(args.apps), "--apps-per-user", str(args.apps_per_user),
+            "--workers", str(args.workers), "--latency-ms", str(args.latency_ms),
+            "--error-rate", str(args.error_rate), "--mode", args.mode,
+        ] + (["--neo4j"] if args.neo4j else [])
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(json.dumps(result))
+
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
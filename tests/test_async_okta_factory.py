@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from utils.async_okta_factory import AsyncOktaFactory
+
+
+@pytest.fixture
+def factory():
+    factory = AsyncOktaFactory("https://okta.example.com", "token", max_concurrency=10, http2=False)
+    yield factory
+    factory.close()
+
+
+def test_apps_for_users_keep_user_order(factory, monkeypatch):
+    async def links(user_id):
+        await asyncio.sleep(0.01 if user_id == "u1" else 0)
+        return [{"id": f"app-of-{user_id}"}]
+    monkeypatch.setattr(factory, "_get_user_app_links", links)
+
+    user_apps = factory.get_apps_for_users([{"id": "u1"}, {"id": "u2"}])
+
+    assert list(user_apps) == ["u1", "u2"]
+    assert user_apps["u2"] == [{"id": "app-of-u2"}]
+
+def test_first_failure_cancels_the_other_fetches(factory, monkeypatch):
+    cancelled = []
+
+    async def links(user_id):
+        if user_id == "bad":
+            raise httpx.HTTPError("appLinks failed")
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(user_id)
+            raise
+    monkeypatch.setattr(factory, "_get_user_app_links", links)
+
+    started = time.monotonic()
+    with pytest.raises(httpx.HTTPError, match="appLinks failed"):
+        factory.get_apps_for_users([{"id": "u1"}, {"id": "bad"}, {"id": "u2"}])
+
+    assert time.monotonic() - started < 5
+    assert sorted(cancelled) == ["u1", "u2"]
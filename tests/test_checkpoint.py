@@ -0,0 +1,49 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from utils.checkpoint import SyncCheckpoint
+
+
+def test_commits_round_trip(tmp_path):
+    path = str(tmp_path / "sync.jsonl")
+    checkpoint = SyncCheckpoint(path)
+    checkpoint.begin(datetime.now(timezone.utc))
+    checkpoint.commit("https://okta/page2", ["u1", "u2"], ["a1"])
+    checkpoint.commit("https://okta/page3", ["u3"], ["a1", "a2"])
+
+    loaded = SyncCheckpoint(path)
+    assert loaded.load()
+    assert loaded.resuming
+    assert loaded.committed_chunks == 2
+    assert loaded.resume_url == "https://okta/page3"
+    assert loaded.committed_users == {"u1", "u2", "u3"}
+    assert loaded.seen_apps == {"a1", "a2"}
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / "sync.jsonl")
+    checkpoint = SyncCheckpoint(path)
+    checkpoint.begin(datetime.now(timezone.utc))
+    checkpoint.commit("https://okta/page2", ["u1"], ["a1"])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"chunk": 2, "resume_url": "https://okta/page3", "users": ["u2"], "apps": []})[:25])
+
+    loaded = SyncCheckpoint(path)
+    assert loaded.load()
+    assert loaded.committed_chunks == 1
+    assert loaded.resume_url == "https://okta/page2"
+    assert loaded.committed_users == {"u1"}
+
+def test_stale_or_headless_checkpoints_are_discarded(tmp_path):
+    path = str(tmp_path / "sync.jsonl")
+    checkpoint = SyncCheckpoint(path, max_age_hours=1)
+    checkpoint.begin(datetime.now(timezone.utc) - timedelta(hours=2))
+    assert not SyncCheckpoint(path, max_age_hours=1).load()
+    assert not (tmp_path / "sync.jsonl").exists()
+
+    (tmp_path / "sync.jsonl").write_text('{"chunk": 1}\n', encoding="utf-8")
+    assert not SyncCheckpoint(path).load()
+
+def test_missing_file_is_not_resuming(tmp_path):
+    checkpoint = SyncCheckpoint(str(tmp_path / "none.jsonl"))
+    assert not checkpoint.load()
+    assert not checkpoint.resuming
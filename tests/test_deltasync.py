@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+from utils.deltasync import choose_sync_mode, run_incremental_sync
+from utils.okta_factory import OktaFactory
+
+STATE = {"cursor": "2024-01-02T00:10:00.000Z", "lastFullSync": "2024-01-01T00:00:00.000Z"}
+STARTED = datetime(2024, 1, 2, 1, 0, tzinfo=timezone.utc)
+
+
+class FakeSession:
+    def __init__(self, hwm):
+        self.hwm = hwm
+
+    def read_transaction(self, tx_function, *args):
+        return self.hwm
+
+
+class FakeOkta:
+    def __init__(self, changed=(), events=(), users=None):
+        self.changed = list(changed)
+        self.events = list(events)
+        self.users = users or {}
+        self.since = None
+
+    def iter_users_updated_since(self, since):
+        self.since = since
+        return iter(self.changed)
+
+    def iter_system_log_events(self, since, until, event_types):
+        return iter(self.events)
+
+    def get_user_by_id(self, user_id):
+        return self.users.get(user_id)
+
+    def get_apps_for_users(self, users, progress_callback=None):
+        return {user["id"]: [{"id": "a1"}] for user in users}
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.calls = {}
+
+    def __getattr__(self, name):
+        def record(rows):
+            self.calls[name] = rows if isinstance(rows, dict) else list(rows)
+            return 0
+        return record
+
+
+def event(event_type, user_id=None):
+    return {"eventType": event_type, "target": [{"type": "User", "id": user_id}] if user_id else []}
+
+
+@pytest.mark.parametrize("hwm, expected", [
+    ("2024-01-01T12:00:00.000Z", "2024-01-01T12:00:00.000Z"),
+    # Newer than the last successful sync, e.g. written by a failed run
+    ("2024-01-02T00:30:00.000Z", "2024-01-02T00:05:00.000Z"),
+    (None, "2024-01-02T00:05:00.000Z"),
+])
+def test_users_query_starts_at_the_older_of_hwm_and_overlapped_cursor(hwm, expected):
+    okta = FakeOkta()
+    run_incremental_sync(FakeSession(hwm), okta, RecordingWriter(), STATE, STARTED, overlap_seconds=300)
+    assert okta.since == expected
+
+def test_assignment_events_refetch_users_and_deletions_remove_them():
+    okta = FakeOkta(events=[event("application.user_membership.add", "u1"),
+                            event("user.lifecycle.delete.initiated", "u2")],
+                    users={"u1": {"id": "u1", "status": "ACTIVE"}})
+    writer = RecordingWriter()
+
+    result = run_incremental_sync(FakeSession(None), okta, writer, STATE, STARTED)
+
+    assert result["needs_full_sync"] is False
+    assert [user["id"] for user in writer.calls["write_users"]] == ["u1"]
+    assert writer.calls["cleanup_user_apps"] == {"u1": ["a1"]}
+    assert writer.calls["delete_users"] == ["u2"]
+
+def test_group_assignment_events_fall_back_to_full_sync():
+    okta = FakeOkta(events=[event("group.application_assignment.add")])
+    writer = RecordingWriter()
+
+    result = run_incremental_sync(FakeSession(None), okta, writer, STATE, STARTED)
+
+    assert result == {"needs_full_sync": True, "reason": "group.application_assignment.add"}
+    assert writer.calls == {}
+
+@pytest.mark.parametrize("requested, state, expected", [
+    ("auto", {}, "full"),
+    ("incremental", STATE, "incremental"),
+    ("auto", STATE, "incremental"),
+    ("auto", {**STATE, "lastFullSync": "2023-12-01T00:00:00.000Z"}, "full"),
+])
+def test_choose_sync_mode(requested, state, expected):
+    assert choose_sync_mode(state, requested, full_sync_interval_hours=48, now=STARTED) == expected
+
+
+def test_get_user_by_id_returns_none_only_when_not_found(monkeypatch):
+    factory = OktaFactory("https://okta.example.com", "token")
+
+    def respond(status):
+        response = requests.Response()
+        response.status_code = status
+        response._content = b'{"id": "u1"}'
+        return response
+
+    monkeypatch.setattr(factory.session, "get", lambda url: respond(404))
+    assert factory.get_user_by_id("u1") is None
+    monkeypatch.setattr(factory.session, "get", lambda url: respond(500))
+    with pytest.raises(requests.exceptions.HTTPError):
+        factory.get_user_by_id("u1")
@@ -0,0 +1,53 @@
+import pytest
+
+from utils.batchwriter import app_to_row
+from utils.okta_factory import OktaFactory, app_to_link, estimate_assignment_requests
+
+APP = {"id": "0oa1", "name": "app", "label": "App", "status": "ACTIVE",
+       "_links": {"appLinks": [{"href": "https://app"}], "logo": [{"href": "https://logo"}]}}
+
+
+def test_estimate_counts_pages_and_per_app_requests():
+    estimate = estimate_assignment_requests(user_count=10000, app_count=300, assignment_count=250000)
+    # 2 app list pages + one /users request per app + 500 assignments per page
+    assert estimate == {"per_user": 10000, "per_app": 2 + 300 + 500}
+
+def test_estimate_for_an_empty_graph_prefers_per_user():
+    estimate = estimate_assignment_requests(user_count=0, app_count=50, assignment_count=0)
+    assert estimate["per_user"] < estimate["per_app"]
+
+def test_app_to_link_is_keyed_by_app_id():
+    link = app_to_link(APP)
+    assert link["id"] == link["appInstanceId"] == "0oa1"
+    assert link["linkUrl"] == "https://app" and link["logoUrl"] == "https://logo"
+
+def test_both_strategies_write_the_same_application_node():
+    app_link = {"id": "0ol1", "label": "App", "linkUrl": "https://app", "appName": "app",
+                "logoUrl": "https://logo", "appInstanceId": "0oa1", "sortOrder": 0}
+    assert app_to_row(app_link)["id"] == app_to_row(app_to_link(APP))["id"] == "0oa1"
+
+@pytest.mark.parametrize("user_count, assignment_count, expected", [
+    (10000, 20000, "per_app"),
+    (0, 0, "per_user"),
+])
+def test_auto_strategy_picks_fewer_requests(monkeypatch, user_count, assignment_count, expected):
+    factory = OktaFactory("https://okta.example.com", "token")
+    monkeypatch.setattr(factory, "get_active_apps", lambda: [APP] * 20)
+    assert factory.select_assignment_strategy("auto", user_count, assignment_count) == expected
+    assert factory.assignment_strategy == expected
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match="per_group"):
+        OktaFactory("https://okta.example.com", "token").select_assignment_strategy("per_group", 0, 0)
+
+def test_group_members_are_fetched_in_a_bounded_window():
+    factory = OktaFactory("https://okta.example.com", "token", max_workers=2)
+    requested = []
+    factory.get_group_member_ids = lambda group_id: requested.append(group_id) or [f"member-of-{group_id}"]
+    group_ids = [f"00g{i}" for i in range(20)]
+
+    members = factory.iter_group_members(group_ids)
+    assert next(members) == ("00g0", ["member-of-00g0"])
+    # 2 * max_workers groups ahead of the consumer, plus the one submitted when it took a result
+    assert len(requested) <= 5
+    assert [group_id for group_id, _ in members] == group_ids[1:]
@@ -0,0 +1,101 @@
+from datetime import datetime, timezone
+
+from utils.batchwriter import app_to_row, user_to_row
+from utils.checkpoint import SyncCheckpoint
+from utils.pipeline import SyncPipeline
+from utils.reconcile import GraphState
+
+
+def make_user(user_id):
+    return {"id": user_id, "status": "ACTIVE", "lastUpdated": "2024-01-01T00:00:00.000Z",
+            "profile": {"email": f"{user_id}@example.com", "login": f"{user_id}@example.com"}}
+
+def make_app(app_id):
+    return {"id": app_id, "label": app_id, "appInstanceId": app_id, "status": "ACTIVE"}
+
+
+class FakeOkta:
+    def __init__(self, pages, user_apps):
+        self.pages = pages
+        self.user_apps = user_apps
+        self.resumed_from = None
+
+    def iter_active_user_pages_with_cursor(self, resume_url=None):
+        self.resumed_from = resume_url
+        start = int(resume_url) if resume_url else 0
+        for index in range(start, len(self.pages)):
+            next_url = str(index + 1) if index + 1 < len(self.pages) else None
+            yield [make_user(user_id) for user_id in self.pages[index]], next_url
+
+    def get_apps_for_users(self, users):
+        return {user["id"]: [make_app(app_id) for app_id in self.user_apps.get(user["id"], [])] for user in users}
+
+
+class RecordingWriter:
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.timings = {}
+        self.calls = []
+
+    def __getattr__(self, name):
+        if not name.startswith(("write_", "delete_")):
+            raise AttributeError(name)
+        return lambda rows: self.calls.append((name, list(rows)))
+
+    def check_lease(self):
+        pass
+
+
+def stored_state(user_apps):
+    return GraphState(
+        {user_id: user_to_row(make_user(user_id)) for user_id in user_apps},
+        {app_id: app_to_row(make_app(app_id)) for app_ids in user_apps.values() for app_id in app_ids},
+        {user_id: set(app_ids) for user_id, app_ids in user_apps.items()},
+    )
+
+
+def test_unchanged_pages_are_checkpointed_without_writes(tmp_path):
+    user_apps = {"u1": ["a1"], "u2": ["a1"], "u3": ["a2"]}
+    checkpoint = SyncCheckpoint(str(tmp_path / "sync.jsonl"))
+    checkpoint.begin(datetime.now(timezone.utc))
+    writer = RecordingWriter(batch_size=1000)
+
+    SyncPipeline(FakeOkta([["u1", "u2"], ["u3"]], user_apps), writer, stored_state(user_apps),
+                 checkpoint=checkpoint).run()
+
+    assert writer.calls == []
+    assert checkpoint.committed_chunks == 2
+    assert checkpoint.committed_users == {"u1", "u2", "u3"}
+
+def test_buffered_rows_are_flushed_every_batch_size_users(tmp_path):
+    pages = [["u1"], ["u2"], ["u3"], ["u4"]]
+    checkpoint = SyncCheckpoint(str(tmp_path / "sync.jsonl"))
+    checkpoint.begin(datetime.now(timezone.utc))
+    writer = RecordingWriter(batch_size=2)
+
+    result = SyncPipeline(FakeOkta(pages, {}), writer, stored_state({}), checkpoint=checkpoint).run()
+
+    assert [rows for name, rows in writer.calls if name == "write_user_rows"] == [
+        [user_to_row(make_user("u1")), user_to_row(make_user("u2"))],
+        [user_to_row(make_user("u3")), user_to_row(make_user("u4"))],
+    ]
+    assert checkpoint.committed_chunks == 2
+    assert result["users_processed"] == 4 and result["users_added"] == 4
+
+def test_resume_skips_committed_users_and_keeps_them_from_deletion(tmp_path):
+    path = str(tmp_path / "sync.jsonl")
+    user_apps = {"u1": ["a1"], "u2": ["a1"], "u3": ["a2"]}
+    first = SyncCheckpoint(path)
+    first.begin(datetime.now(timezone.utc))
+    first.commit("1", ["u1", "u2"], ["a1"])
+    checkpoint = SyncCheckpoint(path)
+    checkpoint.load()
+    okta = FakeOkta([["u1", "u2"], ["u3"]], user_apps)
+    writer = RecordingWriter(batch_size=1000)
+
+    result = SyncPipeline(okta, writer, stored_state(user_apps), checkpoint=checkpoint).run()
+
+    assert okta.resumed_from == "1"
+    assert writer.calls == []
+    assert result["users_processed"] == 3 and result["users_deleted"] == 0
+    assert checkpoint.resume_url is None
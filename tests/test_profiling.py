@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from utils import profiling
+from utils.profiling import SyncProfiler
+
+
+def run_in_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+
+def test_only_the_sync_thread_and_its_bound_workers_record():
+    with SyncProfiler() as profiler:
+        profiling.record("job", 0.1)
+        # e.g. a request served by another thread while the sync runs
+        run_in_thread(lambda: profiling.record("request", 0.1))
+        run_in_thread(profiling.bind(lambda: profiling.record("worker", 0.1)))
+        assert profiling.active()
+
+    assert not profiling.active()
+    profiling.record("after", 0.1)
+    assert sorted(profiler.operations) == ["job", "worker"]
+    assert profiler.operations["worker"]["calls"] == 1
+
+def test_coroutines_scheduled_from_the_sync_thread_record():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def fetch():
+        profiling.record("okta", 0.2)
+
+    try:
+        with SyncProfiler() as profiler:
+            asyncio.run_coroutine_threadsafe(fetch(), loop).result()
+        asyncio.run_coroutine_threadsafe(fetch(), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    assert profiler.operations["okta"]["calls"] == 1
+
+def test_bind_without_an_active_profiler_returns_the_function():
+    def target():
+        pass
+    assert profiling.bind(target) is target
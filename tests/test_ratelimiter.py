@@ -0,0 +1,65 @@
+import time
+
+import pytest
+import requests
+
+from utils.ratelimiter import OktaRateLimiter, endpoint_bucket
+
+BUCKET = "/api/v1/users/{id}/appLinks"
+
+
+def response(status=200, **headers):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update({name.replace("_", "-"): str(value) for name, value in headers.items()})
+    return result
+
+def budget(limit, remaining, reset_in=60):
+    return response(X_Rate_Limit_Limit=limit, X_Rate_Limit_Remaining=remaining,
+                    X_Rate_Limit_Reset=int(time.time() + reset_in))
+
+
+def test_endpoint_bucket_replaces_ids():
+    assert endpoint_bucket("https://org.okta.com/api/v1/users/00u1abcd1234XYZ/appLinks") == BUCKET
+    assert endpoint_bucket("https://org.okta.com/api/v1/users?limit=200") == "/api/v1/users"
+
+def test_reserve_does_not_wait_without_budget_or_with_plenty():
+    limiter = OktaRateLimiter()
+    assert limiter.reserve(BUCKET) == 0
+    limiter.update(BUCKET, budget(600, 590))
+    assert limiter.reserve(BUCKET) == 0
+
+def test_reserve_paces_below_threshold_and_counts_reserved_requests():
+    limiter = OktaRateLimiter(reserve_ratio=0.1, pace_below_ratio=0.5)
+    limiter.update(BUCKET, budget(100, 40, reset_in=60))
+    waits = [limiter.reserve(BUCKET) for _ in range(3)]
+    # 30 usable requests over ~60s, every request claims the next slot
+    assert 1.0 < waits[0] < 3.0
+    assert waits[0] < waits[1] < waits[2]
+    assert limiter._buckets[BUCKET].remaining == 37
+
+def test_spent_budget_waits_for_reset_without_chaining_jitter():
+    limiter = OktaRateLimiter(reserve_ratio=0.1, base_backoff=1.0)
+    limiter.update(BUCKET, budget(100, 10, reset_in=30))
+    waits = [limiter.reserve(BUCKET) for _ in range(20)]
+    assert all(29 <= wait <= 31.1 for wait in waits)
+
+def test_update_keeps_lowest_remaining_of_a_window():
+    limiter = OktaRateLimiter()
+    reset = int(time.time() + 60)
+    limiter.update(BUCKET, response(X_Rate_Limit_Limit=100, X_Rate_Limit_Remaining=50, X_Rate_Limit_Reset=reset))
+    limiter.update(BUCKET, response(X_Rate_Limit_Limit=100, X_Rate_Limit_Remaining=70, X_Rate_Limit_Reset=reset))
+    assert limiter._buckets[BUCKET].remaining == 50
+
+@pytest.mark.parametrize("attempt", [0, 3])
+def test_backoff_honours_retry_after_and_caps_delay(attempt):
+    limiter = OktaRateLimiter(base_backoff=1.0, max_backoff=10.0)
+    delay = limiter.backoff(BUCKET, response(429, Retry_After=2), attempt)
+    assert 2.0 <= delay <= 10.0
+    assert limiter.reserve(BUCKET) == pytest.approx(delay, abs=1.1)
+
+def test_backoff_replaces_a_later_reset():
+    limiter = OktaRateLimiter(base_backoff=1.0, max_backoff=10.0)
+    limiter.update(BUCKET, budget(100, 80, reset_in=3600))
+    delay = limiter.backoff(BUCKET, response(429, Retry_After=1), 0)
+    assert limiter._buckets[BUCKET].reset <= time.time() + delay
@@ -0,0 +1,59 @@
+from flask import Flask
+
+from app.routes import _cached_read
+from utils.cache import TTLCache
+from utils.syncusersutils import get_sync_state
+
+
+class FakeNeo4j:
+    """Answers the sync state and one read query, counting how often the read runs"""
+
+    def __init__(self):
+        self.last_sync = "2024-01-01T00:00:00.000Z"
+        self.reads = 0
+
+    def get_session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def read_transaction(self, tx_function, *args):
+        if tx_function is get_sync_state:
+            return {"lastSync": self.last_sync}
+        self.reads += 1
+        return tx_function(None, *args)
+
+
+def make_app(neo4j, check_seconds):
+    app = Flask(__name__)
+    app.config.update(NEO4J=neo4j, READ_CACHE=TTLCache(100, 300), LAST_SYNC_CACHE=TTLCache(1, check_seconds))
+    return app
+
+
+def user_apps(tx, user_id):
+    return [f"app-of-{user_id}"]
+
+
+def test_reads_are_cached_until_the_stored_sync_moves():
+    neo4j = FakeNeo4j()
+    with make_app(neo4j, check_seconds=0).app_context():
+        assert _cached_read(("user_apps", "u1"), user_apps, "u1") == ["app-of-u1"]
+        _cached_read(("user_apps", "u1"), user_apps, "u1")
+        assert neo4j.reads == 1
+
+        # Another worker finished a sync
+        neo4j.last_sync = "2024-01-01T01:00:00.000Z"
+        _cached_read(("user_apps", "u1"), user_apps, "u1")
+        assert neo4j.reads == 2
+
+def test_sync_state_is_rechecked_at_most_once_per_interval():
+    neo4j = FakeNeo4j()
+    with make_app(neo4j, check_seconds=60).app_context():
+        _cached_read(("user_apps", "u1"), user_apps, "u1")
+        neo4j.last_sync = "2024-01-01T01:00:00.000Z"
+        _cached_read(("user_apps", "u1"), user_apps, "u1")
+        assert neo4j.reads == 1
@@ -0,0 +1,104 @@
+import pytest
+
+from utils.batchwriter import app_key, app_to_row, user_to_row
+from utils.okta_factory import UnchangedAppLinks
+from utils.reconcile import DeletionCapExceeded, GraphDelta, GraphDiffer, GraphState, check_deletion_cap, diff_graph
+
+
+def make_user(user_id, email=None):
+    return {"id": user_id, "status": "ACTIVE", "lastUpdated": "2024-01-01T00:00:00.000Z",
+            "profile": {"email": email or f"{user_id}@example.com", "login": f"{user_id}@example.com"}}
+
+def make_app(app_id, label=None):
+    # appLinks carry a link id of their own, nodes are keyed by the app id
+    return {"id": f"0ol-{app_id}", "label": label or app_id, "appInstanceId": app_id, "status": "ACTIVE"}
+
+def stored_state(user_apps):
+    """GraphState holding exactly the given users and appLinks"""
+    apps = {app_key(app): app_to_row(app) for links in user_apps.values() for app in links}
+    return GraphState(
+        {user_id: user_to_row(make_user(user_id)) for user_id in user_apps},
+        apps,
+        {user_id: {app_key(app) for app in links} for user_id, links in user_apps.items()},
+    )
+
+
+def test_unchanged_snapshot_produces_no_writes():
+    user_apps = {"u1": [make_app("a1"), make_app("a2")], "u2": [make_app("a2")]}
+    delta = diff_graph(stored_state(user_apps), [make_user("u1"), make_user("u2")], user_apps)
+    assert all(value == 0 for value in delta.counts().values())
+
+def test_changes_are_diffed_per_row_and_relationship():
+    state = stored_state({"u1": [make_app("a1")], "gone": [make_app("a3")]})
+    users = [make_user("u1", email="new@example.com"), make_user("u2")]
+    user_apps = {"u1": [make_app("a1", label="Renamed"), make_app("a2")], "u2": [make_app("a2")]}
+
+    delta = diff_graph(state, users, user_apps)
+
+    assert delta.users_added == 1
+    assert {row["id"] for row in delta.users_to_write} == {"u1", "u2"}
+    assert delta.apps_added == 1
+    assert {row["id"] for row in delta.apps_to_write} == {"a1", "a2"}
+    assert sorted((edge["user_id"], edge["app_id"]) for edge in delta.edges_to_add) == [("u1", "a2"), ("u2", "a2")]
+    assert delta.user_ids_to_delete == ["gone"]
+    assert delta.app_ids_to_delete == ["a3"]
+    # The edge of a deleted app goes with its DETACH DELETE
+    assert delta.edges_to_delete == []
+
+def test_batches_share_seen_apps_until_finish():
+    state = stored_state({"u1": [make_app("a1")], "u2": [make_app("a2")]})
+    differ = GraphDiffer(state)
+    first = differ.add([make_user("u1")], {"u1": [make_app("a1"), make_app("a2")]})
+    second = differ.add([make_user("u2")], {"u2": [make_app("a2")]})
+    finish = differ.finish()
+
+    assert first.edges_to_add == [{"user_id": "u1", "app_id": "a2"}]
+    assert second.counts() == GraphDelta().counts()
+    assert finish.user_ids_to_delete == [] and finish.app_ids_to_delete == []
+    assert differ.seen_apps == {"a1", "a2"}
+
+def test_unchanged_links_skip_app_rows_but_keep_apps_and_relationships():
+    state = stored_state({"u1": [make_app("a1"), make_app("a2")]})
+    unchanged = UnchangedAppLinks(["a1"], loader=lambda: pytest.fail("payload must not be parsed"))
+
+    differ = GraphDiffer(state)
+    delta = differ.add([make_user("u1")], {"u1": unchanged})
+    delta.extend(differ.finish())
+
+    assert delta.apps_to_write == []
+    assert delta.edges_to_delete == [{"user_id": "u1", "app_id": "a2"}]
+    assert differ.unchanged_apps == {"a1"}
+    assert delta.app_ids_to_delete == ["a2"]
+
+def test_unchanged_links_are_parsed_when_an_app_left_the_graph():
+    state = stored_state({"u1": [make_app("a1")]})
+    unchanged = UnchangedAppLinks(["a1", "a9"], loader=lambda: [make_app("a1"), make_app("a9")])
+
+    delta = GraphDiffer(state).add([make_user("u1")], {"u1": unchanged})
+
+    assert [row["id"] for row in delta.apps_to_write] == ["a9"]
+    assert delta.edges_to_add == [{"user_id": "u1", "app_id": "a9"}]
+
+
+def deletion_delta(users=0, apps=0):
+    delta = GraphDelta()
+    delta.user_ids_to_delete = [f"u{i}" for i in range(users)]
+    delta.app_ids_to_delete = [f"a{i}" for i in range(apps)]
+    return delta
+
+def sized_state(users, apps):
+    return GraphState({f"u{i}": {} for i in range(users)}, {f"a{i}": {} for i in range(apps)}, {})
+
+def test_deletion_cap_raises_above_ratio():
+    with pytest.raises(DeletionCapExceeded, match="User"):
+        check_deletion_cap(sized_state(1000, 10), deletion_delta(users=300), 0.2)
+
+def test_deletion_cap_allows_up_to_ratio_and_small_deletions():
+    check_deletion_cap(sized_state(1000, 10), deletion_delta(users=200), 0.2)
+    # Below min_nodes the ratio does not matter, small orgs can lose most of their apps
+    check_deletion_cap(sized_state(1000, 10), deletion_delta(apps=9), 0.2)
+
+def test_deletion_cap_checks_applications_and_can_be_disabled():
+    with pytest.raises(DeletionCapExceeded, match="Application"):
+        check_deletion_cap(sized_state(10, 500), deletion_delta(apps=400), 0.2)
+    check_deletion_cap(sized_state(10, 500), deletion_delta(apps=400), None)
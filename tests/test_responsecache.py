@@ -0,0 +1,70 @@
+import requests
+
+from utils.ratelimiter import RateLimitedSession
+from utils.responsecache import CachingSession, ResponseCache
+
+URL = "https://okta.example.com/api/v1/users/00u1abcd1234XYZ/appLinks"
+
+
+def response(status, body=b"", etag=None):
+    result = requests.Response()
+    result.status_code = status
+    result._content = body
+    if etag:
+        result.headers["ETag"] = etag
+    return result
+
+
+class FakeOkta:
+    """Stands in for the network below CachingSession, answering from a queue of responses"""
+
+    def __init__(self, monkeypatch, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+        monkeypatch.setattr(RateLimitedSession, "request", lambda session, method, url, **kwargs: self.send(kwargs))
+
+    def send(self, kwargs):
+        self.sent_headers.append(kwargs.get("headers") or {})
+        return self.responses.pop(0)
+
+
+def test_not_modified_answers_from_the_cache_and_tracks_confirmation(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    session = CachingSession(cache)
+    okta = FakeOkta(monkeypatch, response(200, b'[{"id": "0ol1"}]', etag='W/"1"'),
+                    response(304), response(304))
+
+    first = session.get(URL)
+    second = session.get(URL)
+    cache.confirm()
+    third = session.get(URL)
+
+    assert "If-None-Match" not in okta.sent_headers[0]
+    assert okta.sent_headers[1]["If-None-Match"] == 'W/"1"'
+    assert second.status_code == 200 and second.json() == [{"id": "0ol1"}]
+    assert first.content_digest == second.content_digest == third.content_digest
+    assert not first.unchanged and not second.unchanged
+    assert third.unchanged
+
+def test_changed_body_replaces_the_entry_and_its_summary(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    session = CachingSession(cache)
+    FakeOkta(monkeypatch, response(200, b"[]", etag='W/"1"'), response(200, b'[{"id": "0ol2"}]', etag='W/"2"'))
+
+    first = session.get(URL)
+    cache.set_summary(URL, first.content_digest, "")
+    cache.confirm()
+    second = session.get(URL)
+
+    assert not second.unchanged
+    assert second.cache_summary is None
+    assert cache.get(URL).etag == 'W/"2"'
+
+def test_uncacheable_requests_pass_through(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    FakeOkta(monkeypatch, response(200, b"[]"))
+
+    result = CachingSession(cache).get("https://okta.example.com/api/v1/users", params={"limit": 200})
+
+    assert not hasattr(result, "content_digest")
+    assert cache.get("https://okta.example.com/api/v1/users") is None
@@ -0,0 +1,60 @@
+import gzip
+import json
+
+import pytest
+
+from utils.snapshot import Snapshot, SnapshotSource
+
+
+def make_user(user_id):
+    return {"id": user_id, "status": "ACTIVE", "created": "2024-01-01T00:00:00.000Z", "lastLogin": None,
+            "lastUpdated": "2024-01-02T00:00:00.000Z",
+            "profile": {"firstName": "First", "lastName": user_id, "email": f"{user_id}@example.com",
+                        "login": f"{user_id}@example.com"}}
+
+def make_link(app_id, link_id):
+    return {"id": link_id, "label": app_id, "linkUrl": f"https://{app_id}", "appName": app_id,
+            "logoUrl": "", "appInstanceId": app_id, "sortOrder": 0}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    snapshot = Snapshot()
+    snapshot.add(make_user("u1"), [make_link("0oa1", "0ol1"), make_link("0oa2", "0ol2")])
+    # Another link of the same app is stored once
+    snapshot.add(make_user("u2"), [make_link("0oa1", "0ol3")])
+    path = str(tmp_path / "snapshot.json.gz")
+    snapshot.save(path)
+
+    loaded = Snapshot.load(path)
+
+    assert loaded.created == snapshot.created
+    assert len(loaded) == 2 and len(loaded.apps) == 2
+    assert [user.to_okta_user()["profile"]["email"] for user in loaded.users] == ["u1@example.com", "u2@example.com"]
+    assert [app["id"] for app in loaded.app_links(loaded.users[0])] == ["0oa1", "0oa2"]
+    assert loaded.app_links(loaded.users[1]) == snapshot.app_links(snapshot.users[1])
+
+def test_load_rejects_other_versions(tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    Snapshot().save(path)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] += 1
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    with pytest.raises(ValueError, match="version"):
+        Snapshot.load(path)
+
+def test_source_pages_resume_from_their_cursor():
+    snapshot = Snapshot()
+    for index in range(5):
+        snapshot.add(make_user(f"u{index}"), [make_link("0oa1", f"0ol{index}")])
+    source = SnapshotSource(snapshot)
+
+    pages = list(source.iter_active_user_pages_with_cursor(limit=2))
+    resumed = list(source.iter_active_user_pages_with_cursor(pages[0][1], limit=2))
+
+    assert [len(users) for users, _ in pages] == [2, 2, 1]
+    assert [cursor for _, cursor in pages] == ["2", "4", None]
+    assert resumed == pages[1:]
+    assert source.get_apps_for_users(pages[2][0]) == {"u4": [snapshot.apps[0].to_app_link()]}
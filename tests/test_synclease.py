@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from utils.batchwriter import BatchWriter
+from utils.synclease import LeaseLost, SyncLease, acquire_lease, get_lease, release_lease, renew_lease
+
+
+class LeaseStore:
+    """In-memory stand-in for the (:SyncLease) node, answering the lease transaction functions"""
+
+    def __init__(self):
+        self.holder = None
+        self.expires = None
+        self.failing = False
+
+    def session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def write_transaction(self, tx_function, name, holder, *args):
+        if self.failing:
+            raise ConnectionError("Neo4j unavailable")
+        if tx_function is acquire_lease:
+            now, ttl = args
+            if self.holder not in (None, holder) and self.expires >= now:
+                return False
+            self.holder, self.expires = holder, now + ttl
+            return True
+        if tx_function is renew_lease:
+            now, ttl = args
+            if self.holder != holder:
+                return False
+            self.expires = now + ttl
+            return True
+        if tx_function is release_lease and self.holder == holder:
+            self.holder = self.expires = None
+
+    def read_transaction(self, tx_function, name):
+        assert tx_function is get_lease
+        return {"holder": self.holder, "expires": self.expires}
+
+
+def wait_until_lost(lease, timeout=2.0):
+    deadline = time.time() + timeout
+    while not lease.lost and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_second_holder_is_refused_until_release():
+    store = LeaseStore()
+    first, second = SyncLease(store.session, ttl=30), SyncLease(store.session, ttl=30)
+
+    assert first.acquire()
+    assert not second.acquire()
+    assert second.current()["holder"] == first.holder
+    first.release()
+    assert second.acquire()
+    second.release()
+
+def test_takeover_marks_the_lease_lost_and_stops_writes():
+    store = LeaseStore()
+    lease = SyncLease(store.session, ttl=0.06)
+    assert lease.acquire()
+    lease.check()
+
+    store.holder = "other-process"
+    wait_until_lost(lease)
+
+    with pytest.raises(LeaseLost):
+        lease.check()
+    writer = BatchWriter(session=None, batch_size=10, lease=lease)
+    with pytest.raises(LeaseLost):
+        writer.write_users([{"id": "u1"}])
+    lease.release()
+
+def test_failing_renewals_lose_the_lease_after_ttl():
+    store = LeaseStore()
+    lease = SyncLease(store.session, ttl=0.06)
+    assert lease.acquire()
+
+    store.failing = True
+    wait_until_lost(lease)
+
+    assert lease.lost
+    store.failing = False
+    lease.release()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:  # optional backend, only needed with OKTA_CLIENT="async"
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+from utils import profiling
+from utils.metrics import OKTA_RATE_LIMITED, OKTA_REQUEST_SECONDS, OKTA_RETRIES
+from utils.okta_factory import OktaFactory
+from utils.ratelimiter import OktaRateLimiter, endpoint_bucket
+
+
+class AsyncOktaFactory(OktaFactory):
+    def __init__(self, base_url: str, api_token: str, max_concurrency: int = 100,
+                 rate_limiter: Optional[OktaRateLimiter] = None, http2: bool = True, max_retries: int = 5,
+                 logger: Optional[logging.Logger] = None):
+        """
+        OktaFactory backed by an asyncio httpx client
+
+        Requests run on an event loop owned by the factory, so get_apps_for_users can
+        keep hundreds of appLinks calls in flight on a single thread. The public methods
+        are the blocking ones of OktaFactory, callers do not need to be async.
+
+        Args:
+            base_url: Okta domain URL (e.g., 'https://paloaltonetworks.oktapreview.com')
+            api_token: Okta API token (SSWS token)
+            max_concurrency: Maximum number of requests in flight, also the connection pool size
+            rate_limiter: Limiter shared by all requests of this factory, created when omitted
+            http2: Use HTTP/2 when the h2 package is installed
+            max_retries: Number of retries for a 429 response before it is returned
+            logger: Logger for progress and errors, see OktaFactory
+
+        Raises:
+            ImportError: If httpx is not installed
+        """
+        if httpx is None:
+            raise ImportError("The async Okta client needs httpx, install it with 'pip install httpx[http2]'")
+        super().__init__(base_url, api_token, rate_limiter=rate_limiter, logger=logger)
+        self.limiter = self.session.limiter
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_workers = self.max_concurrency
+        self.max_retries = max_retries
+        self.http2 = http2 and HTTP2_AVAILABLE
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="okta-async", daemon=True)
+        self._thread.start()
+        self._client, self._semaphore = self._run(self._open())
+
+    async def _open(self):
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        client = httpx.AsyncClient(headers=self.headers, http2=self.http2, limits=limits, timeout=30.0)
+        return client, asyncio.Semaphore(self.max_concurrency)
+
+    def _run(self, coroutine):
+        """Run a coroutine on the factory's loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _get(self, url: str, params: Optional[Dict] = None) -> "httpx.Response":
+        """GET through the rate limiter, retrying 429 responses with jittered backoff"""
+        bucket = endpoint_bucket(url)
+        attempt = 0
+        while True:
+            # Reserve inside the semaphore: gather starts every request at once, and reserving
+            # before waiting for a free slot would hand all of them a slot up front
+            async with self._semaphore:
+                wait = self.limiter.reserve(bucket)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                started = time.perf_counter()
+                response = await self._client.get(url, params=params)
+                elapsed = time.perf_counter() - started
+                OKTA_REQUEST_SECONDS.observe(elapsed, endpoint=bucket)
+                profiling.record(f"okta {bucket}", elapsed)
+            self.limiter.update(bucket, response)
+            if response.status_code == 429:
+                OKTA_RATE_LIMITED.inc(endpoint=bucket)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            OKTA_RETRIES.inc(endpoint=bucket)
+            delay = self.limiter.backoff(bucket, response, attempt)
+            self.logger.warning(f"Okta rate limit hit on {bucket}, retrying in {delay:.2f}s (attempt {attempt+1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _get_json(self, url: str, params: Optional[Dict] = None):
+        response = await self._get(url, params)
+        response.raise_for_status()
+        return response.json(), response.headers.get('Link', '')
+
+    async def _get_user_by_id(self, user_id: str) -> Optional[Dict]:
+        url = f"{self.base_url}/api/v1/users/{user_id}"
+        try:
+            response = await self._get(url)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            self.logger.error(f"Error fetching user {user_id}: {e}")
+            raise
+
+    async def _get_user_app_links(self, user_id: str) -> List[Dict]:
+        url = f"{self.base_url}/api/v1/users/{user_id}/appLinks"
+        try:
+            response = await self._get(url)
+            # A user deleted since it was listed has no apps, any other failure must not read as none
+            if response.status_code == 404:
+                return []
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            self.logger.error(f"Error fetching app links for user {user_id}: {e}")
+            raise
+
+    async def _get_apps_for_users(self, user_ids: List[str],
+                                  progress_callback: Optional[Callable[[int], None]]) -> Dict[str, List[Dict]]:
+        done = 0
+
+        async def fetch(user_id):
+            nonlocal done
+            apps = await self._get_user_app_links(user_id)
+            done += 1
+            if done % 1000 == 0:
+                self.logger.debug(f"Fetched applications for {done}/{len(user_ids)} users")
+            if progress_callback and (done % 100 == 0 or done == len(user_ids)):
+                progress_callback(done)
+            return apps
+
+        # gather keeps input order, so the mapping is built in the same order as users
+        tasks = [asyncio.ensure_future(fetch(user_id)) for user_id in user_ids]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # gather leaves the other fetches running, stop them instead of spending the rate limit
+            # on a result that is thrown away. TaskGroup would wrap the error in an ExceptionGroup.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return dict(zip(user_ids, results))
+
+    def get_user_app_links(self, user_id: str) -> List[Dict]:
+        return self._run(self._get_user_app_links(user_id))
+
+    def get_apps_for_users(self, users: List[Dict], max_workers: Optional[int] = None,
+                           progress_callback: Optional[Callable[[int], None]] = None) -> Dict[str, List[Dict]]:
+        """
+        Get assigned applications for a list of users, all requests issued concurrently
+
+        Args:
+            users: List of user objects from get_all_active_users()
+            max_workers: Ignored, concurrency is bounded by max_concurrency
+            progress_callback: Optional function called with the number of users fetched so far
+
+        Returns:
+            Dictionary mapping user_id to list of applications
+        """
+        if self.assignment_strategy == "per_app":
+            return self._apps_from_assignments(users, progress_callback)
+        user_ids = [user['id'] for user in users]
+        self.logger.debug(f"Fetching applications for {len(users)} users with up to {self.max_concurrency} requests in flight...")
+        return self._run(self._get_apps_for_users(user_ids, progress_callback))
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict]:
+        return self._run(self._get_user_by_id(user_id))
+
+    def _iter_pages_with_next(self, url: str, params: Optional[Dict],
+                              label: str) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        total = 0
+
+        while url:
+            try:
+                page, link_header = self._run(self._get_json(url, params))
+            except httpx.HTTPError as e:
+                self.logger.error(f"Error fetching {label}: {e}")
+                raise
+
+            # Polling endpoints such as /logs keep returning a next link on empty pages
+            if not page:
+                break
+            total += len(page)
+            self.logger.debug(f"Retrieved {len(page)} {label} (Total: {total})")
+
+            url = self._parse_next_link(link_header)
+            params = None
+
+            yield page, url
+
+    def close(self):
+        """Close the HTTP client and stop the event loop"""
+        if self._loop.is_running():
+            self._run(self._client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self._loop.close()
+        super().close()
@@ -0,0 +1,499 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+from utils import profiling
+from utils.metrics import NEO4J_ROWS_WRITTEN, NEO4J_TRANSACTION_RETRIES, NEO4J_TRANSACTION_SECONDS
+
+
+# Row builders - flatten Okta objects into the parameter maps used by UNWIND
+def user_to_row(user: Dict) -> Dict:
+    """Build the UNWIND row for a user node"""
+    profile = user.get("profile", {})
+    return {
+        "id": user["id"],
+        "firstName": profile.get("firstName", ""),
+        "lastName": profile.get("lastName", ""),
+        "email": profile.get("email", ""),
+        "login": profile.get("login", ""),
+        "status": user.get("status", ""),
+        "created": user.get("created", ""),
+        "lastLogin": user.get("lastLogin", ""),
+        "lastUpdated": user.get("lastUpdated", ""),
+    }
+
+def app_key(app: Dict) -> str:
+    """
+    Id of the Application node for an appLink or app
+
+    appLinks carry a link id of their own, the Okta app id is in appInstanceId. Keying
+    nodes by the app id gives both assignment strategies the same Application nodes.
+    Payloads without appInstanceId, such as the dummydata files, keep their id.
+    """
+    return app.get("appInstanceId") or app.get("id", "")
+
+def app_to_row(app: Dict) -> Dict:
+    """Build the UNWIND row for an application node"""
+    return {
+        "id": app_key(app),
+        "label": app.get("label", ""),
+        "linkUrl": app.get("linkUrl", ""),
+        "appName": app.get("appName", ""),
+        "logoUrl": app.get("logoUrl", ""),
+        "status": app.get("status", ""),
+        "signOnMode": app.get("signOnMode", ""),
+        "appInstanceId": app.get("appInstanceId", ""),
+        "sortOrder": app.get("sortOrder", 0),
+    }
+
+
+def group_to_row(group: Dict) -> Dict:
+    """Build the UNWIND row for a group node"""
+    profile = group.get("profile", {})
+    return {
+        "id": group["id"],
+        "name": profile.get("name", ""),
+        "description": profile.get("description") or "",
+        "type": group.get("type", ""),
+        "lastUpdated": group.get("lastUpdated", ""),
+        "lastMembershipUpdated": group.get("lastMembershipUpdated", ""),
+    }
+
+
+# Neo4j transaction functions
+def merge_users_batch(tx, rows):
+    """Create or update a batch of user nodes"""
+    query = """
+    UNWIND $rows AS row
+    MERGE (u:User {id: row.id})
+    SET u.firstName = row.firstName,
+        u.lastName = row.lastName,
+        u.email = row.email,
+        u.login = row.login,
+        u.status = row.status,
+        u.created = row.created,
+        u.lastLogin = row.lastLogin,
+        u.lastUpdated = row.lastUpdated,
+        u.type = 'User'
+    """
+    tx.run(query, rows=rows)
+
+def merge_apps_batch(tx, rows):
+    """Create or update a batch of application nodes"""
+    query = """
+    UNWIND $rows AS row
+    MERGE (a:Application {id: row.id})
+    SET a.label = row.label,
+        a.linkUrl = row.linkUrl,
+        a.appName = row.appName,
+        a.logoUrl = row.logoUrl,
+        a.status = row.status,
+        a.signOnMode = row.signOnMode,
+        a.appInstanceId = row.appInstanceId,
+        a.sortOrder = row.sortOrder,
+        a.type = 'Application'
+    """
+    tx.run(query, rows=rows)
+
+def merge_user_apps_batch(tx, rows):
+    """Create a batch of USES relationships, rows are {user_id, app_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (u:User {id: row.user_id}), (a:Application {id: row.app_id})
+    MERGE (u)-[r:USES]->(a)
+    SET r.assignedDate = datetime()
+    """
+    tx.run(query, rows=rows)
+
+def delete_user_apps_batch(tx, rows):
+    """Delete a batch of USES relationships, rows are {user_id, app_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (u:User {id: row.user_id})-[r:USES]->(a:Application {id: row.app_id})
+    DELETE r
+    """
+    tx.run(query, rows=rows)
+
+# Auto-commit statements - CALL { } IN TRANSACTIONS cannot run inside a transaction function
+def purge_nodes(session, label: str, ids: List[str], batch_size: int):
+    """
+    Detach delete nodes by id, committing every batch_size relationships and nodes
+
+    Relationships go first in their own inner transactions, so a node with many
+    relationships, such as a widely assigned application, never has to be removed in
+    one transaction.
+    """
+    batch_size = int(batch_size)
+    relationships_query = f"""
+    UNWIND $ids AS id
+    MATCH (n:{label} {{id: id}})-[r]-()
+    CALL {{ WITH r DELETE r }} IN TRANSACTIONS OF {batch_size} ROWS
+    """
+    nodes_query = f"""
+    UNWIND $ids AS id
+    MATCH (n:{label} {{id: id}})
+    CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {batch_size} ROWS
+    """
+    for name, query in ((f"purge {label} relationships", relationships_query), (f"purge {label} nodes", nodes_query)):
+        started = time.perf_counter()
+        summary = session.run(query, ids=ids).consume()
+        profiling.record(f"neo4j {name}", time.perf_counter() - started, summary.counters)
+
+
+def merge_groups_batch(tx, rows):
+    """Create or update a batch of group nodes"""
+    query = """
+    UNWIND $rows AS row
+    MERGE (g:Group {id: row.id})
+    SET g.name = row.name,
+        g.description = row.description,
+        g.groupType = row.type,
+        g.lastUpdated = row.lastUpdated,
+        g.lastMembershipUpdated = row.lastMembershipUpdated,
+        g.type = 'Group'
+    """
+    tx.run(query, rows=rows)
+
+def merge_memberships_batch(tx, rows):
+    """Create a batch of MEMBER_OF relationships, rows are {user_id, group_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (u:User {id: row.user_id}), (g:Group {id: row.group_id})
+    MERGE (u)-[:MEMBER_OF]->(g)
+    """
+    tx.run(query, rows=rows)
+
+def delete_memberships_batch(tx, rows):
+    """Delete a batch of MEMBER_OF relationships, rows are {user_id, group_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (:User {id: row.user_id})-[r:MEMBER_OF]->(:Group {id: row.group_id})
+    DELETE r
+    """
+    tx.run(query, rows=rows)
+
+def merge_grants_batch(tx, rows):
+    """Create a batch of GRANTS relationships, rows are {group_id, app_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (g:Group {id: row.group_id}), (a:Application {id: row.app_id})
+    MERGE (g)-[:GRANTS]->(a)
+    """
+    tx.run(query, rows=rows)
+
+def delete_grants_batch(tx, rows):
+    """Delete a batch of GRANTS relationships, rows are {group_id, app_id} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (:Group {id: row.group_id})-[r:GRANTS]->(:Application {id: row.app_id})
+    DELETE r
+    """
+    tx.run(query, rows=rows)
+
+def find_stale_user_apps(tx, rows):
+    """Return the USES relationships of a batch of users pointing outside their assigned apps, rows are {user_id, app_ids} maps"""
+    query = """
+    UNWIND $rows AS row
+    MATCH (u:User {id: row.user_id})-[:USES]->(a:Application)
+    WHERE NOT a.id IN row.app_ids
+    RETURN u.id AS user_id, a.id AS app_id
+    """
+    return [record.data() for record in tx.run(query, rows=rows)]
+
+
+def chunked(rows: List, size: int) -> Iterable[List]:
+    """Split a list into consecutive chunks of at most `size` items"""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def partition_by_key(rows: List[Dict], key: str, partitions: int) -> List[List[Dict]]:
+    """
+    Split rows into contiguous key ranges of similar size
+
+    Rows are sorted by key first, and all rows sharing a key land in the same range, so
+    two ranges never touch the same node. Sorting also gives every transaction the same
+    lock order.
+    """
+    ordered = sorted(rows, key=lambda row: (row[key], row.get("app_id", "")))
+    target = max(1, -(-len(ordered) // partitions))
+    ranges = []
+    current = []
+    for row in ordered:
+        if len(current) >= target and row[key] != current[-1][key]:
+            ranges.append(current)
+            current = []
+        current.append(row)
+    if current:
+        ranges.append(current)
+    return ranges
+
+
+class BatchWriter:
+    def __init__(self, session, batch_size: int = 1000, logger=None, delete_batch_size: Optional[int] = None,
+                 lease=None):
+        """
+        Write users, applications and USES relationships to Neo4j in batches
+
+        Args:
+            session: Open Neo4j session
+            batch_size: Number of rows sent per transaction
+            logger: Optional logger used to report per-chunk timings
+            delete_batch_size: Relationships or nodes removed per inner transaction when
+                               deleting nodes, defaults to batch_size
+            lease: Optional SyncLease checked before every chunk, a lost lease aborts the write
+        """
+        self.session = session
+        self.batch_size = max(1, int(batch_size))
+        self.delete_batch_size = max(1, int(delete_batch_size or self.batch_size))
+        self.logger = logger
+        self.lease = lease
+        self.timings = {}
+
+    def write_users(self, users: List[Dict]) -> Dict:
+        """Create or update user nodes, one transaction per chunk"""
+        return self.write_user_rows([user_to_row(user) for user in users])
+
+    def write_apps(self, apps: Iterable[Dict]) -> Dict:
+        """Create or update application nodes, one transaction per chunk"""
+        return self.write_app_rows([app_to_row(app) for app in apps])
+
+    def write_user_apps(self, user_apps: Dict[str, List[Dict]]) -> Dict:
+        """Create USES relationships for a user_id -> apps mapping"""
+        rows = [
+            {"user_id": user_id, "app_id": app_key(app)}
+            for user_id, apps in user_apps.items()
+            for app in apps
+        ]
+        return self.write_user_app_rows(rows)
+
+    def write_user_rows(self, rows: List[Dict]) -> Dict:
+        """Create or update user nodes from rows built by user_to_row()"""
+        return self._write("users", merge_users_batch, rows)
+
+    def write_app_rows(self, rows: List[Dict]) -> Dict:
+        """Create or update application nodes from rows built by app_to_row()"""
+        return self._write("apps", merge_apps_batch, rows)
+
+    def write_user_app_rows(self, rows: List[Dict]) -> Dict:
+        """Create USES relationships from {user_id, app_id} rows"""
+        return self._write("user_apps", merge_user_apps_batch, rows)
+
+    def delete_user_app_rows(self, rows: List[Dict]) -> Dict:
+        """Delete USES relationships from {user_id, app_id} rows"""
+        return self._write("deleted_user_apps", delete_user_apps_batch, rows)
+
+    def cleanup_user_apps(self, user_apps: Dict[str, Iterable[str]]) -> int:
+        """
+        Delete USES relationships to apps no longer assigned, for a user_id -> app ids mapping
+
+        Stale relationships are looked up with one query per chunk of users and deleted
+        in chunks of batch_size, so neither side grows with the number of users.
+
+        Returns:
+            Number of relationships deleted
+        """
+        rows = [{"user_id": user_id, "app_ids": list(app_ids)} for user_id, app_ids in user_apps.items()]
+        deleted = 0
+        for chunk in chunked(rows, self.batch_size):
+            stale = self.session.read_transaction(find_stale_user_apps, chunk)
+            if stale:
+                self.delete_user_app_rows(stale)
+                deleted += len(stale)
+        return deleted
+
+    def write_group_rows(self, rows: List[Dict]) -> Dict:
+        """Create or update group nodes from rows built by group_to_row()"""
+        return self._write("groups", merge_groups_batch, rows)
+
+    def write_membership_rows(self, rows: List[Dict]) -> Dict:
+        """Create MEMBER_OF relationships from {user_id, group_id} rows"""
+        return self._write("memberships", merge_memberships_batch, rows)
+
+    def delete_membership_rows(self, rows: List[Dict]) -> Dict:
+        """Delete MEMBER_OF relationships from {user_id, group_id} rows"""
+        return self._write("deleted_memberships", delete_memberships_batch, rows)
+
+    def write_grant_rows(self, rows: List[Dict]) -> Dict:
+        """Create GRANTS relationships from {group_id, app_id} rows"""
+        return self._write("grants", merge_grants_batch, rows)
+
+    def delete_grant_rows(self, rows: List[Dict]) -> Dict:
+        """Delete GRANTS relationships from {group_id, app_id} rows"""
+        return self._write("deleted_grants", delete_grants_batch, rows)
+
+    def delete_groups(self, group_ids: List[str]) -> Dict:
+        """Detach delete group nodes by id in bounded inner transactions"""
+        return self._purge("deleted_groups", "Group", list(group_ids))
+
+    def delete_users(self, user_ids: List[str]) -> Dict:
+        """Detach delete user nodes by id in bounded inner transactions"""
+        return self._purge("deleted_users", "User", list(user_ids))
+
+    def delete_apps(self, app_ids: List[str]) -> Dict:
+        """Detach delete application nodes by id in bounded inner transactions"""
+        return self._purge("deleted_apps", "Application", list(app_ids))
+
+    def check_lease(self):
+        """Raise LeaseLost when the sync lease this writer runs under was lost"""
+        if self.lease is not None:
+            self.lease.check()
+
+    def _purge(self, name: str, label: str, ids: List[str]) -> Dict:
+        """Run purge_nodes over chunks of batch_size ids, keeping the id parameter small"""
+        chunk_timings = []
+        for chunk in chunked(ids, self.batch_size):
+            self.check_lease()
+            started = time.perf_counter()
+            with NEO4J_TRANSACTION_SECONDS.time(query=f"purge_{label.lower()}_nodes"):
+                purge_nodes(self.session, label, chunk, self.delete_batch_size)
+            elapsed = time.perf_counter() - started
+            NEO4J_ROWS_WRITTEN.inc(len(chunk), query=f"purge_{label.lower()}_nodes")
+            chunk_timings.append(round(elapsed, 4))
+
+        summary = {
+            "rows": len(ids),
+            "chunks": len(chunk_timings),
+            "seconds": round(sum(chunk_timings), 4),
+            "max_chunk_seconds": max(chunk_timings, default=0.0),
+            "chunk_seconds": chunk_timings,
+        }
+        self._record(name, summary)
+        if self.logger:
+            self.logger.info(f"{name}: deleted {len(ids)} {label} nodes in {summary['chunks']} chunks ({summary['seconds']}s)")
+        return summary
+
+    def _write(self, name: str, tx_function, rows: List[Dict]) -> Dict:
+        """
+        Send rows through a transaction function in chunks of batch_size
+
+        Args:
+            name: Name used for logging and in the timings report
+            tx_function: Transaction function taking (tx, rows)
+            rows: Parameter maps (or ids) to write
+
+        Returns:
+            Timing summary for this write
+        """
+        chunk_timings = []
+        total_chunks = (len(rows) + self.batch_size - 1) // self.batch_size
+        for i, chunk in enumerate(chunked(rows, self.batch_size)):
+            self.check_lease()
+            started = time.perf_counter()
+            self.session.write_transaction(tx_function, chunk)
+            elapsed = time.perf_counter() - started
+            NEO4J_ROWS_WRITTEN.inc(len(chunk), query=tx_function.__name__)
+            chunk_timings.append(round(elapsed, 4))
+            if self.logger:
+                self.logger.debug(f"{name}: chunk {i+1}/{total_chunks} wrote {len(chunk)} rows in {elapsed:.3f}s")
+
+        summary = {
+            "rows": len(rows),
+            "chunks": len(chunk_timings),
+            "seconds": round(sum(chunk_timings), 4),
+            "max_chunk_seconds": max(chunk_timings, default=0.0),
+            "chunk_seconds": chunk_timings,
+        }
+        self._record(name, summary)
+        if self.logger:
+            self.logger.info(f"{name}: wrote {len(rows)} rows in {summary['chunks']} chunks ({summary['seconds']}s)")
+        return summary
+
+    def _record(self, name: str, summary: Dict):
+        """Add a write summary to the running totals for name"""
+        totals = self.timings.get(name)
+        if totals is None:
+            self.timings[name] = dict(summary, chunk_seconds=list(summary["chunk_seconds"]))
+            return
+        totals["rows"] += summary["rows"]
+        totals["chunks"] += summary["chunks"]
+        totals["seconds"] = round(totals["seconds"] + summary["seconds"], 4)
+        totals["max_chunk_seconds"] = max(totals["max_chunk_seconds"], summary["max_chunk_seconds"])
+        totals["chunk_seconds"].extend(summary["chunk_seconds"])
+        if "wall_seconds" in summary:
+            totals["wall_seconds"] = round(totals.get("wall_seconds", 0) + summary["wall_seconds"], 4)
+
+
+class ParallelBatchWriter(BatchWriter):
+    # Writes keyed by user id, each partition owns a disjoint range of User nodes
+    PARTITION_KEYS = {"users": "id", "user_apps": "user_id", "deleted_user_apps": "user_id",
+                      "memberships": "user_id", "deleted_memberships": "user_id"}
+
+    def __init__(self, session, session_factory: Callable, batch_size: int = 1000, concurrency: int = 4,
+                 logger=None, delete_batch_size: Optional[int] = None, lease=None):
+        """
+        BatchWriter that commits user-keyed batches from several sessions at once
+
+        Rows are split into user id ranges and every range is written on its own session
+        taken from the driver pool. Application nodes are shared between ranges, so
+        deadlocks stay possible and are retried by the driver's managed transactions. Other writes go through the
+        given session one chunk at a time, like BatchWriter.
+
+        Args:
+            session: Open Neo4j session for the sequential writes
+            session_factory: Returns a new session, e.g. Neo4jConnection.get_session
+            batch_size: Number of rows sent per transaction
+            concurrency: Number of sessions writing at the same time
+            logger: Optional logger used to report per-chunk timings
+            delete_batch_size: Relationships or nodes removed per inner transaction when deleting nodes
+            lease: Optional SyncLease checked before every chunk
+        """
+        super().__init__(session, batch_size, logger, delete_batch_size, lease)
+        self.session_factory = session_factory
+        self.concurrency = max(1, int(concurrency))
+
+    def _write(self, name: str, tx_function, rows: List[Dict]) -> Dict:
+        key = self.PARTITION_KEYS.get(name)
+        if key is None or self.concurrency == 1 or len(rows) <= self.batch_size:
+            return super()._write(name, tx_function, rows)
+
+        started = time.perf_counter()
+        partitions = partition_by_key(rows, key, self.concurrency)
+        with ThreadPoolExecutor(max_workers=len(partitions), thread_name_prefix=f"neo4j-{name}") as executor:
+            write_partition = profiling.bind(self._write_partition)
+            results = list(executor.map(lambda part: write_partition(name, tx_function, part), partitions))
+        chunk_timings = [elapsed for result in results for elapsed in result]
+
+        summary = {
+            "rows": len(rows),
+            "chunks": len(chunk_timings),
+            "seconds": round(sum(chunk_timings), 4),
+            "max_chunk_seconds": max(chunk_timings, default=0.0),
+            "chunk_seconds": chunk_timings,
+            "wall_seconds": round(time.perf_counter() - started, 4),
+        }
+        self._record(name, summary)
+        if self.logger:
+            self.logger.info(f"{name}: wrote {len(rows)} rows in {summary['chunks']} chunks over "
+                             f"{len(partitions)} sessions ({summary['wall_seconds']}s)")
+        return summary
+
+    def _write_partition(self, name: str, tx_function, rows: List[Dict]) -> List[float]:
+        """Write one key range on its own session, returning the chunk timings"""
+        chunk_timings = []
+        with self.session_factory() as session:
+            for chunk in chunked(rows, self.batch_size):
+                self.check_lease()
+                started = time.perf_counter()
+                self._write_chunk(session, name, tx_function, chunk)
+                elapsed = time.perf_counter() - started
+                NEO4J_ROWS_WRITTEN.inc(len(chunk), query=tx_function.__name__)
+                chunk_timings.append(round(elapsed, 4))
+        return chunk_timings
+
+    def _write_chunk(self, session, name: str, tx_function, chunk: List[Dict]):
+        """Commit a chunk, counting the deadlocks and other transient errors the driver retried"""
+        attempts = 0
+
+        @functools.wraps(tx_function)
+        def work(tx, rows):
+            nonlocal attempts
+            attempts += 1
+            if attempts > 1:
+                # write_transaction retries transient errors itself, for up to max_transaction_retry_time
+                NEO4J_TRANSACTION_RETRIES.inc(query=tx_function.__name__)
+                if self.logger:
+                    self.logger.warning(f"{name}: transient error, retry {attempts - 1}")
+            return tx_function(tx, rows)
+
+        session.write_transaction(work, chunk)
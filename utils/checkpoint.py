@@ -0,0 +1,109 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Set
+
+
+class SyncCheckpoint:
+    def __init__(self, path: str, max_age_hours: float = 12):
+        """
+        Append-only on-disk record of a full sync's committed progress
+
+        The first line describes the run, every following line is appended after a
+        batch was committed to Neo4j and holds the Okta users page to resume from, the
+        users and apps that batch covered and the chunk sequence number. Appending
+        keeps each checkpoint O(batch) instead of rewriting the whole state, and a
+        torn last line from a crash is simply ignored on load.
+
+        Args:
+            path: Checkpoint file location
+            max_age_hours: Checkpoints older than this are discarded, Okta cursors expire
+        """
+        self.path = path
+        self.max_age = timedelta(hours=max_age_hours)
+        self.started: Optional[str] = None
+        self.resume_url: Optional[str] = None
+        self.committed_users: Set[str] = set()
+        self.seen_apps: Set[str] = set()
+        self.committed_chunks = 0
+
+    @property
+    def resuming(self) -> bool:
+        return self.committed_chunks > 0
+
+    def load(self) -> bool:
+        """
+        Read an unfinished run from disk
+
+        Returns:
+            True when a usable checkpoint was found
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+        if not entries or entries[0].get("type") != "start":
+            self.clear()
+            return False
+        started = datetime.fromisoformat(entries[0]["started"])
+        if datetime.now(timezone.utc) - started > self.max_age:
+            self.clear()
+            return False
+
+        self.started = entries[0]["started"]
+        for entry in entries[1:]:
+            self.resume_url = entry["resume_url"]
+            self.committed_users.update(entry["users"])
+            self.seen_apps.update(entry["apps"])
+            self.committed_chunks = entry["chunk"]
+        return True
+
+    def begin(self, started: datetime):
+        """Start a fresh checkpoint file for a new run"""
+        self.started = started.isoformat()
+        self.resume_url = None
+        self.committed_users = set()
+        self.seen_apps = set()
+        self.committed_chunks = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "start", "started": self.started}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def commit(self, resume_url: Optional[str], users: Iterable[str], apps: Iterable[str]):
+        """
+        Record a batch whose writes are committed
+
+        Args:
+            resume_url: Okta users page following the last page fully written, None when done
+            users: Ids of the users written in this batch
+            apps: Ids of the apps seen in this batch
+        """
+        users = list(users)
+        apps = [app_id for app_id in apps if app_id not in self.seen_apps]
+        self.committed_chunks += 1
+        self.resume_url = resume_url
+        self.committed_users.update(users)
+        self.seen_apps.update(apps)
+        entry = {"chunk": self.committed_chunks, "resume_url": resume_url, "users": users, "apps": apps}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        """Remove the checkpoint after a successful run"""
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
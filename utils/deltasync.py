@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from utils.batchwriter import app_key
+from utils.syncusersutils import get_sync_state, get_user_high_water_mark, save_sync_state
+
+# System log events that change which apps a single user can reach
+ASSIGNMENT_EVENT_TYPES = [
+    "application.user_membership.add",
+    "application.user_membership.remove",
+    "group.user_membership.add",
+    "group.user_membership.remove",
+    "user.lifecycle.delete.initiated",
+]
+
+# Events that change access for every member of a group at once. They cannot be
+# resolved per user cheaply, so seeing one forces a full resync instead.
+FULL_RESYNC_EVENT_TYPES = [
+    "group.application_assignment.add",
+    "group.application_assignment.remove",
+    "application.lifecycle.delete",
+]
+
+
+def okta_timestamp(moment: datetime) -> str:
+    """Format a datetime the way Okta writes lastUpdated, e.g. 2024-01-02T03:04:05.000Z"""
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def parse_okta_timestamp(value: str) -> datetime:
+    """Parse an Okta ISO 8601 timestamp into an aware datetime"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def choose_sync_mode(state: Dict, requested: str, full_sync_interval_hours: float,
+                     now: Optional[datetime] = None) -> str:
+    """
+    Decide whether a run should be incremental or full
+
+    Args:
+        state: Stored sync state from get_sync_state()
+        requested: 'full', 'incremental' or 'auto'
+        full_sync_interval_hours: Maximum age of the last full sync before a full resync is forced
+        now: Current time, defaults to utcnow
+
+    Returns:
+        'full' or 'incremental'
+    """
+    if requested == "full":
+        return "full"
+    if not state.get("cursor") or not state.get("lastFullSync"):
+        # Nothing to build a delta on yet
+        return "full"
+    if requested == "incremental":
+        return "incremental"
+    now = now or datetime.now(timezone.utc)
+    last_full = parse_okta_timestamp(state["lastFullSync"])
+    if now - last_full >= timedelta(hours=full_sync_interval_hours):
+        return "full"
+    return "incremental"
+
+
+def load_sync_state(session) -> Dict:
+    """Read the stored sync state from Neo4j"""
+    return session.read_transaction(get_sync_state)
+
+
+def record_sync(session, mode: str, started: datetime):
+    """Move the sync cursor to the start of a successful run"""
+    stamp = okta_timestamp(started)
+    state = {"cursor": stamp, "lastSync": stamp, "lastSyncMode": mode}
+    if mode == "full":
+        state["lastFullSync"] = stamp
+    session.write_transaction(save_sync_state, state)
+
+
+def run_incremental_sync(session, okta_factory, writer, state: Dict, started: datetime,
+                         overlap_seconds: int = 300, logger=None, job=None) -> Dict:
+    """
+    Apply only the users and assignments changed since the stored cursor
+
+    Changed users are found with the lastUpdated high-water mark already written onto
+    User nodes. Assignment changes, which do not touch lastUpdated, are found in the
+    system log since the stored cursor. The appLinks of every affected user are fetched
+    again and their USES edges replaced.
+
+    Args:
+        session: Open Neo4j session
+        okta_factory: OktaFactory instance
+        writer: BatchWriter bound to session
+        state: Stored sync state from load_sync_state()
+        started: Start time of this run, the upper bound of the system log window
+        overlap_seconds: How far before the cursor to re-read the log, for late events
+        logger: Optional logger
+        job: Optional SyncJob receiving phase and progress updates
+
+    Returns:
+        Counts for the response, or {'needs_full_sync': True, ...} when the delta
+        cannot be applied safely
+    """
+    log_since = okta_timestamp(parse_okta_timestamp(state["cursor"]) - timedelta(seconds=overlap_seconds))
+    # Users written by a failed run can carry a lastUpdated newer than the last successful
+    # sync, so never start the users query after the overlapped cursor
+    hwm = session.read_transaction(get_user_high_water_mark)
+    hwm = min(hwm, log_since, key=parse_okta_timestamp) if hwm else log_since
+    log_until = okta_timestamp(started)
+    if logger:
+        logger.info(f"Incremental sync: users updated after {hwm}, log events since {log_since}")
+
+    _phase(job, "fetch_changes")
+    changed_users = {user["id"]: user for user in okta_factory.iter_users_updated_since(hwm)}
+
+    affected_ids = set()
+    deleted_ids = set()
+    for event in okta_factory.iter_system_log_events(log_since, log_until,
+                                                     ASSIGNMENT_EVENT_TYPES + FULL_RESYNC_EVENT_TYPES):
+        event_type = event.get("eventType")
+        if event_type in FULL_RESYNC_EVENT_TYPES:
+            if logger:
+                logger.info(f"Incremental sync: '{event_type}' affects many users, falling back to full sync")
+            return {"needs_full_sync": True, "reason": event_type}
+        user_targets = [t["id"] for t in event.get("target") or [] if t.get("type") == "User"]
+        if event_type == "user.lifecycle.delete.initiated":
+            deleted_ids.update(user_targets)
+        else:
+            affected_ids.update(user_targets)
+
+    # Users whose assignments changed but whose profile did not are missing from the
+    # lastUpdated query, look them up individually
+    for user_id in affected_ids - set(changed_users) - deleted_ids:
+        user = okta_factory.get_user_by_id(user_id)
+        if user:
+            changed_users[user_id] = user
+
+    active_users = [user for user in changed_users.values() if user.get("status") == "ACTIVE"]
+    deleted_ids.update(user_id for user_id, user in changed_users.items() if user.get("status") != "ACTIVE")
+
+    if job:
+        job.set_counter("users_changed", len(active_users))
+        job.set_counter("users_to_remove", len(deleted_ids))
+
+    _phase(job, "fetch_apps")
+    progress_callback = None
+    if job:
+        progress_callback = lambda done: job.set_counter("app_links_fetched", done)
+    user_apps = okta_factory.get_apps_for_users(active_users, progress_callback=progress_callback)
+    all_apps = {}
+    for apps in user_apps.values():
+        for app in apps:
+            all_apps[app_key(app)] = app
+
+    _phase(job, "write")
+    writer.write_users(active_users)
+    writer.write_apps(all_apps.values())
+    relationships_deleted = writer.cleanup_user_apps(
+        {user_id: [app_key(app) for app in apps] for user_id, apps in user_apps.items()})
+    writer.write_user_apps(user_apps)
+    if deleted_ids:
+        writer.delete_users(sorted(deleted_ids))
+
+    return {
+        "needs_full_sync": False,
+        "users_processed": len(active_users),
+        "users_removed": len(deleted_ids),
+        "relationships_deleted": relationships_deleted,
+        "applications_processed": len(all_apps),
+    }
+
+
+def _phase(job, name: str):
+    if job:
+        job.start_phase(name)
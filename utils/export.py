@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+from typing import Callable, Dict, Iterator, List
+
+CSV_COLUMNS = ["user_id", "email", "login", "status", "app_id", "app_label", "app_name"]
+
+
+# Neo4j transaction functions - keyset pages ordered by id, served by the id constraints
+def export_apps_page(tx, after_id, limit):
+    """Return up to limit applications with id greater than after_id"""
+    query = """
+    MATCH (a:Application)
+    WHERE a.id > $after_id
+    RETURN a
+    ORDER BY a.id
+    LIMIT $limit
+    """
+    return [dict(record["a"]) for record in tx.run(query, after_id=after_id, limit=limit)]
+
+def export_users_page(tx, after_id, limit):
+    """Return up to limit users with id greater than after_id, each with the apps they use"""
+    query = """
+    MATCH (u:User)
+    WHERE u.id > $after_id
+    WITH u
+    ORDER BY u.id
+    LIMIT $limit
+    OPTIONAL MATCH (u)-[:USES]->(a:Application)
+    WITH u, collect(a {.id, .label, .appName}) AS apps
+    RETURN u, apps
+    ORDER BY u.id
+    """
+    return [
+        {"user": dict(record["u"]), "apps": record["apps"]}
+        for record in tx.run(query, after_id=after_id, limit=limit)
+    ]
+
+
+def iter_pages(session, transaction_function, page_size: int,
+               key: Callable[[Dict], str]) -> Iterator[List[Dict]]:
+    """
+    Walk a keyset-paginated transaction function until a short page comes back
+
+    Args:
+        session: Open Neo4j session
+        transaction_function: Function taking (tx, after_id, limit)
+        page_size: Rows per page
+        key: Returns the id of a row, the last one of a page is the next after_id
+    """
+    after_id = ""
+    while True:
+        page = session.read_transaction(transaction_function, after_id, page_size)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after_id = key(page[-1])
+
+
+def _app_key(row: Dict) -> str:
+    return row["id"]
+
+def _user_key(row: Dict) -> str:
+    return row["user"]["id"]
+
+
+def stream_ndjson(neo4j_conn, page_size: int) -> Iterator[str]:
+    """
+    Stream the access graph as NDJSON, applications first, then one line per user
+    with the ids of the applications they use
+    """
+    with neo4j_conn.get_session() as session:
+        for page in iter_pages(session, export_apps_page, page_size, _app_key):
+            yield "".join(json.dumps({"type": "application", **app}, default=str) + "\n" for app in page)
+        for page in iter_pages(session, export_users_page, page_size, _user_key):
+            yield "".join(
+                json.dumps({"type": "user", **row["user"], "apps": [app["id"] for app in row["apps"]]},
+                           default=str) + "\n"
+                for row in page
+            )
+
+
+def stream_csv(neo4j_conn, page_size: int) -> Iterator[str]:
+    """Stream one CSV row per USES relationship, users without apps get one row with empty app columns"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    with neo4j_conn.get_session() as session:
+        for page in iter_pages(session, export_users_page, page_size, _user_key):
+            for row in page:
+                user = row["user"]
+                user_columns = [user.get("id"), user.get("email"), user.get("login"), user.get("status")]
+                for app in row["apps"] or [{}]:
+                    writer.writerow(user_columns + [app.get("id"), app.get("label"), app.get("appName")])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,137 @@
+from typing import Dict, List, Set
+
+from utils.batchwriter import group_to_row
+
+
+# Neo4j transaction functions - bulk reads of the stored group graph
+def read_groups_state(tx):
+    """Return {group_id: row} for every Group node, with the fields written by group_to_row()"""
+    query = """
+    MATCH (g:Group)
+    RETURN g {.id, .name, .description, type: g.groupType, .lastUpdated, .lastMembershipUpdated} AS row
+    """
+    return {record["row"]["id"]: record["row"] for record in tx.run(query)}
+
+def read_group_members(tx, group_ids):
+    """Return {group_id: set(user_ids)} for a batch of groups"""
+    query = """
+    UNWIND $group_ids AS group_id
+    MATCH (u:User)-[:MEMBER_OF]->(:Group {id: group_id})
+    RETURN group_id, collect(u.id) AS user_ids
+    """
+    return {record["group_id"]: set(record["user_ids"]) for record in tx.run(query, group_ids=group_ids)}
+
+def read_user_ids(tx):
+    """Return the ids of every User node"""
+    return {record["id"] for record in tx.run("MATCH (u:User) RETURN u.id AS id")}
+
+def read_app_ids(tx):
+    """Return the ids of every Application node"""
+    return {record["id"] for record in tx.run("MATCH (a:Application) RETURN a.id AS id")}
+
+def read_grants_state(tx):
+    """Return {app_id: set(group_ids)} for every GRANTS relationship"""
+    query = """
+    MATCH (g:Group)-[:GRANTS]->(a:Application)
+    RETURN a.id AS app_id, collect(g.id) AS group_ids
+    """
+    return {record["app_id"]: set(record["group_ids"]) for record in tx.run(query)}
+
+
+def sync_groups(session, okta_factory, writer, logger=None, job=None, group_batch: int = 50) -> Dict:
+    """
+    Mirror Okta groups, memberships and app-group assignments into the graph
+
+    Writes (:Group) nodes, (:User)-[:MEMBER_OF]->(:Group) and
+    (:Group)-[:GRANTS]->(:Application) relationships. Memberships are fetched
+    concurrently and diffed against the graph group_batch groups at a time, so only
+    changed relationships are written and memory stays bounded by the batch and the
+    fetch window of OktaFactory.iter_group_members(). Members
+    and apps missing from the graph (inactive users, apps nobody is assigned to) are
+    skipped, so run it after the users and apps are written.
+
+    Args:
+        session: Open Neo4j session
+        okta_factory: OktaFactory used for the group endpoints
+        writer: BatchWriter bound to session
+        logger: Optional logger
+        job: Optional SyncJob receiving progress counters
+        group_batch: Number of groups whose members are diffed together
+
+    Returns:
+        Counts for the /syncusers response
+    """
+    counts = dict.fromkeys(("groups_processed", "groups_added", "groups_deleted", "memberships_added",
+                            "memberships_deleted", "grants_added", "grants_deleted"), 0)
+
+    # Groups
+    groups = okta_factory.get_groups()
+    stored_groups = session.read_transaction(read_groups_state)
+    rows = [group_to_row(group) for group in groups]
+    changed = [row for row in rows if stored_groups.get(row["id"]) != row]
+    if changed:
+        writer.write_group_rows(changed)
+    group_ids = [row["id"] for row in rows]
+    counts["groups_processed"] = len(group_ids)
+    counts["groups_added"] = sum(1 for row in rows if row["id"] not in stored_groups)
+
+    # Memberships, group by group as they arrive
+    user_ids = session.read_transaction(read_user_ids)
+    done = 0
+    members_batch: Dict[str, List[str]] = {}
+    for group_id, member_ids in okta_factory.iter_group_members(group_ids):
+        members_batch[group_id] = [user_id for user_id in member_ids if user_id in user_ids]
+        if len(members_batch) >= group_batch:
+            _write_memberships(session, writer, members_batch, counts)
+            done += len(members_batch)
+            members_batch = {}
+            if job:
+                job.set_counter("groups_fetched", done)
+    if members_batch:
+        _write_memberships(session, writer, members_batch, counts)
+
+    # App-group assignments
+    known_apps = session.read_transaction(read_app_ids)
+    app_ids = [app["id"] for app in okta_factory.get_active_apps() if app["id"] in known_apps]
+    grants = okta_factory.get_app_group_grants(app_ids)
+    group_set = set(group_ids)
+    stored_grants = session.read_transaction(read_grants_state)
+    to_add, to_delete = [], []
+    for app_id in set(grants) | set(stored_grants):
+        wanted = set(grants.get(app_id, [])) & group_set
+        stored = stored_grants.get(app_id, set())
+        to_add.extend({"group_id": group_id, "app_id": app_id} for group_id in wanted - stored)
+        to_delete.extend({"group_id": group_id, "app_id": app_id} for group_id in stored - wanted)
+    if to_add:
+        writer.write_grant_rows(to_add)
+    if to_delete:
+        writer.delete_grant_rows(to_delete)
+    counts["grants_added"] = len(to_add)
+    counts["grants_deleted"] = len(to_delete)
+
+    # Groups gone from Okta take their relationships with them
+    departed = sorted(set(stored_groups) - set(group_ids))
+    if departed:
+        writer.delete_groups(departed)
+    counts["groups_deleted"] = len(departed)
+
+    if logger:
+        logger.info(f"Group sync: {counts}")
+    return counts
+
+
+def _write_memberships(session, writer, members_batch: Dict[str, List[str]], counts: Dict):
+    """Diff a batch of groups' members against the graph and write the difference"""
+    stored: Dict[str, Set[str]] = session.read_transaction(read_group_members, list(members_batch))
+    to_add, to_delete = [], []
+    for group_id, member_ids in members_batch.items():
+        wanted = set(member_ids)
+        current = stored.get(group_id, set())
+        to_add.extend({"user_id": user_id, "group_id": group_id} for user_id in wanted - current)
+        to_delete.extend({"user_id": user_id, "group_id": group_id} for user_id in current - wanted)
+    if to_add:
+        writer.write_membership_rows(to_add)
+    if to_delete:
+        writer.delete_membership_rows(to_delete)
+    counts["memberships_added"] += len(to_add)
+    counts["memberships_deleted"] += len(to_delete)
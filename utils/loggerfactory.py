@@ -1,4 +1,10 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from threading import Lock
 
 try:
@@ -22,33 +28,94 @@ class ColorFormatter(logging.Formatter):
         message = super().format(record)
         return f"{color}{message}{self.RESET}"
 
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors that parse structured output"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _InProcessQueueHandler(QueueHandler):
+    """QueueHandler for a listener in the same process, records keep their exc_info for the real formatter"""
+
+    def prepare(self, record):
+        # The default prepare() formats the traceback into msg and drops exc_info, which
+        # leaves JsonFormatter nothing to put in "exception". Only the arguments are
+        # merged, so the record no longer refers to objects the caller may change
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 class LoggerFactory:
     _instance = None
     _lock = Lock()
     _loggers = {}
+    _listeners = []
 
     def __new__(cls):
-        print(cls._lock)
         if not cls._instance:
             with cls._lock:
                 if not cls._instance:
                     cls._instance = super(LoggerFactory, cls).__new__(cls)
         return cls._instance
  
-    def get_logger(self, name: str, use_gcp: bool = False) -> logging.Logger:
+    def get_logger(self, name: str, use_gcp: bool = False, use_queue: bool = False,
+                   json_format: bool = False) -> logging.Logger:
+        """
+        Return the logger for name, configured on first use
+
+        Args:
+            name: Logger name
+            use_gcp: Send records to Google Cloud Logging when the client library is installed
+            use_queue: Only enqueue records on the calling thread, a QueueListener thread
+                       formats them and runs the stream or GCP handler
+            json_format: Format stream output as JSON lines instead of colored text
+        """
         key = f"{name}_gcp" if use_gcp else name
         if key not in self._loggers:
             logger = logging.getLogger(name)
             if use_gcp and GCP_LOGGING_AVAILABLE:
                 client = gcp_logging.Client()
                 handler = client.get_default_handler()
-                logger.addHandler(handler)
-            else:
-                if not logger.hasHandlers():
-                    handler = logging.StreamHandler()
+            elif not logger.hasHandlers():
+                handler = logging.StreamHandler()
+                if json_format:
+                    formatter = JsonFormatter()
+                else:
                     formatter = ColorFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-                    handler.setFormatter(formatter)
-                    logger.addHandler(handler)
+                handler.setFormatter(formatter)
+            else:
+                handler = None
+
+            if handler is not None:
+                if use_queue:
+                    # Unbounded so logging never blocks the caller, the listener drains it
+                    log_queue = queue.SimpleQueue()
+                    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+                    listener.start()
+                    self._listeners.append(listener)
+                    handler = _InProcessQueueHandler(log_queue)
+                logger.addHandler(handler)
             logger.setLevel(logging.DEBUG)
             self._loggers[key] = logger
         return self._loggers[key]
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the queue listeners, writing out the records still queued"""
+        with cls._lock:
+            listeners, cls._listeners = cls._listeners, []
+        for listener in listeners:
+            listener.stop()
+
+
+atexit.register(LoggerFactory.shutdown)
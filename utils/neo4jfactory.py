@@ -1,5 +1,51 @@
-import json
+import time
 from neo4j import GraphDatabase
+from utils import profiling
+from utils.profiling import CountingTransaction
+from utils.metrics import NEO4J_TRANSACTION_SECONDS
+
+class InstrumentedSession:
+    """Neo4j session wrapper that records transaction latency by transaction function name"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def write_transaction(self, transaction_function, *args, **kwargs):
+        return self._execute(self._session.write_transaction, transaction_function, args, kwargs)
+
+    def read_transaction(self, transaction_function, *args, **kwargs):
+        return self._execute(self._session.read_transaction, transaction_function, args, kwargs)
+
+    def _execute(self, execute, transaction_function, args, kwargs):
+        name = transaction_function.__name__
+        if not profiling.active():
+            with NEO4J_TRANSACTION_SECONDS.time(query=name):
+                return execute(transaction_function, *args, **kwargs)
+
+        # Profiled syncs also collect the result summary counters of every statement
+        counters = {}
+        def counted_transaction(tx, *tx_args, **tx_kwargs):
+            counting = CountingTransaction(tx)
+            value = transaction_function(counting, *tx_args, **tx_kwargs)
+            # A retried transaction function only reports its last attempt
+            counters.clear()
+            counters.update(counting.consume_counters())
+            return value
+
+        started = time.perf_counter()
+        with NEO4J_TRANSACTION_SECONDS.time(query=name):
+            value = execute(counted_transaction, *args, **kwargs)
+        profiling.record(f"neo4j {name}", time.perf_counter() - started, counters)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._session.__exit__(exc_type, exc_value, traceback)
 
 class Neo4jConnection:
     def __init__(self, uri, user, password):
@@ -10,7 +56,7 @@ class Neo4jConnection:
         self.driver.close()
     
     def get_session(self):
-        return self.driver.session()
+        return InstrumentedSession(self.driver.session())
     
     # Methods for creating users, apps, relationships, and cleanup
     def create_user(self, user):
@@ -61,41 +107,6 @@ class Neo4jConnection:
         with self.get_session() as session:
             return session.write_transaction(_assign_app_tx, user_id, app_id)
 
-    def cleanup_users_and_apps(self, user_ids, app_ids):
-        def _cleanup_tx(tx, user_ids, app_ids):
-            # Remove users not in current data
-            query_users = """
-            MATCH (u:User)
-            WHERE NOT u.id IN $user_ids
-            DETACH DELETE u
-            """
-            tx.run(query_users, user_ids=user_ids)
-
-            # Remove apps not in current data
-            query_apps = """
-            MATCH (a:Application)
-            WHERE NOT a.id IN $app_ids
-            DETACH DELETE a
-            """
-            tx.run(query_apps, app_ids=app_ids)
-        
-        with self.get_session() as session:
-            return session.write_transaction(_cleanup_tx, user_ids, app_ids)
-
-    def cleanup_relationships(self, user_apps):
-        def _cleanup_rel_tx(tx, user_apps):
-            # Remove relationships not in current data
-            for user_id, app_ids in user_apps.items():
-                query = """
-                MATCH (u:User {id: $user_id})-[r:ASSIGNED]->(a:Application)
-                WHERE NOT a.id IN $app_ids
-                DELETE r
-                """
-                tx.run(query, user_id=user_id, app_ids=app_ids)
-        
-        with self.get_session() as session:
-            return session.write_transaction(_cleanup_rel_tx, user_apps)
-        
     def remove_duplicate_nodes(self, label, id_field):
         def _remove_duplicates_tx(tx, label, id_field):
             query = f"""
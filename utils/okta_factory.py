@@ -1,68 +1,397 @@
 import requests
 import json
-from typing import List, Dict, Optional
-import time
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+from utils import profiling
+from utils.batchwriter import app_key
+from utils.ratelimiter import OktaRateLimiter, RateLimitedSession
+from utils.responsecache import CachingSession, ResponseCache
+
+ASSIGNMENT_STRATEGIES = ("per_user", "per_app")
+# Page sizes of /api/v1/apps and /api/v1/apps/{appId}/users
+APPS_PAGE_LIMIT = 200
+APP_USERS_PAGE_LIMIT = 500
+# Page sizes of /api/v1/groups, /api/v1/groups/{groupId}/users and /api/v1/apps/{appId}/groups
+GROUPS_PAGE_LIMIT = 1000
+GROUP_USERS_PAGE_LIMIT = 1000
+APP_GROUPS_PAGE_LIMIT = 200
+
+
+def estimate_assignment_requests(user_count: int, app_count: int, assignment_count: int) -> Dict[str, int]:
+    """
+    Estimate the Okta requests each assignment fetch strategy needs
+
+    per_user reads /users/{id}/appLinks once per user. per_app lists the apps and reads
+    /apps/{id}/users for each of them, one request per started page of assignments.
+
+    Args:
+        user_count: Number of active users, e.g. from the last sync
+        app_count: Number of active apps
+        assignment_count: Number of user-app assignments, e.g. from the last sync
+    """
+    return {
+        "per_user": user_count,
+        "per_app": math.ceil(app_count / APPS_PAGE_LIMIT) + app_count + math.ceil(assignment_count / APP_USERS_PAGE_LIMIT),
+    }
+
+
+def app_to_link(app: Dict) -> Dict:
+    """Shape an /api/v1/apps object like the appLinks entry of its users"""
+    links = app.get("_links", {})
+    app_links = links.get("appLinks") or [{}]
+    logos = links.get("logo") or [{}]
+    return {
+        "id": app["id"],
+        "label": app.get("label", ""),
+        "linkUrl": app_links[0].get("href", ""),
+        "appName": app.get("name", ""),
+        "logoUrl": logos[0].get("href", ""),
+        "status": app.get("status", ""),
+        "signOnMode": app.get("signOnMode", ""),
+        "appInstanceId": app["id"],
+        "sortOrder": 0,
+    }
+
+
+class UnchangedAppLinks(list):
+    """
+    appLinks of a user whose payload is the one applied by the last successful sync
+
+    Holds {"id": app_id} stubs instead of the parsed links, which is all the relationship
+    diff needs. load() parses the cached payload when the full links are wanted.
+    """
+
+    def __init__(self, app_ids: List[str], loader: Callable[[], List[Dict]]):
+        super().__init__({"id": app_id} for app_id in app_ids)
+        self._loader = loader
+
+    def load(self) -> List[Dict]:
+        return self._loader()
+
 
 class OktaFactory:
-    def __init__(self, base_url: str, api_token: str):
+    def __init__(self, base_url: str, api_token: str, max_workers: int = 1,
+                 rate_limiter: Optional[OktaRateLimiter] = None, response_cache: Optional[ResponseCache] = None,
+                 logger: Optional[logging.Logger] = None):
         """
         Initialize Okta factory with base URL and API token
         
         Args:
             base_url: Okta domain URL (e.g., 'https://paloaltonetworks.oktapreview.com')
             api_token: Okta API token (SSWS token)
+            max_workers: Number of concurrent per-user requests in get_apps_for_users
+            rate_limiter: Limiter shared by all requests of this factory, created when omitted
+            response_cache: Optional on-disk cache answering user and appLinks reads with
+                            conditional requests
+            logger: Logger for progress and errors, per-page and per-user progress is
+                    logged at debug level. Defaults to this module's logger.
         """
+        self.logger = logger or logging.getLogger(__name__)
         self.base_url = base_url.rstrip('/')
         self.headers = {
             'Authorization': f'SSWS {api_token}',
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
-        self.session = requests.Session()
+        self.response_cache = response_cache
+        if response_cache is not None:
+            self.session = CachingSession(response_cache, rate_limiter)
+        else:
+            self.session = RateLimitedSession(rate_limiter)
         self.session.headers.update(self.headers)
+        self.max_workers = max(1, int(max_workers))
+        # Keep one pooled connection per worker so threads do not queue on the pool
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.assignment_strategy = "per_user"
+        # When set, get_user_app_links returns UnchangedAppLinks for already applied payloads
+        self.skip_unchanged_links = False
+        self._apps = None
+        self._assignments = None
+        self._assignments_lock = threading.Lock()
 
-    def get_all_active_users(self, limit: int = 10) -> List[Dict]:
+    def iter_active_user_pages(self, limit: int = 200) -> Iterator[List[Dict]]:
         """
-        Get all active users from Okta (ONLY USERS, NO APPS)
+        Stream active users from Okta page by page, following every Link rel="next"
         
         Args:
             limit: Number of users per page (max 200)
             
-        Returns:
-            List of user objects
+        Yields:
+            List of user objects for each page, as soon as the page arrives
+            
+        Raises:
+            requests.exceptions.RequestException: If a page cannot be fetched. A partial
+            user list must never be mistaken for the full org.
+        """
+        for page_users, _ in self.iter_active_user_pages_with_cursor(limit=limit):
+            yield page_users
+
+    def iter_active_user_pages_with_cursor(self, resume_url: Optional[str] = None,
+                                           limit: int = 200) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """
+        Stream active users page by page together with the URL of the following page
+        
+        Args:
+            resume_url: Page URL recorded by an earlier run to continue from, None for the first page
+            limit: Number of users per page (max 200), ignored when resuming
+            
+        Yields:
+            (users, next_url) for each page, next_url is None on the last page
         """
-        users = []
+        if resume_url:
+            yield from self._iter_pages_with_next(resume_url, None, "users")
+            return
         url = f"{self.base_url}/api/v1/users"
         params = {
             'filter': 'status eq "ACTIVE"',
-            'limit': limit
+            'limit': min(limit, 200)
         }
+        yield from self._iter_pages_with_next(url, params, "users")
+
+    def iter_users_updated_since(self, since: str, limit: int = 200) -> Iterator[Dict]:
+        """
+        Stream users of any status whose lastUpdated is after a timestamp
         
-        while url:
-            try:
-                response = self.session.get(url, params=params if '?' not in url else None)
-                response.raise_for_status()
-                
-                page_users = response.json()
-                users.extend(page_users)
-                
-                # Check for pagination
-                links = response.headers.get('Link', '')
-                next_url = self._parse_next_link(links)
-                url = next_url
-                params = None  # Clear params for subsequent requests
-                
-                print(f"Retrieved {len(page_users)} users (Total: {len(users)})")
-                
-                # Rate limiting - be respectful to Okta API
-                time.sleep(0.1)
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching users: {e}")
-                break
-            break
-                
-        return users
+        Args:
+            since: ISO 8601 timestamp, e.g. the lastUpdated high-water mark in Neo4j
+            limit: Number of users per page (max 200)
+            
+        Yields:
+            User objects, including deactivated ones so they can be removed
+        """
+        url = f"{self.base_url}/api/v1/users"
+        params = {
+            'filter': f'lastUpdated gt "{since}"',
+            'limit': min(limit, 200)
+        }
+        for page_users in self._iter_pages(url, params, "updated users"):
+            yield from page_users
+
+    def iter_system_log_events(self, since: str, until: str, event_types: List[str],
+                               limit: int = 1000) -> Iterator[Dict]:
+        """
+        Stream system log events of the given types in a bounded time window
+        
+        Args:
+            since: ISO 8601 start of the window (the stored sync cursor)
+            until: ISO 8601 end of the window, bounding the log so pagination ends
+            event_types: Event types to include, e.g. 'application.user_membership.add'
+            limit: Number of events per page (max 1000)
+            
+        Yields:
+            System log event objects
+        """
+        url = f"{self.base_url}/api/v1/logs"
+        params = {
+            'since': since,
+            'until': until,
+            'filter': ' or '.join(f'eventType eq "{event_type}"' for event_type in event_types),
+            'sortOrder': 'ASCENDING',
+            'limit': min(limit, 1000)
+        }
+        for page_events in self._iter_pages(url, params, "log events"):
+            yield from page_events
+
+    def iter_active_users(self, limit: int = 200) -> Iterator[Dict]:
+        """
+        Stream active users from Okta one at a time, fetching pages lazily
+        
+        Args:
+            limit: Number of users per page (max 200)
+            
+        Yields:
+            User objects
+        """
+        for page_users in self.iter_active_user_pages(limit):
+            yield from page_users
+
+    def get_all_active_users(self, limit: int = 200) -> List[Dict]:
+        """
+        Get all active users from Okta (ONLY USERS, NO APPS)
+        
+        Args:
+            limit: Number of users per page (max 200)
+            
+        Returns:
+            List of user objects
+        """
+        return list(self.iter_active_users(limit))
+
+    def get_active_apps(self) -> List[Dict]:
+        """
+        Get all active applications of the org, read once per factory
+        
+        Returns:
+            List of app objects from /api/v1/apps
+        """
+        if self._apps is None:
+            url = f"{self.base_url}/api/v1/apps"
+            params = {
+                'filter': 'status eq "ACTIVE"',
+                'limit': APPS_PAGE_LIMIT
+            }
+            self._apps = [app for page in self._iter_pages(url, params, "apps") for app in page]
+        return self._apps
+
+    def get_app_user_ids(self, app_id: str) -> List[str]:
+        """
+        Get the ids of all users assigned to an application, directly or through a group
+        
+        Args:
+            app_id: Okta app id
+            
+        Returns:
+            List of user ids
+        """
+        url = f"{self.base_url}/api/v1/apps/{app_id}/users"
+        params = {'limit': APP_USERS_PAGE_LIMIT}
+        return [app_user["id"] for page in self._iter_pages(url, params, f"users of app {app_id}")
+                for app_user in page]
+
+    def get_app_assignments(self, progress_callback: Optional[Callable[[int], None]] = None) -> Dict[str, List[Dict]]:
+        """
+        Get every user's applications by paging through the users of each app
+        
+        Args:
+            progress_callback: Optional function called with the number of apps fetched so far
+            
+        Returns:
+            Dictionary mapping user_id to list of applications, shaped like appLinks
+        """
+        apps = self.get_active_apps()
+        links = [app_to_link(app) for app in apps]
+        user_apps: Dict[str, List[Dict]] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="okta-app-users") as executor:
+            results = executor.map(profiling.bind(self.get_app_user_ids), [app["id"] for app in apps])
+            for i, (link, user_ids) in enumerate(zip(links, results)):
+                # Every user of the app shares the same link dict
+                for user_id in user_ids:
+                    user_apps.setdefault(user_id, []).append(link)
+                if progress_callback:
+                    progress_callback(i + 1)
+        self.logger.info(f"Retrieved assignments of {len(apps)} apps for {len(user_apps)} users")
+        return user_apps
+
+    def get_groups(self) -> List[Dict]:
+        """
+        Get all groups of the org
+        
+        Returns:
+            List of group objects from /api/v1/groups
+        """
+        url = f"{self.base_url}/api/v1/groups"
+        params = {'limit': GROUPS_PAGE_LIMIT}
+        return [group for page in self._iter_pages(url, params, "groups") for group in page]
+
+    def get_group_member_ids(self, group_id: str) -> List[str]:
+        """
+        Get the ids of all members of a group
+        
+        Args:
+            group_id: Okta group id
+            
+        Returns:
+            List of user ids
+        """
+        url = f"{self.base_url}/api/v1/groups/{group_id}/users"
+        params = {'limit': GROUP_USERS_PAGE_LIMIT}
+        return [user["id"] for page in self._iter_pages(url, params, f"members of group {group_id}")
+                for user in page]
+
+    def get_app_group_ids(self, app_id: str) -> List[str]:
+        """
+        Get the ids of the groups assigned to an application
+        
+        Args:
+            app_id: Okta app id
+            
+        Returns:
+            List of group ids
+        """
+        url = f"{self.base_url}/api/v1/apps/{app_id}/groups"
+        params = {'limit': APP_GROUPS_PAGE_LIMIT}
+        return [assignment["id"] for page in self._iter_pages(url, params, f"groups of app {app_id}")
+                for assignment in page]
+
+    def iter_group_members(self, group_ids: List[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Fetch the members of many groups concurrently
+        
+        Only 2 * max_workers groups are requested ahead of the consumer, so a slow
+        consumer holds a bounded number of member lists instead of the whole org's.
+        
+        Args:
+            group_ids: Okta group ids
+            
+        Yields:
+            (group_id, member user ids) in the order of group_ids
+        """
+        pending = iter(group_ids)
+        get_members = profiling.bind(self.get_group_member_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="okta-group-users") as executor:
+            window = deque((group_id, executor.submit(get_members, group_id))
+                           for group_id in islice(pending, 2 * self.max_workers))
+            while window:
+                group_id, future = window.popleft()
+                for next_id in islice(pending, 1):
+                    window.append((next_id, executor.submit(get_members, next_id)))
+                yield group_id, future.result()
+
+    def get_app_group_grants(self, app_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Fetch the group assignments of many applications concurrently
+        
+        Args:
+            app_ids: Okta app ids
+            
+        Returns:
+            Dictionary mapping app_id to the ids of the groups granting it
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="okta-app-groups") as executor:
+            return dict(zip(app_ids, executor.map(profiling.bind(self.get_app_group_ids), app_ids)))
+
+    def select_assignment_strategy(self, strategy: str, user_count: int, assignment_count: int) -> str:
+        """
+        Decide how get_apps_for_users fetches assignments for the rest of this factory's life
+        
+        Args:
+            strategy: 'per_user', 'per_app' or 'auto' to pick the one needing fewer requests
+            user_count: Expected number of active users, e.g. from the last sync
+            assignment_count: Expected number of user-app assignments
+            
+        Returns:
+            The selected strategy
+            
+        Raises:
+            ValueError: If the strategy is unknown
+        """
+        if strategy == "auto":
+            estimate = estimate_assignment_requests(user_count, len(self.get_active_apps()), assignment_count)
+            strategy = min(ASSIGNMENT_STRATEGIES, key=lambda name: estimate[name])
+            self.logger.info(f"Estimated Okta requests per assignment strategy: {estimate}, using {strategy}")
+        elif strategy not in ASSIGNMENT_STRATEGIES:
+            raise ValueError(f"Unknown assignment strategy '{strategy}', expected auto, per_user or per_app")
+        self.assignment_strategy = strategy
+        return strategy
+
+    def _apps_from_assignments(self, users: List[Dict],
+                               progress_callback: Optional[Callable[[int], None]]) -> Dict[str, List[Dict]]:
+        """Answer get_apps_for_users from the per-app assignments, fetched on first use"""
+        with self._assignments_lock:
+            if self._assignments is None:
+                self._assignments = self.get_app_assignments()
+        user_apps = {user['id']: self._assignments.get(user['id'], []) for user in users}
+        if progress_callback:
+            progress_callback(len(user_apps))
+        return user_apps
 
     def get_user_app_links(self, user_id: str) -> List[Dict]:
         """
@@ -72,43 +401,82 @@ class OktaFactory:
             user_id: Okta user ID
             
         Returns:
-            List of application link objects
+            List of application link objects, an UnchangedAppLinks when skip_unchanged_links
+            is set and the payload has not changed since the last confirmed sync. Empty for
+            a user deleted since it was listed.
+            
+        Raises:
+            requests.exceptions.RequestException: For any other failure, including a 429
+            left after all retries. An empty list would read as "no apps" and remove the
+            user's relationships.
         """
         url = f"{self.base_url}/api/v1/users/{user_id}/appLinks"
         
         try:
             response = self.session.get(url)
+            if response.status_code == 404:
+                return []
             response.raise_for_status()
-            return response.json()
+            summary = getattr(response, "cache_summary", None)
+            if self.skip_unchanged_links and getattr(response, "unchanged", False) and summary is not None:
+                # Parse from the cache rather than keep every unchanged body alive until the diff
+                return UnchangedAppLinks(summary.split(",") if summary else [],
+                                         lambda: json.loads(self.response_cache.get(url).body))
+            apps = response.json()
+            if self.response_cache is not None and hasattr(response, "content_digest") and summary is None:
+                self.response_cache.set_summary(url, response.content_digest, ",".join(app_key(app) for app in apps))
+            return apps
             
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching app links for user {user_id}: {e}")
-            return []
+            self.logger.error(f"Error fetching app links for user {user_id}: {e}")
+            raise
 
-    def get_apps_for_users(self, users: List[Dict]) -> Dict[str, List[Dict]]:
+    def get_apps_for_users(self, users: List[Dict], max_workers: Optional[int] = None,
+                           progress_callback: Optional[Callable[[int], None]] = None) -> Dict[str, List[Dict]]:
         """
         Get assigned applications for a list of users
         
         Args:
             users: List of user objects from get_all_active_users()
+            max_workers: Number of concurrent requests, defaults to the factory's max_workers.
+                         A value of 1 fetches users one at a time.
+            progress_callback: Optional function called with the number of users fetched so far
             
         Returns:
             Dictionary mapping user_id to list of applications
         """
-        user_apps = {}
+        if self.assignment_strategy == "per_app":
+            return self._apps_from_assignments(users, progress_callback)
         
-        print(f"Fetching applications for {len(users)} users...")
+        workers = max(1, int(max_workers or self.max_workers))
+        user_ids = [user['id'] for user in users]
         
-        for i, user in enumerate(users):
-            user_id = user['id']
-            user_email = user['profile'].get('email', user_id)
-            print(f"Processing user {i+1}/{len(users)}: {user_email}")
-            
-            apps = self.get_user_app_links(user_id)
-            user_apps[user_id] = apps
-            
-            # Rate limiting
-            time.sleep(0.1)
+        self.logger.debug(f"Fetching applications for {len(users)} users with {workers} worker(s)...")
+        
+        if workers == 1:
+            user_apps = {}
+            for i, user in enumerate(users):
+                user_id = user['id']
+                apps = self.get_user_app_links(user_id)
+                user_apps[user_id] = apps
+                # Report every 100 users, a line per user costs more than the bookkeeping
+                if (i + 1) % 100 == 0 or i + 1 == len(users):
+                    self.logger.debug(f"Fetched applications for {i+1}/{len(users)} users")
+                    if progress_callback:
+                        progress_callback(i + 1)
+                
+            return user_apps
+        
+        # executor.map keeps input order, so the mapping is built in the same order as users
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="okta-applinks") as executor:
+            results = executor.map(profiling.bind(self.get_user_app_links), user_ids)
+            user_apps = {}
+            for i, (user_id, apps) in enumerate(zip(user_ids, results)):
+                user_apps[user_id] = apps
+                if (i + 1) % 1000 == 0:
+                    self.logger.debug(f"Fetched applications for {i+1}/{len(user_ids)} users")
+                if progress_callback and ((i + 1) % 100 == 0 or i + 1 == len(user_ids)):
+                    progress_callback(i + 1)
             
         return user_apps
 
@@ -121,17 +489,63 @@ class OktaFactory:
             
         Returns:
             User object or None if not found
+            
+        Raises:
+            requests.exceptions.RequestException: For any other failure, a user that
+            cannot be read must not be skipped as if it were gone
         """
         url = f"{self.base_url}/api/v1/users/{user_id}"
         
         try:
             response = self.session.get(url)
+            if response.status_code == 404:
+                return None
             response.raise_for_status()
             return response.json()
             
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching user {user_id}: {e}")
-            return None
+            self.logger.error(f"Error fetching user {user_id}: {e}")
+            raise
+
+    def _iter_pages(self, url: str, params: Optional[Dict], label: str) -> Iterator[List[Dict]]:
+        """
+        Follow Link rel="next" headers from a first page, yielding each page
+        
+        Args:
+            url: URL of the first page
+            params: Query parameters of the first page, next links already carry them
+            label: What is being fetched, used in progress messages
+            
+        Yields:
+            List of objects for each non-empty page
+        """
+        for page, _ in self._iter_pages_with_next(url, params, label):
+            yield page
+
+    def _iter_pages_with_next(self, url: str, params: Optional[Dict],
+                              label: str) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """Same as _iter_pages, also yielding the URL of the next page with each page"""
+        total = 0
+        
+        while url:
+            try:
+                response = self.session.get(url, params=params)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Error fetching {label}: {e}")
+                raise
+            
+            page = response.json()
+            # Polling endpoints such as /logs keep returning a next link on empty pages
+            if not page:
+                break
+            total += len(page)
+            self.logger.debug(f"Retrieved {len(page)} {label} (Total: {total})")
+            
+            url = self._parse_next_link(response.headers.get('Link', ''))
+            params = None
+            
+            yield page, url
 
     def _parse_next_link(self, link_header: str) -> Optional[str]:
         """
@@ -153,6 +567,12 @@ class OktaFactory:
                 return url
         return None
 
+    def confirm_cached_responses(self) -> int:
+        """Mark the cached payloads as applied to the graph, call once a sync has committed"""
+        if self.response_cache is None:
+            return 0
+        return self.response_cache.confirm()
+
     def close(self):
         """Close the session"""
         self.session.close()
\ No newline at end of file
@@ -0,0 +1,220 @@
+import queue
+import threading
+from typing import Dict, Optional
+
+from utils import profiling
+from utils.batchwriter import app_key
+from utils.reconcile import GraphDelta, GraphDiffer, GraphState, check_deletion_cap
+
+# Marks the end of a stage's output on its queue
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class SyncPipeline:
+    def __init__(self, okta_factory, writer, state: GraphState, queue_size: int = 4,
+                 logger=None, job=None, checkpoint=None, max_delete_ratio: Optional[float] = None):
+        """
+        Full sync as a producer/consumer pipeline
+
+        Users pages -> appLinks fetch -> diff and batched Neo4j writes. The stages run on
+        their own threads and hand work over through bounded queues, so Okta requests and
+        Neo4j writes overlap and a slow stage holds back the ones before it instead of
+        letting data pile up in memory.
+
+        Args:
+            okta_factory: OktaFactory used for users pages and appLinks
+            writer: BatchWriter, its batch_size decides when buffered rows are flushed
+            state: Current graph from GraphState.load()
+            queue_size: Number of users pages allowed to wait between two stages
+            logger: Optional logger
+            job: Optional SyncJob receiving progress counters
+            checkpoint: Optional SyncCheckpoint, loaded to resume a run or begun for a new one.
+                        Each flush is recorded in it once committed. A page leaving no rows
+                        buffered is flushed right away, and buffered rows are flushed at
+                        least every writer.batch_size users, so a sync that changes little
+                        still records its progress.
+            max_delete_ratio: Largest share of stored users or apps the final deletions may
+                              remove, see check_deletion_cap()
+        """
+        self.okta_factory = okta_factory
+        self.writer = writer
+        self.state = state
+        self.differ = GraphDiffer(state)
+        self.max_delete_ratio = max_delete_ratio
+        self.logger = logger
+        self.job = job
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.fetched = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._pending = GraphDelta()
+        self.counts = GraphDelta().counts()
+        self.users_processed = 0
+        self.checkpoint = checkpoint
+        self._pending_users = []
+        self._pending_apps = set()
+        self._resume_url = None
+        if checkpoint is not None and checkpoint.resuming:
+            # Users and apps committed by the interrupted run still count as seen for deletions
+            self.differ.seen_users.update(checkpoint.committed_users)
+            self.differ.seen_apps.update(checkpoint.seen_apps)
+            self.users_processed = len(checkpoint.committed_users)
+
+    def run(self) -> Dict:
+        """
+        Run all stages to completion, then delete users and apps no longer in Okta
+
+        Returns:
+            Counts for the /syncusers response
+
+        Raises:
+            The first exception raised by any stage. Nothing is deleted in that case.
+            DeletionCapExceeded: If the deletions exceed max_delete_ratio
+        """
+        threads = []
+        if self.checkpoint is not None and self.checkpoint.resuming and self.checkpoint.resume_url is None:
+            # The interrupted run had written every page, only the deletions are left
+            if self.logger:
+                self.logger.info("Checkpoint covers every users page, skipping the fetch")
+        else:
+            threads = [
+                threading.Thread(target=profiling.bind(self._produce_pages), name="sync-users-pages", daemon=True),
+                threading.Thread(target=profiling.bind(self._fetch_app_links), name="sync-applinks", daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+
+        try:
+            if threads:
+                self._consume()
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        # Every page made it through, so anything not seen is gone from Okta
+        deletions = self.differ.finish()
+        check_deletion_cap(self.state, deletions, self.max_delete_ratio)
+        if deletions.user_ids_to_delete:
+            self.writer.delete_users(deletions.user_ids_to_delete)
+        if deletions.app_ids_to_delete:
+            self.writer.delete_apps(deletions.app_ids_to_delete)
+        self._add_counts(deletions)
+
+        return {
+            "users_processed": self.users_processed,
+            "applications_processed": len(self.differ.seen_apps | self.differ.unchanged_apps),
+            **self.counts
+        }
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """Put with backpressure, giving up when another stage failed"""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce_pages(self):
+        try:
+            fetched = 0
+            resume_url = None
+            if self.checkpoint is not None and self.checkpoint.resuming:
+                resume_url = self.checkpoint.resume_url
+                if self.logger:
+                    self.logger.info(f"Resuming users pages from checkpoint chunk {self.checkpoint.committed_chunks}")
+            for page_users, next_url in self.okta_factory.iter_active_user_pages_with_cursor(resume_url):
+                fetched += len(page_users)
+                if self.job:
+                    self.job.set_counter("users_fetched", fetched)
+                if not self._put(self.pages, (page_users, next_url)):
+                    return
+            self._put(self.pages, _DONE)
+        except BaseException as e:
+            self._put(self.pages, _StageError(e))
+
+    def _fetch_app_links(self):
+        try:
+            fetched = 0
+            while not self._stop.is_set():
+                try:
+                    item = self.pages.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is _DONE or isinstance(item, _StageError):
+                    self._put(self.fetched, item)
+                    return
+                users, next_url = item
+                if self.checkpoint is not None and self.checkpoint.committed_users:
+                    # Pages can shift between runs, never fetch a committed user twice
+                    users = [user for user in users if user["id"] not in self.checkpoint.committed_users]
+                user_apps = self.okta_factory.get_apps_for_users(users)
+                fetched += len(users)
+                if self.job:
+                    self.job.set_counter("app_links_fetched", fetched)
+                if not self._put(self.fetched, (users, user_apps, next_url)):
+                    return
+        except BaseException as e:
+            self._put(self.fetched, _StageError(e))
+
+    def _consume(self):
+        while True:
+            item = self.fetched.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            users, user_apps, next_url = item
+            self.users_processed += len(users)
+            self._pending.extend(self.differ.add(users, user_apps))
+            self._pending_users.extend(user["id"] for user in users)
+            self._pending_apps.update(app_key(app) for apps in user_apps.values() for app in apps)
+            self._resume_url = next_url
+            buffered = self._buffered()
+            if not buffered or buffered >= self.writer.batch_size or len(self._pending_users) >= self.writer.batch_size:
+                self._flush()
+        if self._pending_users or self._buffered():
+            self._flush()
+
+    def _buffered(self) -> int:
+        pending = self._pending
+        return max(len(pending.users_to_write), len(pending.apps_to_write),
+                   len(pending.edges_to_add), len(pending.edges_to_delete))
+
+    def _flush(self):
+        """Write buffered rows, nodes before the relationships that MATCH them"""
+        pending, self._pending = self._pending, GraphDelta()
+        if pending.users_to_write:
+            self.writer.write_user_rows(pending.users_to_write)
+        if pending.apps_to_write:
+            self.writer.write_app_rows(pending.apps_to_write)
+        if pending.edges_to_add:
+            self.writer.write_user_app_rows(pending.edges_to_add)
+        if pending.edges_to_delete:
+            self.writer.delete_user_app_rows(pending.edges_to_delete)
+        self._add_counts(pending)
+        # Never record progress made after another process may have taken over
+        self.writer.check_lease()
+        if self.checkpoint is not None:
+            self.checkpoint.commit(self._resume_url, self._pending_users, self._pending_apps)
+            if self.job:
+                self.job.set_counter("checkpoint_chunks", self.checkpoint.committed_chunks)
+        self._pending_users = []
+        self._pending_apps = set()
+        if self.job:
+            self.job.set_counter("rows_written", sum(t["rows"] for t in self.writer.timings.values()))
+        if self.logger:
+            self.logger.debug(f"Pipeline flushed {pending.counts()}")
+
+    def _add_counts(self, delta: GraphDelta):
+        """Keep running totals without holding on to the written rows"""
+        for name, value in delta.counts().items():
+            self.counts[name] += value
@@ -0,0 +1,185 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# Result summary counters kept per Neo4j statement
+COUNTER_FIELDS = ("nodes_created", "nodes_deleted", "relationships_created", "relationships_deleted",
+                  "properties_set")
+
+# Profiler of the sync running in this thread, other threads (e.g. concurrent requests)
+# see None. Plain threads and executors do not inherit context variables, see bind().
+# Coroutines passed to asyncio.run_coroutine_threadsafe() run in a copy of the caller's.
+_active: ContextVar[Optional["SyncProfiler"]] = ContextVar("sync_profiler", default=None)
+
+
+def record(name: str, seconds: float, counters=None):
+    """
+    Add a timed call to the active SyncProfiler, a no-op when no sync is being profiled
+
+    Args:
+        name: Operation name, e.g. 'neo4j merge_users_batch' or 'okta /api/v1/users/{id}/appLinks'
+        seconds: Wall time of the call
+        counters: Optional Neo4j SummaryCounters of the call
+    """
+    profiler = _active.get()
+    if profiler is not None:
+        profiler.add(name, seconds, counters)
+
+def active() -> bool:
+    return _active.get() is not None
+
+def bind(function: Callable) -> Callable:
+    """
+    Make function record into the profiler active in the calling thread, wherever it runs
+
+    Wrap the targets of threads and executors started by a sync, they would otherwise
+    record nothing. Returns function itself when no profiler is active.
+    """
+    profiler = _active.get()
+    if profiler is None:
+        return function
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        token = _active.set(profiler)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active.reset(token)
+    return bound
+
+
+class CountingTransaction:
+    """Transaction proxy keeping every result, so their summary counters can be read before commit"""
+
+    def __init__(self, tx):
+        self._tx = tx
+        self._results = []
+
+    def run(self, query, parameters=None, **kwargs):
+        result = self._tx.run(query, parameters, **kwargs)
+        self._results.append(result)
+        return result
+
+    def consume_counters(self) -> Dict[str, int]:
+        totals = dict.fromkeys(COUNTER_FIELDS, 0)
+        for result in self._results:
+            counters = result.consume().counters
+            for field in COUNTER_FIELDS:
+                totals[field] += getattr(counters, field)
+        return totals
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+class SyncProfiler:
+    def __init__(self, use_cprofile: bool = False, top: int = 30):
+        """
+        Opt-in timing report for one sync
+
+        While activated, every Neo4j transaction function, auto-commit purge statement
+        and Okta request records its wall time, and Neo4j calls also their result
+        summary counters. Activation is scoped to the thread entering the profiler, the
+        sync job thread, and to the worker threads it starts through bind().
+        cProfile, when enabled, covers the sync job thread only; the pipeline and fetch
+        worker threads show up through the recorded calls instead.
+
+        Args:
+            use_cprofile: Also run cProfile on the calling thread
+            top: Number of cProfile functions kept in the report, by cumulative time
+        """
+        self.use_cprofile = use_cprofile
+        self.top = top
+        self.operations: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._token = None
+
+    def add(self, name: str, seconds: float, counters=None):
+        with self._lock:
+            entry = self.operations.get(name)
+            if entry is None:
+                entry = self.operations[name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            if counters:
+                for field in COUNTER_FIELDS:
+                    value = counters[field] if isinstance(counters, dict) else getattr(counters, field)
+                    entry[field] = entry.get(field, 0) + value
+
+    def __enter__(self):
+        self._token = _active.set(self)
+        if self.use_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        _active.reset(self._token)
+
+    def report(self, phases: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        Structured report of the recorded calls
+
+        Args:
+            phases: Phase durations of the sync job
+
+        Returns:
+            {"phases", "operations", "cprofile"}, operations sorted by total time
+        """
+        with self._lock:
+            operations = sorted(self.operations.items(), key=lambda item: item[1]["seconds"], reverse=True)
+            report = {
+                "phases": dict(phases or {}),
+                "operations": {
+                    name: dict(entry, seconds=round(entry["seconds"], 4), max_seconds=round(entry["max_seconds"], 4))
+                    for name, entry in operations
+                },
+            }
+        if self._cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self._cprofile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+            report["cprofile"] = stream.getvalue()
+        return report
+
+
+def save_report(directory: str, job_id: str, report: Dict, keep: int = 50) -> str:
+    """
+    Store a report as JSON for later comparison, keeping the newest `keep` files
+
+    Returns:
+        Path of the written report
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{report['started'].replace(':', '')}_{job_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    for old in list_reports(directory)[keep:]:
+        os.remove(os.path.join(directory, old))
+    return path
+
+def list_reports(directory: str) -> List[str]:
+    """Report file names, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if name.endswith(".json")), reverse=True)
+
+def load_reports(directory: str, limit: int = 10) -> List[Dict]:
+    """Newest reports without their cProfile text, for side-by-side comparison"""
+    reports = []
+    for name in list_reports(directory)[:limit]:
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            report = json.load(f)
+        report.pop("cprofile", None)
+        reports.append(report)
+    return reports
@@ -0,0 +1,197 @@
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from utils import profiling
+from utils.metrics import OKTA_RATE_LIMITED, OKTA_REQUEST_SECONDS, OKTA_RETRIES
+
+# Path segments that look like Okta object ids (00u..., 0oa..., 00g...)
+_ID_SEGMENT = re.compile(r"^[0-9A-Za-z]{15,}$")
+
+
+def endpoint_bucket(url: str) -> str:
+    """
+    Normalize a request URL to the Okta rate limit bucket it counts against
+
+    '/api/v1/users/00u1abcd1234XYZ/appLinks' -> '/api/v1/users/{id}/appLinks'
+    """
+    path = urlsplit(url).path
+    segments = [
+        "{id}" if _ID_SEGMENT.match(segment) and any(c.isdigit() for c in segment) else segment
+        for segment in path.split("/")
+    ]
+    return "/".join(segments) or "/"
+
+
+class _BucketState:
+    __slots__ = ("limit", "remaining", "reset", "next_slot")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = 0.0
+        self.next_slot = 0.0
+
+
+class OktaRateLimiter:
+    def __init__(self, reserve_ratio: float = 0.1, pace_below_ratio: float = 0.5,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        Pace Okta requests from the X-Rate-Limit-* response headers
+
+        Requests go out unthrottled while a bucket has plenty of budget left. Once the
+        remaining budget drops below pace_below_ratio of the limit, requests are spread
+        evenly over the time left until the reset, keeping reserve_ratio of the limit
+        untouched for other clients of the org.
+
+        Args:
+            reserve_ratio: Fraction of each bucket's limit that is never used
+            pace_below_ratio: Fraction of the limit below which requests are spaced out
+            base_backoff: Base delay in seconds for 429 retries without a hint
+            max_backoff: Upper bound in seconds for a single backoff
+        """
+        self.reserve_ratio = reserve_ratio
+        self.pace_below_ratio = pace_below_ratio
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._buckets: Dict[str, _BucketState] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, bucket: str):
+        """Block until a request against bucket may be sent"""
+        wait = self.reserve(bucket)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, bucket: str) -> float:
+        """
+        Claim a request slot against bucket without blocking
+
+        Returns:
+            Seconds the caller must wait before sending, for callers that cannot sleep the thread
+        """
+        with self._lock:
+            state = self._buckets.setdefault(bucket, _BucketState())
+            now = time.time()
+            if state.reset and now >= state.reset:
+                # Window rolled over, the next response will tell us the new budget
+                state.remaining = None
+                state.reset = 0.0
+
+            slot = max(now, state.next_slot)
+            if state.remaining is not None and state.limit:
+                reserve = int(state.limit * self.reserve_ratio)
+                usable = state.remaining - reserve
+                if usable <= 0:
+                    # Budget spent, hold until the window resets. The jitter spreads the
+                    # waiting threads out but is not chained, so waiters do not stack up.
+                    slot = max(slot, state.reset) + random.uniform(0, self.base_backoff)
+                elif state.remaining < state.limit * self.pace_below_ratio:
+                    slot += max(0.0, state.reset - now) / usable
+                    state.next_slot = slot
+                # Count this request against the budget before its response arrives,
+                # so concurrent threads do not all spend the same remaining requests
+                state.remaining -= 1
+            return slot - now
+
+    def update(self, bucket: str, response: requests.Response):
+        """Record the budget reported by the X-Rate-Limit-* headers of a response"""
+        limit = _int_header(response, "X-Rate-Limit-Limit")
+        remaining = _int_header(response, "X-Rate-Limit-Remaining")
+        reset = _int_header(response, "X-Rate-Limit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            state = self._buckets.setdefault(bucket, _BucketState())
+            state.limit = limit or state.limit or remaining
+            # Responses can arrive out of order, keep the lowest remaining of a window
+            if state.remaining is None or reset > state.reset:
+                state.remaining = remaining
+            else:
+                state.remaining = min(state.remaining, remaining)
+            state.reset = float(reset)
+
+    def backoff(self, bucket: str, response: requests.Response, attempt: int) -> float:
+        """
+        Compute the delay before retrying a 429 response and hold the bucket until then
+
+        Args:
+            bucket: Rate limit bucket of the request
+            response: The 429 response
+            attempt: Zero-based retry attempt
+
+        Returns:
+            Seconds to wait before the retry
+        """
+        now = time.time()
+        retry_after = _int_header(response, "Retry-After")
+        reset = _int_header(response, "X-Rate-Limit-Reset")
+        if retry_after is not None:
+            hint = float(retry_after)
+        elif reset is not None:
+            hint = max(0.0, reset - now)
+        else:
+            hint = 0.0
+        exponential = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        delay = min(self.max_backoff, max(hint, exponential * 0.5) + random.uniform(0, exponential * 0.5))
+
+        # Hold the bucket for exactly the backoff, the 429 is the freshest word on the
+        # budget even if an earlier response reported a later window reset
+        with self._lock:
+            state = self._buckets.setdefault(bucket, _BucketState())
+            state.remaining = 0
+            state.reset = now + delay
+            state.next_slot = max(state.next_slot, now + delay)
+        return delay
+
+
+def _int_header(response: requests.Response, name: str) -> Optional[int]:
+    value = response.headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+class RateLimitedSession(requests.Session):
+    def __init__(self, limiter: Optional[OktaRateLimiter] = None, max_retries: int = 5):
+        """
+        requests.Session that paces every request through an OktaRateLimiter
+        and retries 429 responses with jittered backoff
+
+        Args:
+            limiter: Shared limiter, a new one is created when omitted
+            max_retries: Number of retries for a 429 response before it is returned
+        """
+        super().__init__()
+        self.limiter = limiter or OktaRateLimiter()
+        self.max_retries = max_retries
+
+    def request(self, method, url, *args, **kwargs):
+        bucket = endpoint_bucket(url)
+        attempt = 0
+        while True:
+            self.limiter.acquire(bucket)
+            started = time.perf_counter()
+            response = super().request(method, url, *args, **kwargs)
+            elapsed = time.perf_counter() - started
+            OKTA_REQUEST_SECONDS.observe(elapsed, endpoint=bucket)
+            profiling.record(f"okta {bucket}", elapsed)
+            self.limiter.update(bucket, response)
+            if response.status_code == 429:
+                OKTA_RATE_LIMITED.inc(endpoint=bucket)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            OKTA_RETRIES.inc(endpoint=bucket)
+            delay = self.limiter.backoff(bucket, response, attempt)
+            print(f"Okta rate limit hit on {bucket}, retrying in {delay:.2f}s (attempt {attempt+1}/{self.max_retries})")
+            response.close()
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,259 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+from utils.batchwriter import app_key, app_to_row, user_to_row
+from utils.okta_factory import UnchangedAppLinks
+
+USER_FIELDS = list(user_to_row({"id": ""}).keys())
+APP_FIELDS = list(app_to_row({}).keys())
+
+
+# Neo4j transaction functions - bulk reads of the current graph
+def read_users_state(tx):
+    """Return {user_id: row} for every User node, with the fields written by user_to_row()"""
+    query = f"""
+    MATCH (u:User)
+    RETURN u {{ {", ".join("." + field for field in USER_FIELDS)} }} AS row
+    """
+    return {record["row"]["id"]: record["row"] for record in tx.run(query)}
+
+def read_apps_state(tx):
+    """Return {app_id: row} for every Application node, with the fields written by app_to_row()"""
+    query = f"""
+    MATCH (a:Application)
+    RETURN a {{ {", ".join("." + field for field in APP_FIELDS)} }} AS row
+    """
+    return {record["row"]["id"]: record["row"] for record in tx.run(query)}
+
+def read_user_apps_state(tx):
+    """Return {user_id: set(app_ids)} for every USES relationship"""
+    query = """
+    MATCH (u:User)-[:USES]->(a:Application)
+    RETURN u.id AS user_id, collect(a.id) AS app_ids
+    """
+    return {record["user_id"]: set(record["app_ids"]) for record in tx.run(query)}
+
+
+class DeletionCapExceeded(Exception):
+    """Raised instead of deleting when a sync would remove an implausible share of the graph"""
+
+
+class GraphState:
+    def __init__(self, users: Dict[str, Dict], apps: Dict[str, Dict], user_apps: Dict[str, Set[str]]):
+        """
+        Snapshot of the User/Application/USES graph as currently stored in Neo4j
+
+        Args:
+            users: user_id -> stored user row
+            apps: app_id -> stored application row
+            user_apps: user_id -> set of app ids the user USES
+        """
+        self.users = users
+        self.apps = apps
+        self.user_apps = user_apps
+
+    @classmethod
+    def load(cls, session) -> "GraphState":
+        """Read the whole graph state with three bulk queries"""
+        return cls(
+            session.read_transaction(read_users_state),
+            session.read_transaction(read_apps_state),
+            session.read_transaction(read_user_apps_state),
+        )
+
+
+class GraphDelta:
+    def __init__(self):
+        """Changes needed to bring the graph in line with an Okta snapshot"""
+        self.users_to_write: List[Dict] = []
+        self.users_added = 0
+        self.user_ids_to_delete: List[str] = []
+        self.apps_to_write: List[Dict] = []
+        self.apps_added = 0
+        self.app_ids_to_delete: List[str] = []
+        self.edges_to_add: List[Dict] = []
+        self.edges_to_delete: List[Dict] = []
+
+    def counts(self) -> Dict:
+        """Delta sizes for the /syncusers response"""
+        return {
+            "users_added": self.users_added,
+            "users_updated": len(self.users_to_write) - self.users_added,
+            "users_deleted": len(self.user_ids_to_delete),
+            "applications_added": self.apps_added,
+            "applications_updated": len(self.apps_to_write) - self.apps_added,
+            "applications_deleted": len(self.app_ids_to_delete),
+            "relationships_added": len(self.edges_to_add),
+            "relationships_deleted": len(self.edges_to_delete),
+        }
+
+    def extend(self, other: "GraphDelta"):
+        """Append the changes of another delta to this one"""
+        self.users_to_write.extend(other.users_to_write)
+        self.users_added += other.users_added
+        self.user_ids_to_delete.extend(other.user_ids_to_delete)
+        self.apps_to_write.extend(other.apps_to_write)
+        self.apps_added += other.apps_added
+        self.app_ids_to_delete.extend(other.app_ids_to_delete)
+        self.edges_to_add.extend(other.edges_to_add)
+        self.edges_to_delete.extend(other.edges_to_delete)
+
+
+class GraphDiffer:
+    def __init__(self, state: GraphState, final_app_ids: Optional[Set[str]] = None):
+        """
+        Compare an Okta snapshot with the stored graph one batch of users at a time
+
+        add() returns the writes for each batch as it arrives. finish() returns the
+        nodes to delete, which are only known once every batch has been seen.
+
+        Args:
+            state: Current graph from GraphState.load()
+            final_app_ids: Every app id of the snapshot, when known up front. Used to skip
+                           deleting edges of apps that will be detach-deleted anyway.
+        """
+        self.state = state
+        self.final_app_ids = final_app_ids
+        self.seen_users: Set[str] = set()
+        self.seen_apps: Set[str] = set()
+        # Apps only linked from already applied appLinks payloads, their rows are not re-diffed
+        self.unchanged_apps: Set[str] = set()
+
+    def add(self, users: Iterable[Dict], user_apps: Dict[str, List[Dict]]) -> GraphDelta:
+        """
+        Diff a batch of users and their appLinks
+
+        Args:
+            users: Active Okta users of this batch
+            user_apps: user_id -> appLinks for the users of this batch. UnchangedAppLinks
+                       skip the application rows, only their relationships are compared.
+
+        Returns:
+            GraphDelta with the node and relationship writes for this batch
+        """
+        delta = GraphDelta()
+        state = self.state
+
+        batch_user_ids = []
+        for user in users:
+            row = user_to_row(user)
+            batch_user_ids.append(row["id"])
+            self.seen_users.add(row["id"])
+            stored = state.users.get(row["id"])
+            if stored is None:
+                delta.users_added += 1
+                delta.users_to_write.append(row)
+            elif stored != row:
+                delta.users_to_write.append(row)
+
+        parsed = {}
+        for user_id, apps in user_apps.items():
+            if isinstance(apps, UnchangedAppLinks):
+                app_ids = [app_key(app) for app in apps]
+                if all(app_id in state.apps for app_id in app_ids):
+                    self.unchanged_apps.update(app_ids)
+                    continue
+                # The graph lost an app of this payload since it was applied
+                apps = apps.load()
+            parsed[user_id] = apps
+
+        for apps in parsed.values():
+            for app in apps:
+                if app_key(app) in self.seen_apps:
+                    continue
+                row = app_to_row(app)
+                self.seen_apps.add(row["id"])
+                stored = state.apps.get(row["id"])
+                if stored is None:
+                    delta.apps_added += 1
+                    delta.apps_to_write.append(row)
+                elif stored != row:
+                    delta.apps_to_write.append(row)
+
+        for user_id in batch_user_ids:
+            wanted = {app_key(app) for app in user_apps.get(user_id, [])}
+            stored = state.user_apps.get(user_id, set())
+            for app_id in wanted - stored:
+                delta.edges_to_add.append({"user_id": user_id, "app_id": app_id})
+            for app_id in stored - wanted:
+                # Edges of apps leaving the graph go with their DETACH DELETE
+                if self.final_app_ids is None or app_id in self.final_app_ids:
+                    delta.edges_to_delete.append({"user_id": user_id, "app_id": app_id})
+
+        return delta
+
+    def finish(self) -> GraphDelta:
+        """Return the users and apps stored in the graph but never seen in any batch"""
+        delta = GraphDelta()
+        delta.user_ids_to_delete = sorted(set(self.state.users) - self.seen_users)
+        delta.app_ids_to_delete = sorted(set(self.state.apps) - self.seen_apps - self.unchanged_apps)
+        return delta
+
+
+def diff_graph(state: GraphState, users: Iterable[Dict], user_apps: Dict[str, List[Dict]]) -> GraphDelta:
+    """
+    Compare a complete Okta snapshot with the stored graph
+
+    Args:
+        state: Current graph from GraphState.load()
+        users: Active Okta users
+        user_apps: user_id -> appLinks from OktaFactory.get_apps_for_users()
+
+    Returns:
+        GraphDelta holding only the rows that differ
+    """
+    app_ids = {app_key(app) for apps in user_apps.values() for app in apps}
+    differ = GraphDiffer(state, app_ids)
+    delta = differ.add(users, user_apps)
+    delta.extend(differ.finish())
+    return delta
+
+
+def check_deletion_cap(state: GraphState, delta: GraphDelta, max_ratio: Optional[float],
+                       min_nodes: int = 100):
+    """
+    Refuse deletions that look like a truncated Okta fetch rather than real offboarding
+
+    Args:
+        state: Graph the deletions were computed against
+        delta: GraphDelta holding user_ids_to_delete and app_ids_to_delete
+        max_ratio: Largest share of stored users or apps that may be deleted, None disables the cap
+        min_nodes: Deletions of fewer nodes than this are always allowed
+
+    Raises:
+        DeletionCapExceeded: If either label would lose more than max_ratio of its nodes
+    """
+    if max_ratio is None:
+        return
+    for label, stored, to_delete in (("User", len(state.users), len(delta.user_ids_to_delete)),
+                                     ("Application", len(state.apps), len(delta.app_ids_to_delete))):
+        if to_delete < min_nodes or not stored:
+            continue
+        if to_delete / stored > max_ratio:
+            raise DeletionCapExceeded(
+                f"Sync would delete {to_delete} of {stored} {label} nodes, more than {max_ratio:.0%}. "
+                f"Nothing was deleted, check the Okta fetch or raise SYNC_MAX_DELETE_RATIO")
+
+
+def apply_delta(writer, delta: GraphDelta, logger=None) -> Dict:
+    """
+    Write a GraphDelta through a BatchWriter, nodes before relationships
+
+    Returns:
+        The delta counts
+    """
+    counts = delta.counts()
+    if logger:
+        logger.info(f"Reconciliation delta: {counts}")
+    if delta.users_to_write:
+        writer.write_user_rows(delta.users_to_write)
+    if delta.apps_to_write:
+        writer.write_app_rows(delta.apps_to_write)
+    if delta.edges_to_add:
+        writer.write_user_app_rows(delta.edges_to_add)
+    if delta.edges_to_delete:
+        writer.delete_user_app_rows(delta.edges_to_delete)
+    if delta.user_ids_to_delete:
+        writer.delete_users(delta.user_ids_to_delete)
+    if delta.app_ids_to_delete:
+        writer.delete_apps(delta.app_ids_to_delete)
+    return counts
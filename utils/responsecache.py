@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+from utils.metrics import OKTA_CACHE_RESPONSES
+from utils.ratelimiter import OktaRateLimiter, RateLimitedSession, endpoint_bucket
+
+# Single-object reads worth caching, list endpoints page through cursors that change every run
+CACHEABLE_ENDPOINTS = frozenset({"/api/v1/users/{id}", "/api/v1/users/{id}/appLinks"})
+
+# Bumped when callers change what they store with set_summary(), older summaries are dropped.
+# 1: appLinks summaries hold app ids instead of appLink ids
+SUMMARY_VERSION = 1
+
+CachedResponse = namedtuple("CachedResponse", ["etag", "digest", "confirmed_digest", "summary", "body"])
+
+
+class ResponseCache:
+    def __init__(self, path: str):
+        """
+        On-disk cache of Okta response bodies, keyed by URL
+
+        Every entry holds the ETag and the SHA-256 digest of the last body received.
+        confirm() marks the current digests as written to the graph, so a later sync
+        can tell a payload it has already applied from one it has merely downloaded.
+
+        Args:
+            path: SQLite database file, shared by every process of the deployment
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                digest TEXT NOT NULL,
+                confirmed_digest TEXT,
+                summary TEXT,
+                body BLOB NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        """)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SUMMARY_VERSION:
+            self._conn.execute("UPDATE responses SET summary = NULL")
+            self._conn.execute(f"PRAGMA user_version = {SUMMARY_VERSION}")
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, digest, confirmed_digest, summary, body FROM responses WHERE url = ?", (url,)).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def put(self, url: str, etag: Optional[str], digest: str, body: bytes):
+        """Store a body, keeping the confirmed digest and dropping the summary of an older body"""
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO responses (url, etag, digest, body, stored_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag,
+                    summary = CASE WHEN responses.digest = excluded.digest THEN responses.summary END,
+                    digest = excluded.digest,
+                    body = excluded.body,
+                    stored_at = excluded.stored_at
+            """, (url, etag, digest, body, time.time()))
+
+    def set_summary(self, url: str, digest: str, summary: str):
+        """Attach a caller-derived compact form of a body, e.g. the app ids of an appLinks payload"""
+        with self._lock:
+            self._conn.execute("UPDATE responses SET summary = ? WHERE url = ? AND digest = ?", (summary, url, digest))
+
+    def confirm(self) -> int:
+        """Mark every stored body as applied, returns the number of entries that changed"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE responses SET confirmed_digest = digest WHERE confirmed_digest IS NOT digest")
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachingSession(RateLimitedSession):
+    def __init__(self, cache: ResponseCache, limiter: Optional[OktaRateLimiter] = None, max_retries: int = 5,
+                 cacheable=CACHEABLE_ENDPOINTS):
+        """
+        RateLimitedSession answering single-object GETs through a ResponseCache
+
+        Requests for a cached URL carry If-None-Match, and a 304 is turned into a 200
+        with the cached body. Every cached response gets two extra attributes:
+        content_digest, the SHA-256 of its body, and unchanged, True when that digest
+        is the one confirmed by the last successful sync.
+
+        Args:
+            cache: Shared ResponseCache
+            limiter: Shared limiter, a new one is created when omitted
+            max_retries: Number of retries for a 429 response before it is returned
+            cacheable: Endpoint buckets, as returned by endpoint_bucket(), that are cached
+        """
+        super().__init__(limiter, max_retries)
+        self.cache = cache
+        self.cacheable = cacheable
+
+    def request(self, method, url, *args, **kwargs):
+        bucket = endpoint_bucket(url)
+        if method.upper() != "GET" or args or kwargs.get("params") or bucket not in self.cacheable:
+            return super().request(method, url, *args, **kwargs)
+
+        entry = self.cache.get(url)
+        if entry is not None and entry.etag:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), "If-None-Match": entry.etag}
+        response = super().request(method, url, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            OKTA_CACHE_RESPONSES.inc(endpoint=bucket, result="not_modified")
+            response.status_code = 200
+            response._content = entry.body
+            digest = entry.digest
+        elif response.status_code == 200:
+            digest = hashlib.sha256(response.content).hexdigest()
+            etag = response.headers.get("ETag")
+            if entry is None or entry.digest != digest or entry.etag != etag:
+                self.cache.put(url, etag, digest, response.content)
+            OKTA_CACHE_RESPONSES.inc(endpoint=bucket, result="same" if entry and entry.digest == digest else "changed")
+        else:
+            return response
+
+        response.content_digest = digest
+        response.unchanged = entry is not None and entry.confirmed_digest == digest
+        response.cache_summary = entry.summary if entry is not None and entry.digest == digest else None
+        return response
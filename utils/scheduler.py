@@ -0,0 +1,51 @@
+import random
+import threading
+from typing import Callable, Optional
+
+
+class SyncScheduler:
+    def __init__(self, trigger: Callable[[], None], interval_seconds: float, jitter_seconds: float = 0,
+                 logger=None):
+        """
+        Trigger a sync periodically from a background thread
+
+        Each process runs its own scheduler. The jitter spreads the triggers of several
+        gunicorn workers apart, and the sync lease makes sure only one of them syncs.
+
+        Args:
+            trigger: Called at every tick, e.g. submitting an 'auto' sync to the job runner
+            interval_seconds: Time between ticks
+            jitter_seconds: Random delay of up to this many seconds added to every tick
+            logger: Optional logger
+        """
+        self.trigger = trigger
+        self.interval = interval_seconds
+        self.jitter = jitter_seconds
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="sync-scheduler", daemon=True)
+            self._thread.start()
+            if self.logger:
+                self.logger.info(f"Sync scheduler started, every {self.interval}s with up to {self.jitter}s jitter")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next_delay(self) -> float:
+        return self.interval + random.uniform(0, self.jitter)
+
+    def _loop(self):
+        while not self._stop.wait(self.next_delay()):
+            try:
+                self.trigger()
+            except Exception as e:
+                # A failed tick must not end the schedule
+                if self.logger:
+                    self.logger.error(f"Scheduled sync trigger failed. error is {e}", exc_info=True)
@@ -0,0 +1,163 @@
+from typing import Dict, List
+
+from utils.batchwriter import chunked
+from utils.syncusersutils import remove_duplicate_nodes
+
+# Uniqueness constraints also create the index backing MERGE/MATCH on id
+CONSTRAINTS = [
+    ("user_id_unique", "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE"),
+    ("application_id_unique", "CREATE CONSTRAINT application_id_unique IF NOT EXISTS FOR (a:Application) REQUIRE a.id IS UNIQUE"),
+    ("syncstate_id_unique", "CREATE CONSTRAINT syncstate_id_unique IF NOT EXISTS FOR (s:SyncState) REQUIRE s.id IS UNIQUE"),
+    ("group_id_unique", "CREATE CONSTRAINT group_id_unique IF NOT EXISTS FOR (g:Group) REQUIRE g.id IS UNIQUE"),
+    ("synclease_id_unique", "CREATE CONSTRAINT synclease_id_unique IF NOT EXISTS FOR (l:SyncLease) REQUIRE l.id IS UNIQUE"),
+]
+
+INDEXES = [
+    ("user_last_updated", "CREATE INDEX user_last_updated IF NOT EXISTS FOR (u:User) ON (u.lastUpdated)"),
+    ("user_email", "CREATE INDEX user_email IF NOT EXISTS FOR (u:User) ON (u.email)"),
+    # rekey_applications() finds appLink-keyed nodes by their Okta app id
+    ("application_instance_id", "CREATE INDEX application_instance_id IF NOT EXISTS FOR (a:Application) ON (a.appInstanceId)"),
+]
+
+# Labels whose id uniqueness makes remove_duplicate_nodes unnecessary
+UNIQUE_ID_LABELS = ["User", "Application"]
+
+
+# Neo4j transaction functions
+def read_constraints(tx) -> List[Dict]:
+    """List existing constraints"""
+    query = """
+    SHOW CONSTRAINTS YIELD name, type, labelsOrTypes, properties
+    RETURN name, type, labelsOrTypes, properties
+    """
+    return [record.data() for record in tx.run(query)]
+
+def read_indexes(tx) -> List[Dict]:
+    """List existing indexes with their population state"""
+    query = """
+    SHOW INDEXES YIELD name, type, labelsOrTypes, properties, state, populationPercent
+    RETURN name, type, labelsOrTypes, properties, state, populationPercent
+    """
+    return [record.data() for record in tx.run(query)]
+
+def read_link_keyed_app_ids(tx) -> List[str]:
+    """Return the Okta app ids of Application nodes still keyed by an appLink id"""
+    query = """
+    MATCH (a:Application)
+    WHERE a.appInstanceId IS NOT NULL AND a.appInstanceId <> '' AND a.id <> a.appInstanceId
+    RETURN DISTINCT a.appInstanceId AS id
+    """
+    return [record["id"] for record in tx.run(query)]
+
+def merge_link_keyed_apps(tx, app_ids) -> int:
+    """Fold the appLink-keyed nodes of a batch of apps into the node keyed by their Okta app id"""
+    query = """
+    UNWIND $app_ids AS app_id
+    MATCH (old:Application {appInstanceId: app_id})
+    WHERE old.id <> app_id
+    WITH app_id, collect(old) AS olds
+    MERGE (a:Application {id: app_id})
+    ON CREATE SET a += olds[0] {.*, id: app_id}
+    WITH a, olds
+    UNWIND olds AS old
+    CALL {
+        WITH a, old
+        MATCH (u:User)-[r:USES]->(old)
+        MERGE (u)-[moved:USES]->(a)
+        ON CREATE SET moved += properties(r)
+        RETURN count(*) AS uses
+    }
+    CALL {
+        WITH a, old
+        MATCH (g:Group)-[:GRANTS]->(old)
+        MERGE (g)-[:GRANTS]->(a)
+        RETURN count(*) AS grants
+    }
+    DETACH DELETE old
+    RETURN count(*) AS merged
+    """
+    return tx.run(query, app_ids=app_ids).single()["merged"]
+
+
+def rekey_applications(session, logger=None, batch_size: int = 500) -> int:
+    """
+    Key every Application node by its Okta app id
+
+    Graphs written before app_key() keyed the applications of per-user syncs by appLink
+    id. Their nodes are merged into one node per app id, keeping the USES and GRANTS
+    relationships. A graph with nothing left to merge costs a single read.
+
+    Args:
+        session: Open Neo4j session
+        logger: Optional logger
+        batch_size: Number of apps merged per transaction
+
+    Returns:
+        Number of appLink-keyed nodes merged away
+    """
+    app_ids = session.read_transaction(read_link_keyed_app_ids)
+    merged = 0
+    for chunk in chunked(app_ids, batch_size):
+        merged += session.write_transaction(merge_link_keyed_apps, chunk)
+    if merged and logger:
+        logger.info(f"Merged {merged} appLink-keyed Application nodes into {len(app_ids)} app-keyed nodes")
+    return merged
+
+
+def ensure_schema(session, logger=None) -> Dict:
+    """
+    Idempotently create the uniqueness constraints and lookup indexes the sync relies on
+
+    Existing duplicate User/Application nodes are removed first, because a
+    uniqueness constraint cannot be created while duplicates exist. Application
+    nodes still keyed by an appLink id are merged, see rekey_applications().
+
+    Args:
+        session: Open Neo4j session
+        logger: Optional logger
+
+    Returns:
+        schema_status() after the statements ran
+    """
+    if not uniqueness_enforced(session):
+        for label in UNIQUE_ID_LABELS:
+            if logger:
+                logger.info(f"Removing duplicate {label} nodes before creating constraints")
+            session.write_transaction(remove_duplicate_nodes, label, "id")
+    rekey_applications(session, logger)
+
+    # Schema commands cannot share a transaction with data writes, run each on its own
+    for name, statement in CONSTRAINTS + INDEXES:
+        session.run(statement).consume()
+        if logger:
+            logger.info(f"Ensured schema object {name}")
+
+    status = schema_status(session)
+    if logger:
+        for index in status["indexes"]:
+            logger.info(f"Index {index['name']} on {index['labelsOrTypes']}{index['properties']}: "
+                        f"{index['state']} ({index['populationPercent']}%)")
+    return status
+
+
+def schema_status(session) -> Dict:
+    """Report constraints and indexes, and whether every expected one is online"""
+    constraints = session.read_transaction(read_constraints)
+    indexes = session.read_transaction(read_indexes)
+    existing = {c["name"] for c in constraints} | {i["name"] for i in indexes if i["state"] == "ONLINE"}
+    expected = [name for name, _ in CONSTRAINTS + INDEXES]
+    return {
+        "constraints": constraints,
+        "indexes": indexes,
+        "missing": [name for name in expected if name not in existing],
+    }
+
+
+def uniqueness_enforced(session) -> bool:
+    """True when User.id and Application.id are both backed by uniqueness constraints"""
+    constrained = {
+        tuple(c["labelsOrTypes"] or []) + tuple(c["properties"] or [])
+        for c in session.read_transaction(read_constraints)
+        if c["type"] == "UNIQUENESS"
+    }
+    return all((label, "id") in constrained for label in UNIQUE_ID_LABELS)
@@ -0,0 +1,208 @@
+import gzip
+import json
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.batchwriter import app_key, app_to_row, user_to_row
+from utils.reconcile import APP_FIELDS, USER_FIELDS
+
+SNAPSHOT_VERSION = 1
+
+
+class AppRecord:
+    __slots__ = ("id", "label", "linkUrl", "appName", "logoUrl", "status", "signOnMode",
+                 "appInstanceId", "sortOrder")
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def to_app_link(self) -> Dict:
+        """Okta appLink shape, as returned by /api/v1/users/{id}/appLinks"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class UserRecord:
+    __slots__ = ("id", "firstName", "lastName", "email", "login", "status", "created",
+                 "lastLogin", "lastUpdated", "app_ids")
+
+    def __init__(self, *values, app_ids: Optional[array] = None):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+        # Indexes into Snapshot.apps, 4 bytes per assignment instead of a copied dict
+        self.app_ids = app_ids if app_ids is not None else array("I")
+
+    def to_okta_user(self) -> Dict:
+        """Okta user shape, as returned by /api/v1/users"""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created": self.created,
+            "lastLogin": self.lastLogin,
+            "lastUpdated": self.lastUpdated,
+            "profile": {
+                "firstName": self.firstName,
+                "lastName": self.lastName,
+                "email": self.email,
+                "login": self.login,
+            },
+        }
+
+
+# The records hold exactly the fields the row builders write to Neo4j, checked without
+# assert so the check also runs under python -O
+if list(AppRecord.__slots__) != APP_FIELDS or list(UserRecord.__slots__[:-1]) != USER_FIELDS:
+    raise RuntimeError("Snapshot record fields are out of sync with app_to_row()/user_to_row(), "
+                       f"expected {APP_FIELDS} and {USER_FIELDS}")
+
+
+class Snapshot:
+    def __init__(self, created: Optional[str] = None):
+        """
+        Compact in-memory copy of the Okta users and their app assignments
+
+        Every application is stored once in an interned table and users reference it by
+        index, instead of repeating the full appLink dict for each assignment.
+
+        Args:
+            created: When the data was read from Okta, defaults to now
+        """
+        self.created = created or datetime.now(timezone.utc).isoformat()
+        self.apps: List[AppRecord] = []
+        self.users: List[UserRecord] = []
+        self._app_index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def add(self, user: Dict, app_links: List[Dict]):
+        """
+        Add an Okta user with their appLinks
+
+        Args:
+            user: Okta user object
+            app_links: appLinks of that user
+        """
+        row = user_to_row(user)
+        record = UserRecord(*(row[field] for field in USER_FIELDS))
+        for app in app_links:
+            record.app_ids.append(self._intern_app(app))
+        self.users.append(record)
+
+    def app_links(self, user: UserRecord) -> List[Dict]:
+        return [self.apps[index].to_app_link() for index in user.app_ids]
+
+    def _intern_app(self, app: Dict) -> int:
+        index = self._app_index.get(app_key(app))
+        if index is None:
+            row = app_to_row(app)
+            index = len(self.apps)
+            self.apps.append(AppRecord(*(row[field] for field in APP_FIELDS)))
+            self._app_index[row["id"]] = index
+        return index
+
+    def save(self, path: str):
+        """Write the snapshot as gzip-compressed columnar JSON"""
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "created": self.created,
+            "app_fields": APP_FIELDS,
+            "apps": [[getattr(app, field) for field in APP_FIELDS] for app in self.apps],
+            "user_fields": USER_FIELDS,
+            "users": [[getattr(user, field) for field in USER_FIELDS] + [user.app_ids.tolist()]
+                      for user in self.users],
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "Snapshot":
+        """
+        Read a snapshot written by save()
+
+        Raises:
+            ValueError: If the file has an unknown version or field layout
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {data.get('version')}")
+        if data["app_fields"] != APP_FIELDS or data["user_fields"] != USER_FIELDS:
+            raise ValueError("Snapshot fields do not match this version of the sync")
+
+        snapshot = cls(data["created"])
+        for index, values in enumerate(data["apps"]):
+            app = AppRecord(*values)
+            snapshot.apps.append(app)
+            snapshot._app_index[app.id] = index
+        for values in data["users"]:
+            snapshot.users.append(UserRecord(*values[:-1], app_ids=array("I", values[-1])))
+        return snapshot
+
+    @classmethod
+    def from_okta(cls, okta_factory, logger=None) -> "Snapshot":
+        """Read every active user and their appLinks from Okta, one users page at a time"""
+        snapshot = cls()
+        for page_users in okta_factory.iter_active_user_pages():
+            user_apps = okta_factory.get_apps_for_users(page_users)
+            for user in page_users:
+                snapshot.add(user, user_apps.get(user["id"], []))
+            if logger:
+                logger.info(f"Snapshot holds {len(snapshot.users)} users and {len(snapshot.apps)} applications")
+        return snapshot
+
+    @classmethod
+    def from_json(cls, users_path: str, user_apps_path: str) -> "Snapshot":
+        """
+        Build a snapshot from raw Okta JSON files, such as the ones in dummydata/
+
+        Args:
+            users_path: JSON list of Okta users
+            user_apps_path: JSON object of user_id -> appLinks
+        """
+        with open(users_path, "r", encoding="utf-8") as f:
+            users = json.load(f)
+        with open(user_apps_path, "r", encoding="utf-8") as f:
+            user_apps = json.load(f)
+        snapshot = cls()
+        for user in users:
+            snapshot.add(user, user_apps.get(user["id"], []))
+        return snapshot
+
+
+class SnapshotSource:
+    def __init__(self, snapshot: Snapshot):
+        """
+        Serve a snapshot through the OktaFactory methods used by SyncPipeline
+
+        Lets a full sync replay a snapshot into Neo4j without calling Okta.
+
+        Args:
+            snapshot: Loaded Snapshot
+        """
+        self.snapshot = snapshot
+        self._by_id = {user.id: user for user in snapshot.users}
+
+    def iter_active_user_pages_with_cursor(self, resume_url: Optional[str] = None,
+                                           limit: int = 200) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """Yield (users page, next cursor), the cursor being the offset of the next page"""
+        users = self.snapshot.users
+        start = int(resume_url) if resume_url else 0
+        for offset in range(start, len(users), limit):
+            end = offset + limit
+            yield [user.to_okta_user() for user in users[offset:end]], (str(end) if end < len(users) else None)
+
+    def iter_active_user_pages(self, limit: int = 200) -> Iterator[List[Dict]]:
+        for page_users, _ in self.iter_active_user_pages_with_cursor(limit=limit):
+            yield page_users
+
+    def get_apps_for_users(self, users: List[Dict], max_workers: Optional[int] = None,
+                           progress_callback=None) -> Dict[str, List[Dict]]:
+        user_apps = {user["id"]: self.snapshot.app_links(self._by_id[user["id"]]) for user in users}
+        if progress_callback:
+            progress_callback(len(user_apps))
+        return user_apps
+
+    def close(self):
+        pass
@@ -0,0 +1,188 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.metrics import SYNC_LAST_SUCCESS, SYNC_PHASE_SECONDS, SYNC_RUNS
+
+
+class SyncSkipped(Exception):
+    """Raised by a sync target that found nothing to do, e.g. another process holds the sync lease"""
+
+
+class SyncJob:
+    def __init__(self, mode: str):
+        """
+        Status of one background sync run
+
+        Args:
+            mode: Requested sync mode
+        """
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.status = "queued"
+        self.phase = None
+        self.counters = {}
+        self.phase_durations = {}
+        self.result = None
+        self.error = None
+        self.created = _now()
+        self.started = None
+        self.finished = None
+        self._phase_started = None
+        self._lock = threading.Lock()
+
+    def start_phase(self, name: str):
+        """Close the current phase, recording its duration, and open a new one"""
+        with self._lock:
+            self._close_phase()
+            self.phase = name
+            self._phase_started = time.perf_counter()
+
+    def set_counter(self, name: str, value: int):
+        with self._lock:
+            self.counters[name] = value
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            durations = dict(self.phase_durations)
+            if self._phase_started is not None:
+                durations[self.phase] = round(time.perf_counter() - self._phase_started, 3)
+            return {
+                "job_id": self.id,
+                "mode": self.mode,
+                "status": self.status,
+                "phase": self.phase,
+                "counters": dict(self.counters),
+                "phase_durations": durations,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "result": self.result,
+                "error": self.error,
+            }
+
+    def _close_phase(self):
+        if self._phase_started is not None:
+            elapsed = time.perf_counter() - self._phase_started
+            self.phase_durations[self.phase] = round(self.phase_durations.get(self.phase, 0) + elapsed, 3)
+            SYNC_PHASE_SECONDS.observe(elapsed, phase=self.phase)
+            self._phase_started = None
+
+    def _mark_running(self):
+        with self._lock:
+            self.status = "running"
+            self.started = _now()
+
+    def _mark_finished(self, result: Optional[Dict] = None, error: Optional[str] = None,
+                       status: Optional[str] = None):
+        with self._lock:
+            self._close_phase()
+            self.phase = None
+            self.status = status or ("failed" if error else "succeeded")
+            self.result = result
+            self.error = error
+            self.finished = _now()
+
+
+class SyncJobRunner:
+    def __init__(self, max_history: int = 50, logger=None):
+        """
+        Run sync jobs one at a time on a background thread
+
+        Args:
+            max_history: Number of finished jobs kept for status lookups
+            logger: Optional logger for job failures
+        """
+        self.max_history = max_history
+        self.logger = logger
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync-job")
+        self._jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+        self._active: Optional[SyncJob] = None
+        self._lock = threading.Lock()
+
+    def submit(self, target: Callable[[SyncJob], Dict], mode: str) -> Tuple[SyncJob, bool]:
+        """
+        Queue a sync unless one is already queued or running
+
+        Args:
+            target: Function running the sync, called with the SyncJob and returning the result dict
+            mode: Requested sync mode, recorded on the job
+
+        Returns:
+            (job, created) - the new job, or the job already in progress with created=False
+        """
+        with self._lock:
+            if self._active is not None:
+                return self._active, False
+            job = SyncJob(mode)
+            self._active = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_history:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, target)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @property
+    def active(self) -> Optional[SyncJob]:
+        return self._active
+
+    def _run(self, job: SyncJob, target: Callable[[SyncJob], Dict]):
+        try:
+            run_job(job, target, self.logger)
+        finally:
+            with self._lock:
+                self._active = None
+
+
+def run_job(job: SyncJob, target: Callable[[SyncJob], Dict], logger=None, reraise: bool = False) -> Optional[Dict]:
+    """
+    Run a sync target for a job, keeping the job status, phases and sync metrics
+
+    Args:
+        job: Job to run, marked running before the target is called
+        target: Function running the sync, called with the SyncJob and returning the result dict
+        logger: Optional logger for job failures
+        reraise: Raise failures and skips after recording them, for foreground runs
+
+    Returns:
+        The target's result, None when the job failed or was skipped
+    """
+    job._mark_running()
+    try:
+        result = target(job)
+    except SyncSkipped as e:
+        if logger:
+            logger.info(f"Sync job {job.id} skipped: {e}")
+        job._mark_finished(error=str(e), status="skipped")
+        SYNC_RUNS.inc(status="skipped")
+        if reraise:
+            raise
+        return None
+    except Exception as e:
+        if logger:
+            logger.error(f"Sync job {job.id} failed: {e}", exc_info=True)
+        job._mark_finished(error=str(e))
+        SYNC_RUNS.inc(status="failed")
+        if reraise:
+            raise
+        return None
+    job._mark_finished(result=result)
+    SYNC_RUNS.inc(status="succeeded")
+    SYNC_LAST_SUCCESS.set(time.time())
+    return result
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
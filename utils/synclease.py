@@ -0,0 +1,145 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+
+# Neo4j transaction functions
+def acquire_lease(tx, name: str, holder: str, now: float, ttl: float) -> bool:
+    """Take the named lease if it is free, expired or already ours"""
+    query = """
+    MERGE (l:SyncLease {id: $name})
+    // Writing first takes the node's write lock, so the check below sees the last committed holder
+    SET l.lockedAt = $now
+    WITH l
+    WHERE l.holder IS NULL OR l.expires < $now OR l.holder = $holder
+    SET l.holder = $holder,
+        l.expires = $now + $ttl
+    RETURN l.holder AS holder
+    """
+    return tx.run(query, name=name, holder=holder, now=now, ttl=ttl).single() is not None
+
+def renew_lease(tx, name: str, holder: str, now: float, ttl: float) -> bool:
+    """Push back the expiry of a lease we hold"""
+    query = """
+    MATCH (l:SyncLease {id: $name})
+    WHERE l.holder = $holder
+    SET l.expires = $now + $ttl
+    RETURN l.holder AS holder
+    """
+    return tx.run(query, name=name, holder=holder, now=now, ttl=ttl).single() is not None
+
+def release_lease(tx, name: str, holder: str):
+    """Free a lease we hold"""
+    query = """
+    MATCH (l:SyncLease {id: $name})
+    WHERE l.holder = $holder
+    SET l.holder = null, l.expires = null
+    """
+    tx.run(query, name=name, holder=holder)
+
+def get_lease(tx, name: str) -> Optional[Dict]:
+    """Return the holder and expiry of a lease"""
+    query = """
+    MATCH (l:SyncLease {id: $name})
+    RETURN l.holder AS holder, l.expires AS expires
+    """
+    record = tx.run(query, name=name).single()
+    return record.data() if record else None
+
+
+class LeaseLost(Exception):
+    """Raised when a sync keeps writing after its lease expired or was taken over"""
+
+
+class SyncLease:
+    def __init__(self, session_factory: Callable, name: str = "okta", ttl: float = 300, logger=None):
+        """
+        Cluster-wide single-flight lock for syncs, stored as a (:SyncLease) node
+
+        Every gunicorn worker and CLI process shares the Neo4j database, so the lease
+        keeps exactly one sync running across all of them. While held it is renewed by a
+        heartbeat thread, and a holder that dies lets it expire after ttl seconds. A holder
+        whose renewals fail for longer than ttl, or whose lease was taken over, marks the
+        lease lost and check() stops its writes.
+
+        Args:
+            session_factory: Returns a new session, e.g. Neo4jConnection.get_session
+            name: Lease id, one per kind of sync
+            ttl: Seconds the lease stays valid without a renewal
+            logger: Optional logger
+        """
+        self.session_factory = session_factory
+        self.name = name
+        self.ttl = ttl
+        self.logger = logger
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lost = False
+        self._renewed = 0.0
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self) -> bool:
+        """Take the lease and start renewing it, False when another process holds it"""
+        with self.session_factory() as session:
+            acquired = session.write_transaction(acquire_lease, self.name, self.holder, time.time(), self.ttl)
+        if acquired:
+            self.lost = False
+            self._renewed = time.time()
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._renew, name="sync-lease", daemon=True)
+            self._heartbeat.start()
+        return acquired
+
+    def release(self):
+        """Stop renewing and free the lease"""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        with self.session_factory() as session:
+            session.write_transaction(release_lease, self.name, self.holder)
+
+    def check(self):
+        """Raise LeaseLost once the lease can no longer be trusted to be ours"""
+        if self.lost:
+            raise LeaseLost(f"Sync lease {self.name} was lost by {self.holder}, another process may be syncing")
+
+    def current(self) -> Optional[Dict]:
+        """Holder and expiry of an unexpired lease, None when the lease is free"""
+        with self.session_factory() as session:
+            lease = session.read_transaction(get_lease, self.name)
+        if not lease or not lease["holder"] or lease["expires"] < time.time():
+            return None
+        return lease
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                with self.session_factory() as session:
+                    renewed = session.write_transaction(renew_lease, self.name, self.holder, time.time(), self.ttl)
+                if renewed:
+                    self._renewed = time.time()
+                    continue
+                self._mark_lost("it is held by another process")
+                return
+            except Exception as e:
+                # Keep trying until a whole ttl has passed without a renewal
+                if time.time() - self._renewed > self.ttl:
+                    self._mark_lost(f"renewing failed for longer than {self.ttl}s. error is {e}")
+                    return
+                if self.logger:
+                    self.logger.warning(f"Renewing sync lease {self.name} failed. error is {e}")
+
+    def _mark_lost(self, reason: str):
+        self.lost = True
+        if self.logger:
+            self.logger.error(f"Sync lease {self.name} was lost by {self.holder}, {reason}")
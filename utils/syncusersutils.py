@@ -62,33 +62,6 @@ def assign_app_to_user(tx, user_id, app_id):
     """
     tx.run(query, user_id=user_id, app_id=app_id)
 
-def cleanup_users_and_apps(tx, user_ids, app_ids):
-    """Remove users and apps not in the current Okta data"""
-    # Remove users not in Okta
-    query_users = """
-    MATCH (u:User)
-    WHERE NOT u.id IN $user_ids
-    DETACH DELETE u
-    """
-    result_users = tx.run(query_users, user_ids=user_ids)
-    
-    # Remove apps not in Okta
-    query_apps = """
-    MATCH (a:Application)
-    WHERE NOT a.id IN $app_ids
-    DETACH DELETE a
-    """
-    result_apps = tx.run(query_apps, app_ids=app_ids)
-
-def cleanup_user_relationships(tx, user_id, app_list):
-    """Remove relationships for apps no longer assigned to user"""
-    query = """
-    MATCH (u:User {id: $user_id})-[r:USES]->(a:Application)
-    WHERE NOT a.id IN $app_list
-    DELETE r
-    """
-    tx.run(query, user_id=user_id, app_list=app_list)
-
 def remove_duplicate_nodes(tx, label, id_field):
     """Remove duplicate nodes based on ID field"""
     query = f"""
@@ -97,4 +70,81 @@ def remove_duplicate_nodes(tx, label, id_field):
     WHERE size(nodes) > 1
     FOREACH (n IN nodes[1..] | DETACH DELETE n)
     """
-    tx.run(query)
\ No newline at end of file
+    tx.run(query)
+
+
+def get_sync_state(tx, name="okta"):
+    """Return the stored sync bookkeeping (cursor, last full sync) or an empty dict"""
+    query = """
+    MATCH (s:SyncState {id: $name})
+    RETURN s
+    """
+    record = tx.run(query, name=name).single()
+    return dict(record["s"]) if record else {}
+
+def save_sync_state(tx, state, name="okta"):
+    """Store sync bookkeeping properties on the SyncState node"""
+    query = """
+    MERGE (s:SyncState {id: $name})
+    SET s += $state
+    """
+    tx.run(query, name=name, state=state)
+
+def get_user_high_water_mark(tx):
+    """Return the newest Okta lastUpdated written onto a User node"""
+    query = """
+    MATCH (u:User)
+    WHERE u.lastUpdated IS NOT NULL AND u.lastUpdated <> ''
+    RETURN max(u.lastUpdated) AS hwm
+    """
+    record = tx.run(query).single()
+    return record["hwm"] if record else None
+
+def get_user_apps(tx, user_id):
+    """Return the applications a user USES, or None if the user does not exist"""
+    query = """
+    MATCH (u:User {id: $user_id})
+    OPTIONAL MATCH (u)-[:USES]->(a:Application)
+    RETURN u, collect(a) AS apps
+    """
+    record = tx.run(query, user_id=user_id).single()
+    if record is None:
+        return None
+    return [dict(app) for app in record["apps"]]
+
+def get_app_users(tx, app_id):
+    """Return the users of an application, or None if the application does not exist"""
+    query = """
+    MATCH (a:Application {id: $app_id})
+    OPTIONAL MATCH (u:User)-[:USES]->(a)
+    RETURN a, collect(u) AS users
+    """
+    record = tx.run(query, app_id=app_id).single()
+    if record is None:
+        return None
+    return [dict(user) for user in record["users"]]
+
+def get_app_groups(tx, app_id):
+    """Return the groups granting an application, or None if the application does not exist"""
+    query = """
+    MATCH (a:Application {id: $app_id})
+    OPTIONAL MATCH (g:Group)-[:GRANTS]->(a)
+    RETURN a, collect(g) AS groups
+    """
+    record = tx.run(query, app_id=app_id).single()
+    if record is None:
+        return None
+    return [dict(group) for group in record["groups"]]
+
+def get_user_by_email(tx, email):
+    """Return a user looked up by email with their applications, or None"""
+    query = """
+    MATCH (u:User {email: $email})
+    OPTIONAL MATCH (u)-[:USES]->(a:Application)
+    RETURN u, collect(a) AS apps
+    LIMIT 1
+    """
+    record = tx.run(query, email=email).single()
+    if record is None:
+        return None
+    return {"user": dict(record["u"]), "applications": [dict(app) for app in record["apps"]]}